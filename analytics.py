@@ -0,0 +1,297 @@
+import argparse
+import os
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from simulation import (
+    Simulation, MachineType, machine_types, casino_upgrades, fill_floor,
+    UPGRADE_TYPES, MACHINE_UPGRADE_MAX, FPS,
+)
+from crowd import COST_TO_PLAY
+
+# Closed-form machine economics. The stat formulas are the ones in
+# build_stat_table, evaluated as NumPy arrays so every machine type and
+# upgrade-level combination (or every upgrade on offer for a floor) is priced
+# in one pass instead of being played out tick by tick.
+#
+# Per machine, with win chance p, win amount W and cooldown C:
+#   earnings per play   p * W - COST_TO_PLAY   (what total_earnings gains)
+#   play period         C + 1 ticks            (the play tick, then C idle)
+#   plays per visit     (1 - q^3) / (p q^3)    (q = 1 - p; NPCs move on after
+#                                               LOSS_STREAK losses in a row)
+#
+# The floor model sends arriving visitors to machines in MachineIndex order
+# (best value first) until each machine's capacity is used up; every visitor
+# makes `max_machines` visits. Cash running out is not modelled.
+
+LOSS_STREAK = 3
+
+MACHINE_TYPES = list(MachineType)
+TYPE_INDEX = {machine_type: i for i, machine_type in enumerate(MACHINE_TYPES)}
+LEVELS = np.arange(MACHINE_UPGRADE_MAX + 1)
+# 0.9 ** n for every reachable speed + faster_cooldown level
+COOLDOWN_FACTORS = 0.9 ** np.arange(MACHINE_UPGRADE_MAX + casino_upgrades["faster_cooldown"]["max_level"] + 1)
+
+Purchase = namedtuple("Purchase", "kind target key cost gain payback")
+
+def base_stats():
+    # Current machine_types as arrays indexed by TYPE_INDEX
+    return {field: np.array([machine_types[t][field] for t in MACHINE_TYPES])
+            for field in ("win_chance", "win_amount", "cooldown", "cost")}
+
+def machine_stats(types, speed, odds, payout, faster=0, better=0, higher=0, base=None):
+    # (win_chance, win_amount, cooldown) exactly as build_stat_table computes
+    # them; all arguments broadcast against each other
+    base = base or base_stats()
+    cooldown = np.floor(base["cooldown"][types] * COOLDOWN_FACTORS[speed + faster]).astype(np.int64)
+    win_chance = np.minimum(base["win_chance"][types] + (0.05 * (odds + better)), 0.9)
+    win_amount = np.floor(base["win_amount"][types] * (1 + (0.2 * (payout + higher)))).astype(np.int64)
+    return win_chance, win_amount, cooldown
+
+def plays_per_visit(win_chance):
+    # Expected plays before LOSS_STREAK consecutive losses
+    lose = 1 - win_chance
+    with np.errstate(divide="ignore", invalid="ignore"):
+        plays = (1 - lose ** LOSS_STREAK) / (win_chance * lose ** LOSS_STREAK)
+    return np.where(win_chance > 0, plays, LOSS_STREAK)
+
+def expectations(win_chance, win_amount, cooldown):
+    earnings = win_chance * win_amount - COST_TO_PLAY
+    period = cooldown + 1
+    plays = plays_per_visit(win_chance)
+    return {
+        "earnings_per_play": earnings,
+        "revenue_per_tick": earnings / period,
+        "plays_per_visit": plays,
+        "visit_ticks": plays * period,
+        "value": win_chance * win_amount / cooldown,
+    }
+
+def variant_tables(faster, better, higher):
+    # Expectations for every (variant, type, speed, odds, payout), shape
+    # (V, T, L, L, L), where variant v has casino levels faster[v], better[v]
+    # and higher[v]
+    def axis(levels):
+        return np.asarray(levels)[:, None, None, None, None]
+    types = np.arange(len(MACHINE_TYPES))[:, None, None, None]
+    stats = machine_stats(types, LEVELS[:, None, None], LEVELS[:, None], LEVELS,
+                          axis(faster), axis(better), axis(higher))
+    return expectations(*np.broadcast_arrays(*stats))
+
+# Per-machine expectations the floor model needs, in this order
+FIELDS = ("value", "visit_ticks", "plays_per_visit", "earnings_per_play")
+# casino_table() results by casino levels, and the base machine stats they
+# were built from
+_casino_tables = {}
+_casino_tables_base = None
+
+def casino_tables():
+    # The cache of casino tables, emptied if the base machine stats have
+    # changed since it was filled (a balance config was applied)
+    global _casino_tables_base
+    base = tuple((data["win_chance"], data["win_amount"], data["cooldown"]) for data in machine_types.values())
+    if base != _casino_tables_base:
+        _casino_tables.clear()
+        _casino_tables_base = base
+    return _casino_tables
+
+def casino_table(tables, levels):
+    # FIELDS for every (type, speed, odds, payout) at the casino `levels`,
+    # stacked to shape (T, L, L, L, F). Only a handful of level sets ever
+    # come up, so each is built once into `tables` (from casino_tables()).
+    key = (levels["faster_cooldown"], levels["better_odds"], levels["higher_payouts"])
+    table = tables.get(key)
+    if table is None:
+        variants = variant_tables(*([level] for level in key))
+        table = tables[key] = np.stack([variants[field][0] for field in FIELDS], axis=-1)
+    return table
+
+def level_table(levels=None):
+    # Expectations for every (type, speed, odds, payout), shape (T, L, L, L),
+    # for the given casino upgrade levels (default: none bought)
+    levels = levels or dict.fromkeys(casino_upgrades, 0)
+    variants = variant_tables([levels["faster_cooldown"]], [levels["better_odds"]], [levels["higher_payouts"]])
+    table = {key: value[0] for key, value in variants.items()}
+    table["max_machines"] = 2 + levels["more_machines"]
+    table["plays_per_visitor"] = table["plays_per_visit"] * table["max_machines"]
+    return table
+
+def floor_revenue(e, present, arrival_rate, max_machines):
+    # Expected earnings per tick for S floors of up to N machines at once.
+    # `e` holds expectations arrays and `present` which slots hold a machine,
+    # all (S, N); arrival_rate and max_machines broadcast against (S, 1).
+    value = np.where(present, e["value"], -np.inf)
+    order = (np.arange(len(value))[:, None], np.argsort(-value, axis=1, kind="stable"))
+    visit_ticks = e["visit_ticks"][order]
+    plays = e["plays_per_visit"][order]
+    earnings = e["earnings_per_play"][order]
+    capacity = present[order] / visit_ticks
+
+    demand = arrival_rate * max_machines
+    served_before = np.cumsum(capacity, axis=1) - capacity
+    visits = np.clip(demand - served_before, 0, capacity)
+    return (visits * plays * earnings).sum(axis=1)
+
+def changed_revenue(stats, changed, changed_stats, demand):
+    # floor_revenue() of a floor of machines with FIELDS `stats` (N, F) at
+    # the given demand, for K variations of it at once: in variation k
+    # machine changed[k] has changed_stats[k]
+    # instead. Only that machine moves in the fill order, so everyone else
+    # just sees the capacity served before them shift by its old and new
+    # capacity; and since demand runs out a few machines down the order,
+    # only those first few are looked at.
+    value, visit_ticks, plays, earnings = stats.T
+    n = len(value)
+    order = np.argsort(-value, kind="stable")
+    key = -value[order]
+    capacity = 1 / visit_ticks[order]
+    per_visit = (plays * earnings)[order]
+    prefix = np.concatenate([[0], np.cumsum(capacity)])
+    served = prefix[:-1]
+
+    new_value, new_visit_ticks, new_plays, new_earnings = changed_stats.T
+    new_capacity = 1 / new_visit_ticks
+    # Where the changed machine was in the order...
+    rank = np.empty(n, np.int64)
+    rank[order] = np.arange(n)
+    was = rank[changed]
+    removed_capacity = capacity[was]
+    # ...and where it goes: after every machine of higher value and those of
+    # equal value placed before it. Ties are in placement order, so
+    # (start of the tie, index) rises along the order too.
+    at = np.searchsorted(key, -new_value, "left")
+    tied = np.searchsorted(key, -new_value, "right") > at
+    tie_key = np.searchsorted(key, key, "left") * (n + 1) + order
+    at[tied] = np.searchsorted(tie_key, at[tied] * (n + 1) + changed[tied])
+    before = prefix[at] - (was < at) * removed_capacity
+    own = np.clip(demand - before, 0, new_capacity) * new_plays * new_earnings
+
+    # Past these positions demand is used up even with the changed machine
+    # taken out of the way
+    count = np.searchsorted(served, demand + capacity.max(initial=0))
+    positions = np.arange(count)
+    shifted = (served[:count] - (positions > was[:, None]) * removed_capacity[:, None]
+               + (positions >= at[:, None]) * new_capacity[:, None])
+    visits = np.clip(demand - shifted, 0, capacity[:count])
+    visits[positions == was[:, None]] = 0
+    return visits @ per_visit[:count] + own
+
+def price_options(game):
+    # Every machine and casino upgrade available right now (what
+    # Machine.upgrade and buy_casino_upgrade sell), priced by the floor's
+    # expected earnings per tick with it against without. Returns the
+    # options as (kind, target, key) tuples with arrays of cost, gain per
+    # tick and payback ticks.
+    machines = game.machines
+    n = len(machines)
+    levels = game.casino_levels
+    types = np.array([TYPE_INDEX[m.type] for m in machines], np.int64)
+    current = np.array([[m.speed_level, m.odds_level, m.payout_level] for m in machines],
+                       np.int64).reshape(n, 3)
+    arrival_rate = 1 / (game.spawn_rate + 1)
+    max_machines = 2 + levels["more_machines"]
+    tables = casino_tables()
+    table = casino_table(tables, levels)
+
+    def floor_stats(casino):
+        # FIELDS of every machine on the floor, (N, F), from a casino_table()
+        return casino[types, current[:, 0], current[:, 1], current[:, 2]]
+
+    # Machine upgrades, priced like Machine.upgrade_cost
+    machine_idx, upgrade_idx = np.nonzero(current < MACHINE_UPGRADE_MAX)
+    options = [("machine", machines[i], UPGRADE_TYPES[t])
+               for i, t in zip(machine_idx.tolist(), upgrade_idx.tolist())]
+    costs = (500 * (current[machine_idx, upgrade_idx] + 1)).tolist()
+    casino_keys = [key for key, upgrade in casino_upgrades.items()
+                   if levels[key] < upgrade["max_level"]]
+    for key in casino_keys:
+        options.append(("casino", None, key))
+        costs.append(casino_upgrades[key]["cost"] * (levels[key] + 1))
+
+    # The floor as it stands (row 0) and with each casino upgrade, which
+    # changes every machine (or, for more_machines, every visitor)
+    stats = floor_stats(table)
+    rows = [stats]
+    row_max_machines = [max_machines]
+    for key in casino_keys:
+        if key == "more_machines":
+            rows.append(stats)
+            row_max_machines.append(max_machines + 1)
+        else:
+            rows.append(floor_stats(casino_table(tables, dict(levels, **{key: levels[key] + 1}))))
+            row_max_machines.append(max_machines)
+    rows = np.array(rows).reshape(len(rows), n, len(FIELDS))
+    e = {field: rows[..., i] for i, field in enumerate(FIELDS)}
+    revenue = floor_revenue(e, np.ones((len(rows), n), bool), arrival_rate,
+                            np.array(row_max_machines)[:, None])
+
+    # Machine upgrades each change a single machine
+    upgraded = current[machine_idx]
+    upgraded[np.arange(len(machine_idx)), upgrade_idx] += 1
+    changed_stats = table[types[machine_idx], upgraded[:, 0], upgraded[:, 1], upgraded[:, 2]]
+    single = changed_revenue(stats, machine_idx, changed_stats, arrival_rate * max_machines)
+
+    gain = np.concatenate([single, revenue[1:]]) - revenue[0]
+    costs = np.array(costs, float)
+    with np.errstate(divide="ignore"):
+        payback = np.where(gain > 0, costs / gain, np.inf)
+    return options, costs, gain, payback
+
+def purchase_options(game):
+    options, costs, gain, payback = price_options(game)
+    return [Purchase(kind, target, key, int(cost), float(g), float(p))
+            for (kind, target, key), cost, g, p in zip(options, costs, gain, payback)]
+
+def best_purchase(game):
+    # The affordable purchase that pays for itself soonest, or None when
+    # nothing affordable raises expected earnings
+    options, costs, gain, payback = price_options(game)
+    payback = np.where(costs <= game.money, payback, np.inf)
+    if not len(payback) or payback.min() == np.inf:
+        return None
+    i = int(np.argmin(payback))
+    kind, target, key = options[i]
+    return Purchase(kind, target, key, int(costs[i]), float(gain[i]), float(payback[i]))
+
+def describe(option):
+    if option.kind == "machine":
+        name = option.target.data["name"]
+        return f"{option.key} upgrade on {name} #{option.target.order}"
+    return casino_upgrades[option.key]["name"]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Expected machine economics and the best next purchase")
+    parser.add_argument("--machines", type=int, default=10, help="slot machines on the sample floor")
+    parser.add_argument("--money", type=int, default=20000, help="cash available for purchases")
+    args = parser.parse_args(argv)
+
+    table = level_table()
+    print(f"{'machine':16}{'win':>8}{'$/play':>10}{'$/tick':>10}{'plays/visitor':>15}")
+    for i, machine_type in enumerate(MACHINE_TYPES):
+        print(f"{machine_types[machine_type]['name']:16}"
+              f"{machine_stats(i, 0, 0, 0)[0]:>8.0%}"
+              f"{table['earnings_per_play'][i, 0, 0, 0]:>10.1f}"
+              f"{table['revenue_per_tick'][i, 0, 0, 0]:>10.3f}"
+              f"{table['plays_per_visitor'][i, 0, 0, 0]:>15.1f}")
+
+    game = Simulation()
+    fill_floor(game, args.machines)
+    game.money = args.money
+    start = time.perf_counter()
+    best = best_purchase(game)
+    elapsed = time.perf_counter() - start
+    print()
+    if best is None:
+        print("No affordable purchase raises expected earnings")
+    else:
+        print(f"Best next purchase: {describe(best)} for ${best.cost}, "
+              f"+${best.gain * FPS * 60:.1f}/min, pays back in {best.payback / FPS / 60:.1f} game minutes")
+    print(f"({elapsed * 1e6:.0f} us)")
+
+if __name__ == "__main__":
+    sys.exit(main())
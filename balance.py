@@ -0,0 +1,239 @@
+import argparse
+import copy
+import itertools
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from simulation import (
+    Simulation, MachineType, machine_types, casino_upgrades, fill_floor, FPS,
+)
+from crowd import COST_TO_PLAY
+
+# Monte Carlo balance runs. Every configuration (a point in the parameter
+# grid: machine_types / casino_upgrades overrides plus a floor layout) is
+# played for --runs independent seeded headless sessions, fanned out over a
+# process pool. Run i of every configuration uses the same seed, so
+# configurations are compared on the same visitor streams.
+#
+# Results are folded into running statistics as runs finish and each
+# configuration is reported as soon as its last run is in, so memory stays
+# flat however many runs are asked for.
+#
+#     python balance.py --runs 200 --set slot.win_chance=0.35,0.4,0.45 \
+#         --set upgrade.better_odds=0,1 --machines 5,10 [--out results.jsonl]
+#
+# House edge is total_earnings over the $50 stakes played: the casino's net
+# take per dollar staked (negative when machines pay out more than they
+# take). A session is bankrupt once cash drops below the price of a play.
+
+BASE_MACHINE_TYPES = copy.deepcopy(machine_types)
+
+Z_95 = 1.96
+
+class RunningStat:
+    # Welford's online mean and variance
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+
+    def ci95(self):
+        # Half-width of the normal-approximation 95% confidence interval
+        if self.n < 2:
+            return float("nan")
+        return Z_95 * math.sqrt(self.m2 / (self.n - 1) / self.n)
+
+def parse_value(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+def parse_grid(settings):
+    # ["slot.win_chance=0.3,0.4", ...] -> [("slot.win_chance", [0.3, 0.4]), ...]
+    grid = []
+    for setting in settings:
+        name, _, values = setting.partition("=")
+        group, _, field = name.partition(".")
+        if group == "upgrade":
+            if field not in casino_upgrades:
+                raise ValueError(f"unknown casino upgrade: {field}")
+        elif MachineType(group) not in machine_types or field not in BASE_MACHINE_TYPES[MachineType(group)]:
+            raise ValueError(f"unknown machine setting: {name}")
+        grid.append((name, [parse_value(value) for value in values.split(",")]))
+    return grid
+
+def configurations(grid, layouts, machine_type):
+    names = [name for name, _ in grid]
+    for values in itertools.product(*(values for _, values in grid)):
+        for machines in layouts:
+            yield {"set": dict(zip(names, values)), "machines": machines, "type": machine_type}
+
+def label(config):
+    settings = [f"{name}={value}" for name, value in config["set"].items()]
+    return " ".join(settings + [f"{config['machines']}x{config['type']}"])
+
+def apply_config(config):
+    # Workers run many sessions, so every one starts from the stock tables.
+    # Returns the casino upgrade levels the session's game starts with.
+    for machine_type, data in BASE_MACHINE_TYPES.items():
+        machine_types[machine_type].update(data)
+    levels = {}
+    for name, value in config["set"].items():
+        group, field = name.split(".")
+        if group == "upgrade":
+            levels[field] = value
+        else:
+            machine_types[MachineType(group)][field] = value
+    return levels
+
+def run_session(config, seed, ticks, sample_every, crowd=0):
+    # One headless session; returns a small summary, never the game itself
+    levels = apply_config(config)
+    game = Simulation(crowd=crowd > 0, seed=seed)
+    game.set_casino_levels(levels)
+    game.effects_enabled = False
+    fill_floor(game, config["machines"], MachineType(config["type"]))
+    if crowd:
+        game.spawn_npc(crowd)
+
+    bankrupt = False
+    money = []
+    for tick in range(1, ticks + 1):
+        game.step()
+        if game.money < COST_TO_PLAY:
+            bankrupt = True
+        if tick % sample_every == 0:
+            money.append(game.money)
+
+    wagered = game.total_plays * COST_TO_PLAY
+    return {
+        "house_edge": game.total_earnings / wagered if wagered else 0.0,
+        "money": game.money,
+        "bankrupt": bankrupt,
+        "visitors_per_hour": game.total_visitors / (ticks / (FPS * 3600)),
+        "money_over_time": money,
+    }
+
+class ConfigStats:
+    def __init__(self, config):
+        self.config = config
+        self.house_edge = RunningStat()
+        self.money = RunningStat()
+        self.bankrupt = RunningStat()
+        self.visitors = RunningStat()
+        self.money_over_time = []
+
+    def add(self, result):
+        self.house_edge.add(result["house_edge"])
+        self.money.add(result["money"])
+        self.bankrupt.add(1.0 if result["bankrupt"] else 0.0)
+        self.visitors.add(result["visitors_per_hour"])
+        for i, value in enumerate(result["money_over_time"]):
+            if i == len(self.money_over_time):
+                self.money_over_time.append(RunningStat())
+            self.money_over_time[i].add(value)
+
+    def summary(self):
+        def stat(s):
+            return {"mean": s.mean, "ci95": s.ci95()}
+        return {
+            "config": self.config,
+            "runs": self.money.n,
+            "house_edge": stat(self.house_edge),
+            "money": stat(self.money),
+            "bankruptcy_rate": stat(self.bankrupt),
+            "visitors_per_hour": stat(self.visitors),
+            "money_over_time": [s.mean for s in self.money_over_time],
+        }
+
+def sweep(configs, runs, ticks, sample_every, seed=0, crowd=0, workers=None):
+    # Yields (config, summary) as each configuration finishes. Only a
+    # bounded window of sessions is in flight at any time.
+    configs = list(configs)
+    stats = [ConfigStats(config) for config in configs]
+    remaining = [runs] * len(configs)
+    tasks = ((i, seed + run) for i in range(len(configs)) for run in range(runs))
+    workers = workers or os.cpu_count() or 1
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+
+        def submit(count):
+            for i, run_seed in itertools.islice(tasks, count):
+                future = pool.submit(run_session, configs[i], run_seed, ticks, sample_every, crowd)
+                pending[future] = i
+
+        submit(workers * 4)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = pending.pop(future)
+                stats[i].add(future.result())
+                remaining[i] -= 1
+                if remaining[i] == 0:
+                    yield configs[i], stats[i].summary()
+                    stats[i] = None
+            submit(len(done))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monte Carlo balance sweeps over machine and upgrade settings")
+    parser.add_argument("--set", action="append", default=[], metavar="GROUP.FIELD=V1,V2",
+                        help="sweep a machine_types field (e.g. slot.win_chance=0.3,0.4) "
+                             "or a casino upgrade level (e.g. upgrade.better_odds=0,1)")
+    parser.add_argument("--machines", default="10", help="comma-separated machine counts to lay out")
+    parser.add_argument("--type", default=MachineType.SLOT.value, choices=[t.value for t in MachineType],
+                        help="machine type to fill the floor with")
+    parser.add_argument("--runs", type=int, default=100, help="sessions per configuration")
+    parser.add_argument("--ticks", type=int, default=FPS * 60 * 60, help="ticks per session (default: one game hour)")
+    parser.add_argument("--sample", type=int, default=FPS * 60, help="ticks between money samples")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first run of each configuration")
+    parser.add_argument("--crowd", type=int, default=0, metavar="N",
+                        help="use the NumPy crowd engine, starting with N visitors")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--out", default=None, help="append one JSON summary line per configuration")
+    args = parser.parse_args(argv)
+
+    grid = parse_grid(args.set)
+    layouts = [int(count) for count in args.machines.split(",")]
+    configs = list(configurations(grid, layouts, args.type))
+    out = open(args.out, "a") if args.out else None
+
+    print(f"{len(configs)} configurations x {args.runs} runs, {args.ticks} ticks each")
+    width = max([len("configuration")] + [len(label(config)) for config in configs]) + 2
+    print(f"{'configuration':{width}}{'house edge':>18}{'final cash':>20}{'bankrupt':>16}{'visitors/h':>16}")
+    start = time.perf_counter()
+    try:
+        for config, summary in sweep(configs, args.runs, args.ticks, args.sample,
+                                     args.seed, args.crowd, args.workers):
+            edge = summary["house_edge"]
+            money = summary["money"]
+            bankrupt = summary["bankruptcy_rate"]
+            visitors = summary["visitors_per_hour"]
+            print(f"{label(config):{width}}"
+                  f"{edge['mean']:>+10.1%} ±{edge['ci95']:5.1%}"
+                  f"{money['mean']:>12.0f} ±{money['ci95']:6.0f}"
+                  f"{bankrupt['mean']:>8.0%} ±{bankrupt['ci95']:5.0%}"
+                  f"{visitors['mean']:>8.1f} ±{visitors['ci95']:5.1f}", flush=True)
+            if out:
+                out.write(json.dumps(summary) + "\n")
+                out.flush()
+    finally:
+        if out:
+            out.close()
+    print(f"Done in {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pygame
+
+from simulation import Simulation, Effect, EffectRing, GREEN, RED
+from render import Renderer
+
+# Ticks per second for updating and drawing a steady stream of win/lose
+# effects: a list with list.remove and a fresh SRCALPHA Surface per effect
+# per frame, against the EffectRing with pre-rendered sprites drawn in one
+# blits call.
+#
+#     python benchmarks/effects.py [--rate N] [--ticks N]
+
+def list_effects(win, rate, ticks):
+    effects = []
+    pos = pygame.Vector2(400, 400)
+    start = time.perf_counter()
+    for tick in range(ticks):
+        for i in range(rate):
+            effects.append(Effect(pos.copy(), GREEN if i % 2 else RED, 30, 15))
+        for effect in effects[:]:
+            effect.timer -= 1
+            if effect.timer <= 0:
+                effects.remove(effect)
+        for effect in effects:
+            alpha = int(255 * (effect.timer / effect.max_time))
+            size = int(effect.size * (effect.timer / effect.max_time))
+            s = pygame.Surface((size*2, size*2), pygame.SRCALPHA)
+            pygame.draw.circle(s, (*effect.color, alpha), (size, size), size)
+            win.blit(s, (effect.pos.x + 15 - size, effect.pos.y + 15 - size))
+    return ticks / (time.perf_counter() - start)
+
+def ring_effects(win, rate, ticks):
+    renderer = Renderer(Simulation(), win)
+    effects = EffectRing()
+    pos = pygame.Vector2(400, 400)
+    start = time.perf_counter()
+    for tick in range(ticks):
+        for i in range(rate):
+            effects.add(pos, GREEN if i % 2 else RED, 30, 15)
+        effects.update()
+        renderer.drawn = []
+        renderer.draw_effects(effects)
+    return ticks / (time.perf_counter() - start)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Effect update and draw throughput, list vs ring buffer")
+    parser.add_argument("--rate", type=int, default=10, help="effects started per tick")
+    parser.add_argument("--ticks", type=int, default=600, help="ticks per run")
+    args = parser.parse_args(argv)
+
+    pygame.init()
+    win = pygame.display.set_mode((800, 600))
+    before = list_effects(win, args.rate, args.ticks)
+    after = ring_effects(win, args.rate, args.ticks)
+    print(f"{'':18}{'list':>14}{'ring':>14}{'change':>10}")
+    print(f"{'Ticks/s':18}{before:14.0f}{after:14.0f}{(after - before) / before:+10.0%}")
+
+if __name__ == "__main__":
+    main()
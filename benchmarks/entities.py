@@ -0,0 +1,103 @@
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pygame
+
+from simulation import Simulation, Machine, NPC, Effect, MachineType, GREEN, fill_floor
+
+# Memory per entity and update throughput for the slotted Machine, NPC and
+# Effect classes, compared with the layout they replaced: the same classes
+# with a per-instance __dict__, and effects as plain dicts.
+#
+#     python benchmarks/entities.py [--count N] [--ticks N]
+
+def unslotted(cls):
+    # Copy of `cls` without __slots__, so every instance carries a __dict__
+    skip = set(cls.__slots__) | {"__slots__", "__dict__", "__weakref__"}
+    namespace = {key: value for key, value in vars(cls).items() if key not in skip}
+    return type(cls.__name__, (), namespace)
+
+def dict_effect(pos, color, duration, size):
+    return {"pos": pos, "color": color, "timer": duration, "max_time": duration, "size": size}
+
+def bytes_per_entity(factory, count):
+    entities = []
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for _ in range(count):
+        entities.append(factory())
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / count
+
+def npc_updates_per_second(npc_class, count, ticks):
+    game = Simulation()
+    game.effects_enabled = False
+    game.spawn_rate = float("inf")
+    fill_floor(game, 40)
+    game.money = 10 ** 9
+    for _ in range(count):
+        game.add_npc(npc_class(game))
+
+    updates = 0
+    start = time.perf_counter()
+    for _ in range(ticks):
+        updates += len(game.npcs)
+        game.step()
+    return updates / (time.perf_counter() - start)
+
+def effect_updates_per_second(make_effect, count, ticks):
+    # Long-lived effects so the list stays full for the whole run
+    pos = pygame.Vector2(0, 0)
+    effects = [make_effect(pos, GREEN, ticks + 1, 15) for _ in range(count)]
+    start = time.perf_counter()
+    if isinstance(effects[0], dict):
+        for _ in range(ticks):
+            for effect in effects:
+                effect["timer"] -= 1
+    else:
+        for _ in range(ticks):
+            for effect in effects:
+                effect.timer -= 1
+    return count * ticks / (time.perf_counter() - start)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Entity memory and update throughput, __dict__ vs __slots__")
+    parser.add_argument("--count", type=int, default=10000, help="entities per measurement")
+    parser.add_argument("--ticks", type=int, default=300, help="ticks per throughput run")
+    args = parser.parse_args(argv)
+
+    game = Simulation()
+    pos = pygame.Vector2(100, 300)
+    DictMachine = unslotted(Machine)
+    DictNPC = unslotted(NPC)
+
+    rows = [
+        ("Machine bytes",
+         bytes_per_entity(lambda: DictMachine(game, pygame.Vector2(pos), MachineType.SLOT), args.count),
+         bytes_per_entity(lambda: Machine(game, pygame.Vector2(pos), MachineType.SLOT), args.count)),
+        ("NPC bytes",
+         bytes_per_entity(lambda: DictNPC(game), args.count),
+         bytes_per_entity(lambda: NPC(game), args.count)),
+        ("Effect bytes",
+         bytes_per_entity(lambda: dict_effect(pos.copy(), GREEN, 30, 15), args.count),
+         bytes_per_entity(lambda: Effect(pos.copy(), GREEN, 30, 15), args.count)),
+        ("NPC updates/s",
+         npc_updates_per_second(DictNPC, args.count, args.ticks),
+         npc_updates_per_second(NPC, args.count, args.ticks)),
+        ("Effect updates/s",
+         effect_updates_per_second(dict_effect, args.count, args.ticks),
+         effect_updates_per_second(Effect, args.count, args.ticks)),
+    ]
+
+    print(f"{'':18}{'__dict__':>14}{'__slots__':>14}{'change':>10}")
+    for name, before, after in rows:
+        print(f"{name:18}{before:14.0f}{after:14.0f}{(after - before) / before:+10.0%}")
+
+if __name__ == "__main__":
+    main()
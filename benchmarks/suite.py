@@ -0,0 +1,291 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pygame
+
+from simulation import Simulation, NPC, MachineType, GREEN, RED, MACHINE_SIZE, fill_floor
+
+# Benchmark suite with regression checks. Every benchmark builds a scripted
+# headless scenario, then times a fixed batch of work for --rounds rounds;
+# the best round is its score in operations per second (ticks, calls or
+# frames). Drawing goes through main.draw_window onto the SDL dummy driver.
+#
+#     python benchmarks/suite.py --save            # record benchmarks/baseline.json
+#     python benchmarks/suite.py [--threshold 0.2] # compare; exit 1 on regression
+#     python benchmarks/suite.py --only draw       # benchmarks with "draw" in the name
+#
+# Baselines are per machine, so benchmarks/baseline.json is not checked in.
+# A benchmark regresses when it scores more than --threshold below its
+# baseline; ones missing from either side are reported but never fail.
+# Some also have a minimum score, a hard budget that fails on any machine
+# (e.g. a cold route through a maze must fit well inside a frame).
+#
+# The floor holds at most 56 machines, so "full floor" is as many as fit.
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+BASELINE_VERSION = 1
+
+FULL_FLOOR = 56
+
+BENCHMARKS = []
+
+def benchmark(name, unit, minimum=None):
+    # Register a benchmark; the function sets up its scenario and returns a
+    # callable doing one round of work that returns how many `unit`s it did
+    def register(setup):
+        BENCHMARKS.append((name, unit, setup, minimum))
+        return setup
+    return register
+
+def scenario(machines=0, npcs=0, crowd=False, money=10 ** 9, seed=0):
+    # A game with `machines` slots placed, `npcs` visitors walked in and no
+    # further spawns; cash is effectively unlimited so nobody leaves broke
+    game = Simulation(crowd=crowd, seed=seed)
+    game.effects_enabled = False
+    fill_floor(game, machines)
+    game.money = money
+    game.spawn_rate = float("inf")
+    if npcs:
+        game.spawn_npc(npcs)
+    return game
+
+def build_maze(game):
+    # Columns of walls across the floor, each with a gap at alternate ends
+    rect = game.casino_rect
+    for i, x in enumerate(range(rect.left + 100, rect.right - 50, 100)):
+        gap = rect.top if i % 2 else rect.bottom - 50
+        for y in range(rect.top, rect.bottom, 50):
+            if y != gap:
+                game.place_wall(pygame.Vector2(x, y))
+
+@benchmark("step/empty_floor", "ticks")
+def step_empty():
+    game = scenario()
+    return lambda: (game.advance(2000), 2000)[1]
+
+@benchmark("step/full_floor_200_npcs", "ticks")
+def step_full_floor():
+    game = scenario(FULL_FLOOR, 200)
+    return lambda: (game.advance(100), 100)[1]
+
+@benchmark("step/full_floor_2000_npcs_settled", "ticks")
+def step_settled():
+    # Timed once most visitors have sat down at a machine and spend their
+    # ticks waiting out cooldowns
+    game = scenario(FULL_FLOOR, 2000)
+    game.advance(1500)
+    return lambda: (game.advance(100), 100)[1]
+
+@benchmark("step/visitor_churn", "ticks")
+def step_churn():
+    # 10 visitors walk in every tick and as many walk out, on an empty floor
+    game = scenario()
+    def run():
+        for _ in range(50):
+            game.spawn_npc(10)
+            game.step()
+        return 50
+    for _ in range(12):
+        run()
+    return run
+
+@benchmark("npc_update/10k", "ticks")
+def npc_update_10k():
+    game = scenario(FULL_FLOOR, 10000)
+    return lambda: (game.advance(3), 3)[1]
+
+@benchmark("crowd_update/10k", "ticks")
+def crowd_update_10k():
+    game = scenario(FULL_FLOOR, 10000, crowd=True)
+    return lambda: (game.advance(20), 20)[1]
+
+@benchmark("choose_machine/full_floor", "calls")
+def choose_machine():
+    game = scenario(FULL_FLOOR)
+    npc = NPC(game)
+    def run():
+        for _ in range(2000):
+            npc.choose_machine()
+        return 2000
+    return run
+
+def maze_starts(game, count):
+    rng = random.Random(1)
+    rect = game.casino_rect
+    return [pygame.Vector2(rng.uniform(rect.left, rect.right - 30), rng.uniform(rect.top, rect.bottom - 30))
+            for _ in range(count)]
+
+# 5 ms a route: placing a wall re-routes every NPC whose route it crossed
+@benchmark("shortest_path_to_exit/maze_cold", "calls", minimum=200)
+def path_to_exit_cold():
+    # Every round starts with an empty route cache
+    game = scenario()
+    build_maze(game)
+    starts = maze_starts(game, 50)
+    nav = game.nav
+    def run():
+        nav.routes.clear()
+        nav.route_swept.clear()
+        nav.route_cells.clear()
+        for pos in starts:
+            game.shortest_path_to_exit(pos)
+        return len(starts)
+    return run
+
+@benchmark("shortest_path_to_exit/maze_cached", "calls")
+def path_to_exit_cached():
+    game = scenario()
+    build_maze(game)
+    starts = maze_starts(game, 200)
+    for pos in starts:
+        game.shortest_path_to_exit(pos)
+    def run():
+        for pos in starts:
+            game.shortest_path_to_exit(pos)
+        return len(starts)
+    return run
+
+@benchmark("place_machine/validate_full_floor", "calls")
+def place_machine_validate():
+    # Every placement is rejected: the floor is full, or it's off the floor
+    game = scenario(FULL_FLOOR)
+    rng = random.Random(2)
+    spots = [pygame.Vector2(rng.uniform(0, 800), rng.uniform(250, 550)) for _ in range(5000)]
+    def run():
+        for pos in spots:
+            game.place_machine(pos, MachineType.SLOT)
+        return len(spots)
+    return run
+
+@benchmark("place_machine/fill_empty_floor", "machines")
+def place_machine_fill():
+    # Each round fills 10 fresh floors, made ahead of time
+    games = [scenario() for _ in range(100)]
+    def run():
+        placed = 0
+        for _ in range(10):
+            game = games.pop() if games else scenario()
+            rect = game.casino_rect
+            for y in range(rect.top, rect.bottom - MACHINE_SIZE[1] + 1, MACHINE_SIZE[1]):
+                for x in range(rect.left, rect.right - MACHINE_SIZE[0] + 1, MACHINE_SIZE[0]):
+                    placed += game.place_machine(pygame.Vector2(x, y), MachineType.SLOT)
+        return placed
+    return run
+
+def windowed(machines=0, npcs=0):
+    # The windowed game's GameState, drawn by main.draw_window
+    import main
+    game = main.game = main.GameState()
+    fill_floor(game, machines)
+    game.money = 10 ** 9
+    game.spawn_rate = float("inf")
+    if npcs:
+        game.spawn_npc(npcs)
+    game.advance(300)
+    return main, game
+
+@benchmark("draw_window/full_floor_500_npcs", "frames")
+def draw_crowd():
+    main, game = windowed(FULL_FLOOR, 500)
+    def run():
+        for _ in range(30):
+            main.draw_window()
+        return 30
+    return run
+
+@benchmark("draw_window/effect_storm", "frames")
+def draw_effect_storm():
+    # 20 new win/lose effects a frame, ~600 alive at once
+    main, game = windowed(FULL_FLOOR)
+    pos = pygame.Vector2(400, 400)
+    def run():
+        for _ in range(30):
+            for i in range(20):
+                game.add_effect(pos, GREEN if i % 2 else RED)
+            game.update_effects()
+            main.draw_window()
+        return 30
+    return run
+
+def measure(setup, rounds):
+    run = setup()
+    scores = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        ops = run()
+        scores.append(ops / (time.perf_counter() - start))
+    return max(scores), scores
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scripted benchmarks with baselines and regression checks")
+    parser.add_argument("--rounds", type=int, default=5, help="timed rounds per benchmark; the best one counts")
+    parser.add_argument("--only", default=None, help="run only benchmarks whose name contains this")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline JSON to compare with or save to")
+    parser.add_argument("--save", action="store_true", help="save the results as the baseline instead of comparing")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="fail when a benchmark scores more than this fraction below its baseline")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            saved = json.load(f)
+        if saved.get("version") != BASELINE_VERSION:
+            parser.error(f"{args.baseline} is not a version {BASELINE_VERSION} baseline")
+        baseline = saved["results"]
+
+    pygame.init()
+    results = {}
+    regressed = []
+    print(f"{'benchmark':40}{'score':>14}{'unit':>12}{'baseline':>14}{'change':>10}")
+    for name, unit, setup, minimum in BENCHMARKS:
+        if args.only and args.only not in name:
+            continue
+        try:
+            score, _ = measure(setup, args.rounds)
+        except RuntimeError as e:  # e.g. the crowd engine without numpy
+            print(f"{name:40}{'skipped':>14}  ({e})")
+            continue
+        results[name] = score
+        line = f"{name:40}{score:14.1f}{unit + '/s':>12}"
+        if name in baseline:
+            change = score / baseline[name] - 1
+            line += f"{baseline[name]:14.1f}{change:+10.1%}"
+            if change < -args.threshold:
+                regressed.append(name)
+                line += "  REGRESSED"
+        if minimum is not None and score < minimum:
+            regressed.append(name)
+            line += f"  BELOW MINIMUM ({minimum:g})"
+        print(line, flush=True)
+
+    if args.save:
+        # Benchmarks not run this time keep their old baselines
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "version": BASELINE_VERSION,
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "rounds": args.rounds,
+                "results": dict(baseline, **results),
+            }, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    if regressed:
+        print(f"{len(regressed)} benchmark(s) regressed more than {args.threshold:.0%} "
+              f"or fell below their minimum: {', '.join(regressed)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,370 @@
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; only Simulation(crowd=True) needs it
+    np = None
+
+import pygame
+
+from simulation import GREEN, RED, NPC_STATES
+
+# Array-backed crowd engine. The whole visitor population is stored as NumPy
+# arrays (structure of arrays) and advanced with batched operations that
+# mirror NPC.walk_path, move_to_machine, play_machine and leave_casino.
+#
+# The one deliberate difference from the per-object NPCs: within a tick the
+# crowd is processed phase by phase (movement, then plays, then machine
+# choice) instead of in list order. Which NPCs act on a tick, and what they
+# do, is decided from the state at the start of the tick exactly as before.
+# Routing is either the simple lane model (NPCs walk the straight lanes in
+# game.paths, head straight for machines and leave along the nearest lane,
+# ignoring walls) or, with game.flow_fields, the nav grid's flow fields,
+# sampled for the whole crowd at once.
+
+# NPC states
+WALKING_PATH, TO_MACHINE, PLAYING, LEAVING = range(4)
+STATE_NAMES = NPC_STATES
+
+NPC_SPEED = 1.5
+COST_TO_PLAY = 50
+
+# Per-NPC arrays, grown and compacted together. (tx, ty) is the point the
+# NPC is currently heading for: the next waypoint or its target machine.
+# (dest_x, dest_y) is where the current leg ends and `goal` its row in the
+# flow table; in flow mode a leg is path_index 0 -> path_last 1. A save
+# stores them in this order, so changing the list needs a new
+# savegame.SAVE_VERSION.
+SAVED_FIELDS = ("x", "y", "tx", "ty", "dest_x", "dest_y", "goal", "state", "path_id",
+                "path_index", "path_last", "target", "cooldown", "losses",
+                "machines_played", "plays", "max_machines")
+
+class CrowdEngine:
+    def __init__(self, game, capacity=1024):
+        if np is None:
+            raise RuntimeError("the crowd engine requires numpy")
+        self.game = game
+        # Same streams and draw order as the NPC objects
+        self.rng = game.rng
+        self.count = 0
+
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        self.tx = np.zeros(capacity)
+        self.ty = np.zeros(capacity)
+        self.dest_x = np.zeros(capacity)
+        self.dest_y = np.zeros(capacity)
+        self.goal = np.zeros(capacity, np.int32)
+        self.state = np.zeros(capacity, np.int8)
+        self.path_id = np.zeros(capacity, np.int32)
+        self.path_index = np.zeros(capacity, np.int32)
+        self.path_last = np.zeros(capacity, np.int32)
+        self.target = np.full(capacity, -1, np.int32)
+        self.cooldown = np.zeros(capacity, np.int32)
+        self.losses = np.zeros(capacity, np.int8)
+        self.machines_played = np.zeros(capacity, np.int8)
+        self.plays = np.zeros(capacity, np.int32)
+        self.max_machines = np.zeros(capacity, np.int8)
+
+        self._stats_version = None
+        self.compile_paths()
+
+        # Flow-field routing: one table row per distinct goal cell
+        self.flow = game.flow_fields
+        self.goal_rows = {}
+        self.goal_cells = []
+        self._flow_version = None
+
+    def __len__(self):
+        return self.count
+
+    def compile_paths(self):
+        # Flatten game.paths into one point array plus per-path offsets
+        paths = self.game.paths
+        self.path_len = np.array([len(path) for path in paths], np.int32)
+        self.path_offset = np.concatenate(([0], np.cumsum(self.path_len)[:-1])).astype(np.int32)
+        self.path_x = np.array([p.x for path in paths for p in path])
+        self.path_y = np.array([p.y for path in paths for p in path])
+        self.point_path = np.repeat(np.arange(len(paths), dtype=np.int32), self.path_len)
+
+    def _grow(self, needed):
+        capacity = len(self.state)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name in SAVED_FIELDS:
+            old = getattr(self, name)
+            new = np.zeros(capacity, old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def spawn(self, count=1):
+        start = self.count
+        self._grow(start + count)
+        end = start + count
+        path_id = (self.rng.spawns.uniform(count) * len(self.path_len)).astype(np.int64)
+
+        self.x[start:end] = self.path_x[self.path_offset[path_id]]
+        self.y[start:end] = self.path_y[self.path_offset[path_id]]
+        self.state[start:end] = WALKING_PATH
+        self.path_id[start:end] = path_id
+        self.path_index[start:end] = 0
+        self.path_last[start:end] = self.path_len[path_id] - 1
+        self.target[start:end] = -1
+        self.cooldown[start:end] = 0
+        self.losses[start:end] = 0
+        self.machines_played[start:end] = 0
+        self.plays[start:end] = 0
+        self.max_machines[start:end] = 2 + self.game.casino_levels["more_machines"]
+        self.count = end
+        idx = np.arange(start, end)
+        lane_end = self.path_offset[path_id] + self.path_len[path_id] - 1
+        self._set_dest(idx, self.path_x[lane_end], self.path_y[lane_end])
+        self._head_along_path(idx)
+
+    def state_counts(self):
+        counts = np.bincount(self.state[:self.count], minlength=len(STATE_NAMES))
+        return dict(zip(STATE_NAMES, counts.tolist()))
+
+    def machine_counts(self, state):
+        # NPCs in `state` at (or walking to) each machine, by machine order
+        n = self.count
+        target = self.target[:n][self.state[:n] == state]
+        return np.bincount(target, minlength=len(self.game.machines)).tolist()
+
+    def _machine_arrays(self):
+        game = self.game
+        if self._stats_version == game.stats_version:
+            return
+        machines = game.machines
+        m = len(machines)
+        self.machine_x = np.fromiter((mm.pos.x for mm in machines), float, m)
+        self.machine_y = np.fromiter((mm.pos.y for mm in machines), float, m)
+        self.win_chance = np.fromiter((mm.win_chance for mm in machines), float, m)
+        self.win_amount = np.fromiter((mm.win_amount for mm in machines), np.int64, m)
+        self.cooldown_time = np.fromiter((mm.cooldown_time for mm in machines), np.int32, m)
+        self._stats_version = game.stats_version
+
+    def _set_dest(self, idx, x, y):
+        self.dest_x[idx] = x
+        self.dest_y[idx] = y
+        if not self.flow:
+            return
+        self.path_index[idx] = 0
+        self.path_last[idx] = 1
+        nav = self.game.nav
+        offset = nav.agent_offset
+        cx = np.clip((self.dest_x[idx] + offset - nav.rect.left) // nav.cell_size, 0, nav.cols - 1)
+        cy = np.clip((self.dest_y[idx] + offset - nav.rect.top) // nav.cell_size, 0, nav.rows - 1)
+        cells, inverse = np.unique((cy * nav.cols + cx).astype(np.int32), return_inverse=True)
+        rows = np.array([self._goal_row(cell) for cell in cells.tolist()], np.int32)
+        self.goal[idx] = rows[inverse]
+
+    def _goal_row(self, cell):
+        row = self.goal_rows.get(cell)
+        if row is None:
+            row = self.goal_rows[cell] = len(self.goal_cells)
+            self.goal_cells.append(cell)
+            self._flow_version = None
+        return row
+
+    def _flow_table(self):
+        nav = self.game.nav
+        if self._flow_version != nav.version:
+            cols = nav.cols
+            self.flow_table = np.array([nav.flow_field((cell % cols, cell // cols)).step
+                                        for cell in self.goal_cells], np.int32)
+            self.goal_cell = np.array(self.goal_cells, np.int32)
+            index = np.arange(cols * nav.rows)
+            half = nav.cell_size / 2 - nav.agent_offset
+            self.cell_x = nav.rect.left + (index % cols) * nav.cell_size + half
+            self.cell_y = nav.rect.top + (index // cols) * nav.cell_size + half
+            self._flow_version = nav.version
+        return self.flow_table
+
+    def _flow_targets(self, idx):
+        # Sample every moving NPC's flow field; returns which of them are
+        # now steering for the end of their leg rather than a cell centre
+        if len(idx) == 0:
+            return np.zeros(0, bool)
+        nav = self.game.nav
+        table = self._flow_table()
+        offset = nav.agent_offset
+        cx = np.clip((self.x[idx] + offset - nav.rect.left) // nav.cell_size, 0, nav.cols - 1)
+        cy = np.clip((self.y[idx] + offset - nav.rect.top) // nav.cell_size, 0, nav.rows - 1)
+        cell = (cy * nav.cols + cx).astype(np.int32)
+        goal = self.goal[idx]
+        step = table[goal, cell]
+        final = (step < 0) | (cell == self.goal_cell[goal])
+        step[final] = 0
+        self.tx[idx] = np.where(final, self.dest_x[idx], self.cell_x[step])
+        self.ty[idx] = np.where(final, self.dest_y[idx], self.cell_y[step])
+        return final
+
+    def _head_along_path(self, idx):
+        # Point NPCs that still have a waypoint ahead at that waypoint
+        idx = idx[self.path_index[idx] < self.path_last[idx]]
+        point = self.path_offset[self.path_id[idx]] + self.path_index[idx] + 1
+        self.tx[idx] = self.path_x[point]
+        self.ty[idx] = self.path_y[point]
+
+    def _set_exit_path(self, idx):
+        if len(idx) == 0:
+            return
+        self.state[idx] = LEAVING
+        exit_point = self.game.exit_point
+        self._set_dest(idx, exit_point.x, exit_point.y)
+        if self.flow:
+            return
+        # Leave along the lane with the closest waypoint; argmin keeps the
+        # first of equal distances
+        dx = self.x[idx][:, None] - self.path_x[None, :]
+        dy = self.y[idx][:, None] - self.path_y[None, :]
+        closest = (dx * dx + dy * dy).argmin(axis=1)
+        path_id = self.point_path[closest]
+        self.path_id[idx] = path_id
+        self.path_index[idx] = closest - self.path_offset[path_id]
+        self.path_last[idx] = self.path_len[path_id] - 1
+        self._head_along_path(idx)
+
+    def _choose_machine(self, idx):
+        if len(idx) == 0:
+            return
+        machine = self.game.machine_index.best()
+        if machine:
+            best = machine.order
+            self.target[idx] = best
+            self.state[idx] = TO_MACHINE
+            self.tx[idx] = self.machine_x[best]
+            self.ty[idx] = self.machine_y[best]
+            self._set_dest(idx, self.machine_x[best], self.machine_y[best])
+            return
+        self._set_exit_path(idx)
+
+    def _play(self, players):
+        game = self.game
+        target = self.target[players]
+        payout = self.win_amount[target]
+
+        if game.money >= COST_TO_PLAY * len(players):
+            afford = np.ones(len(players), bool)
+            wins = self.rng.outcomes.uniform(len(players)) < self.win_chance[target]
+            game.money += int(payout[wins].sum()) - COST_TO_PLAY * len(players)
+        else:
+            # Not everyone can be covered; settle plays one at a time and,
+            # like object NPCs, draw an outcome only for those who can pay
+            afford = np.zeros(len(players), bool)
+            wins = np.zeros(len(players), bool)
+            win_chance = self.win_chance[target].tolist()
+            outcomes = self.rng.outcomes
+            money = game.money
+            for i in range(len(players)):
+                if money >= COST_TO_PLAY:
+                    money -= COST_TO_PLAY
+                    if outcomes.random() < win_chance[i]:
+                        money += int(payout[i])
+                        wins[i] = True
+                    afford[i] = True
+            game.money = money
+
+        self._set_exit_path(players[~afford])
+        played, wins, target = players[afford], wins[afford], target[afford]
+        if len(played) == 0:
+            return played
+
+        game.total_earnings += int(self.win_amount[target][wins].sum()) - COST_TO_PLAY * len(played)
+        game.total_plays += len(played)
+        if game.log is not None:
+            game.log.plays(game, target, wins, self.win_amount[target])
+
+        cooldown = self.cooldown_time[target]
+        machines = game.machines
+        for m in np.unique(target).tolist():
+            machines[m].start_cooldown()
+
+        self.losses[played[wins]] = 0
+        self.losses[played[~wins]] += 1
+        self.plays[played] += 1
+        self.cooldown[played] = cooldown
+
+        if game.effects_enabled:
+            for i, won in zip(played.tolist(), wins.tolist()):
+                game.add_effect(pygame.Vector2(self.x[i], self.y[i]), GREEN if won else RED)
+
+        return played
+
+    def update(self):
+        n = self.count
+        if n == 0:
+            return
+        game = self.game
+        self._machine_arrays()
+
+        # Decide who does what from the state at the start of the tick
+        state = self.state[:n]
+        walking = state == WALKING_PATH
+        leaving = state == LEAVING
+        playing = state == PLAYING
+        at_end = (walking | leaving) & (self.path_index[:n] >= self.path_last[:n])
+        moving = np.nonzero(~(playing | at_end))[0]
+        walked = np.nonzero(at_end & walking)[0]
+        left = np.nonzero(at_end & leaving)[0]
+        cooldown = self.cooldown[:n]
+        ready = np.nonzero(playing & (cooldown == 0))[0]
+
+        # Movement, with the same arithmetic as
+        # `pos += direction.normalize() * speed`
+        final = self._flow_targets(moving) if self.flow else None
+        dx = self.tx[moving] - self.x[moving]
+        dy = self.ty[moving] - self.y[moving]
+        length = np.sqrt(dx * dx + dy * dy)
+        far = length > NPC_SPEED
+        step = moving[far]
+        self.x[step] += dx[far] / length[far] * NPC_SPEED
+        self.y[step] += dy[far] / length[far] * NPC_SPEED
+
+        if final is None:
+            near = moving[~far]
+        else:
+            # Cell centres within reach are snapped to; the leg ends at dest
+            snap = moving[~far & ~final]
+            self.x[snap] = self.tx[snap]
+            self.y[snap] = self.ty[snap]
+            near = moving[~far & final]
+        heading = self.state[near] == TO_MACHINE
+        waypoint = near[~heading]
+        self.path_index[waypoint] += 1
+        self._head_along_path(waypoint)
+        arrived = near[heading]
+        self.state[arrived] = PLAYING
+        self.cooldown[arrived] = 0
+        self.losses[arrived] = 0
+        self.plays[arrived] = 0
+
+        # Plays; the rest of the table just counts down
+        cooldown -= playing & (cooldown > 0)
+        played = self._play(ready)
+
+        finished = played[self.losses[played] >= 3]
+        self.machines_played[finished] += 1
+        done = self.machines_played[finished] >= self.max_machines[finished]
+        self._set_exit_path(finished[done])
+        rechoose = finished[~done]
+
+        # Machine choice
+        if game.machines and game.money >= COST_TO_PLAY:
+            self._choose_machine(walked)
+        else:
+            self._set_exit_path(walked)
+        self._choose_machine(rechoose)
+        self.losses[rechoose] = 0
+        self.plays[rechoose] = 0
+
+        # Visitors that reached the end of their exit path leave
+        if len(left):
+            keep = np.ones(n, bool)
+            keep[left] = False
+            keep = np.nonzero(keep)[0]
+            for name in SAVED_FIELDS:
+                array = getattr(self, name)
+                array[:len(keep)] = array[keep]
+            self.count = len(keep)
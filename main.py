@@ -1,137 +1,62 @@
-import pygame
+import argparse
+import asyncio
+import os
+import struct
 import sys
-import random
-import math
-from enum import Enum
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pygame
+
+from simulation import (
+    Simulation, MachineType, machine_types, casino_upgrades, FPS,
+    WHITE, YELLOW, RED, GREEN, BLUE, GRAY, LIGHT_GRAY, BLACK, DARK_BG,
+    PLAYER_SIZE, MACHINE_SIZE,
+)
+
+from crowd import PLAYING
+from render import Renderer
+from savegame import Autosaver, save, load, dumps, write_file
+from profiler import Profiler, table, write_trace
+from metrics import Metrics, METRICS_NAME
+import replay
 
 pygame.init()
 
 # Game Constants
 WIN_WIDTH, WIN_HEIGHT = 800, 600
-FPS = 60
-
-# Colors
-WHITE = (255, 255, 255)
-YELLOW = (255, 255, 0)
-RED = (200, 50, 50)
-GREEN = (50, 200, 50)
-BLUE = (0, 0, 200)
-PURPLE = (200, 0, 200)
-GRAY = (150, 150, 150)
-LIGHT_GRAY = (200, 200, 200)
-BLACK = (0, 0, 0)
-DARK_BG = (30, 30, 30)
-ORANGE = (255, 165, 0)
-CYAN = (0, 255, 255)
-
-# Sizes
-PLAYER_SIZE = (30, 30)
-MACHINE_SIZE = (50, 50)
-WALL_SIZE = 50
-
-# Machine types with stats, costs and unlock requirements
-class MachineType(Enum):
-    SLOT = "slot"
-    ROULETTE = "roulette"
-    BLACKJACK = "blackjack"
-    POKER = "poker"
-    CRAPS = "craps"
-    
-machine_types = {
-    MachineType.SLOT: {
-        "name": "Slot Machine",
-        "cost": 200,
-        "win_chance": 0.4,
-        "win_amount": 50,
-        "cooldown": 60,
-        "unlock_at": 0,
-        "color": GREEN
-    },
-    MachineType.ROULETTE: {
-        "name": "Roulette",
-        "cost": 500,
-        "win_chance": 0.3,
-        "win_amount": 150,
-        "cooldown": 90,
-        "unlock_at": 2000,
-        "color": PURPLE
-    },
-    MachineType.BLACKJACK: {
-        "name": "Blackjack",
-        "cost": 800,
-        "win_chance": 0.5,
-        "win_amount": 300,
-        "cooldown": 120,
-        "unlock_at": 5000,
-        "color": BLUE
-    },
-    MachineType.POKER: {
-        "name": "Poker Table",
-        "cost": 1200,
-        "win_chance": 0.45,
-        "win_amount": 400,
-        "cooldown": 150,
-        "unlock_at": 10000,
-        "color": ORANGE
-    },
-    MachineType.CRAPS: {
-        "name": "Craps Table",
-        "cost": 1500,
-        "win_chance": 0.35,
-        "win_amount": 500,
-        "cooldown": 180,
-        "unlock_at": 15000,
-        "color": CYAN
-    }
-}
-
-# Casino upgrades
-casino_upgrades = {
-    "more_machines": {
-        "name": "More Machines",
-        "description": "NPCs will play up to 3 machines before leaving",
-        "cost": 3000,
-        "max_level": 3,
-        "current_level": 0
-    },
-    "faster_cooldown": {
-        "name": "Faster Play",
-        "description": "Reduces machine cooldown by 10% per level",
-        "cost": 2000,
-        "max_level": 5,
-        "current_level": 0
-    },
-    "better_odds": {
-        "name": "Better Odds",
-        "description": "Increases win chance by 5% per level",
-        "cost": 5000,
-        "max_level": 3,
-        "current_level": 0
-    },
-    "higher_payouts": {
-        "name": "Higher Payouts",
-        "description": "Increases win amount by 20% per level",
-        "cost": 4000,
-        "max_level": 3,
-        "current_level": 0
-    }
-}
-
-class GameState:
-    def __init__(self):
+
+# Fixed simulation timestep. Rendering runs at whatever rate the display
+# manages; the simulation always advances in whole ticks of TICK_MS.
+TICK_MS = 1000 / FPS
+MAX_TICKS_PER_FRAME = 5
+
+# Game speeds, stepped through with [ and ]: ticks per TICK_MS of real time, or None
+# for as many as fit in MAX_SPEED_BUDGET seconds a frame. Only one frame is
+# drawn however many ticks it covers.
+SPEEDS = (1, 2, 8, None)
+MAX_SPEED_BUDGET = 0.75 / FPS
+
+# Time away is made up when the autosave is resumed on startup, by stepping
+# the game headless before the first frame, up to MAX_CATCH_UP seconds of it
+MAX_CATCH_UP = 60 * 60
+CATCH_UP_CHUNK = FPS * 10
+
+# The game resumes from the autosave, which is rewritten every game minute
+# and on quit; F5/F9 quick save and load a separate slot
+AUTOSAVE_PATH = "autosave.sav"
+QUICKSAVE_PATH = "quicksave.sav"
+# Every session (and every quick load) is recorded to its own event log
+# here, for replaying with replay.py
+REPLAY_DIR = "replays"
+
+class GameState(Simulation):
+    def __init__(self, crowd=False, seed=None, flow_fields=False):
+        super().__init__(crowd=crowd, seed=seed, flow_fields=flow_fields)
         self.win = pygame.display.set_mode((WIN_WIDTH, WIN_HEIGHT))
         pygame.display.set_caption("Casino Tycoon")
         self.clock = pygame.time.Clock()
         
-        # Game objects
-        self.casino_rect = pygame.Rect(50, 300, 700, 200)
-        self.money = 1000
-        self.total_earnings = 0
-        self.total_visitors = 0
-        self.machines = []
-        self.npcs = []
-        self.walls = []
-        
         # Player state
         self.player_pos = pygame.Vector2(100, 350)
         self.build_mode = False
@@ -142,323 +67,61 @@ class GameState:
         self.show_help = False
         self.show_stats = False
         self.show_upgrades = False
+        # Machine whose upgrade popup is open, if any
+        self.upgrade_machine = None
+        # Index into SPEEDS
+        self.speed = 0
         self.ui_font = pygame.font.SysFont(None, 24)
         self.title_font = pygame.font.SysFont(None, 32)
-        
-        # Paths for NPCs
-        self.paths = [
-            [pygame.Vector2(x, 480) for x in range(100, 700, 50)],
-            [pygame.Vector2(x, 420) for x in range(100, 700, 50)],
-            [pygame.Vector2(x, 360) for x in range(100, 700, 50)],
-        ]
-        self.exit_point = pygame.Vector2(750, 480)
+        self.small_font = pygame.font.SysFont(None, 18)
         
         # UI elements
         self.q_rect = pygame.Rect(10, 70, 30, 30)
         self.s_rect = pygame.Rect(10, 110, 30, 30)
         self.u_rect = pygame.Rect(10, 150, 30, 30)
         
-        # Animation effects
-        self.effects = []
-        
-        # Spawn timer
-        self.spawn_timer = 0
-        self.spawn_rate = FPS * 5  # 5 seconds
-        
-    def distance(self, a, b):
-        return math.sqrt((a.x - b.x) ** 2 + (a.y - b.y) ** 2)
-    
-    def find_closest_point(self, point, path):
-        closest = path[0]
-        min_dist = self.distance(point, closest)
-        for p in path:
-            d = self.distance(point, p)
-            if d < min_dist:
-                closest = p
-                min_dist = d
-        return closest
-    
-    def shortest_path_to_exit(self, npc_pos):
-        best_path = None
-        best_start_index = 0
-        best_dist = float('inf')
-
-        for path in self.paths:
-            closest_point = self.find_closest_point(npc_pos, path)
-            dist = self.distance(npc_pos, closest_point)
-            if dist < best_dist:
-                best_dist = dist
-                best_path = path
-                best_start_index = path.index(closest_point)
-
-        return best_path, best_start_index
-    
-    def add_effect(self, pos, color, duration=30, size=15):
-        self.effects.append({
-            "pos": pos.copy(),
-            "color": color,
-            "timer": duration,
-            "max_time": duration,
-            "size": size
-        })
-    
-    def update_effects(self):
-        for effect in self.effects[:]:
-            effect["timer"] -= 1
-            if effect["timer"] <= 0:
-                self.effects.remove(effect)
-
-class Machine:
-    def __init__(self, pos, machine_type):
-        self.pos = pos
-        self.type = machine_type
-        self.data = machine_types[machine_type]
-        self.cooldown = 0
-        self.upgrades = {
-            "speed": 0,
-            "odds": 0,
-            "payout": 0
-        }
-        
-    def get_win_chance(self):
-        base = self.data["win_chance"]
-        upgraded = base + (0.05 * self.upgrades["odds"])
-        return min(upgraded, 0.9)  # Cap at 90% chance
-        
-    def get_win_amount(self):
-        base = self.data["win_amount"]
-        upgraded = base * (1 + (0.2 * self.upgrades["payout"]))
-        return int(upgraded)
-        
-    def get_cooldown(self):
-        base = self.data["cooldown"]
-        upgraded = base * (0.9 ** self.upgrades["speed"])
-        return int(upgraded)
-        
-    def can_upgrade(self, upgrade_type):
-        return self.upgrades[upgrade_type] < 3
-        
-    def upgrade_cost(self, upgrade_type):
-        return 500 * (self.upgrades[upgrade_type] + 1)
-        
-    def upgrade(self, upgrade_type):
-        if self.can_upgrade(upgrade_type):
-            cost = self.upgrade_cost(upgrade_type)
-            if game.money >= cost:
-                game.money -= cost
-                self.upgrades[upgrade_type] += 1
-                return True
-        return False
-
-class NPC:
-    def __init__(self):
-        self.path = random.choice(game.paths)
-        self.path_index = 0
-        self.pos = self.path[0].copy()
-        self.state = "walking_path"  # walking_path, to_machine, playing, leaving
-        self.target_machine = None
-        self.cooldown = 0
-        self.losses = 0
-        self.machines_played = 0
-        self.plays = 0
-        self.max_machines = 2 + casino_upgrades["more_machines"]["current_level"]
-        self.speed = 1.5
-        
-    def update(self):
-        if self.state == "walking_path":
-            self.walk_path()
-        elif self.state == "to_machine":
-            self.move_to_machine()
-        elif self.state == "playing":
-            self.play_machine()
-        elif self.state == "leaving":
-            self.leave_casino()
-    
-    def walk_path(self):
-        if self.path_index < len(self.path) - 1:
-            target = self.path[self.path_index + 1]
-            direction = target - self.pos
-            if direction.length() > self.speed:
-                self.pos += direction.normalize() * self.speed
-            else:
-                self.path_index += 1
-        else:
-            # Choose machine or leave if no machines or not enough money
-            if game.machines and game.money >= 50:
-                self.choose_machine()
-            else:
-                self.state = "leaving"
-                self.set_exit_path()
-    
-    def choose_machine(self):
-        # AI: Choose machine based on best value (win_chance * win_amount / cooldown)
-        best_value = 0
-        best_machine = None
-        
-        for machine in game.machines:
-            # Skip machines that are on cooldown
-            if machine.cooldown > 0:
-                continue
-                
-            win_chance = machine.get_win_chance()
-            win_amount = machine.get_win_amount()
-            cooldown = machine.get_cooldown()
-            
-            value = (win_chance * win_amount) / cooldown
-            
-            if value > best_value:
-                best_value = value
-                best_machine = machine
-        
-        if best_machine:
-            self.target_machine = best_machine
-            self.state = "to_machine"
-        else:
-            self.state = "leaving"
-            self.set_exit_path()
-    
-    def move_to_machine(self):
-        direction = self.target_machine.pos - self.pos
-        if direction.length() > self.speed:
-            self.pos += direction.normalize() * self.speed
-        else:
-            self.state = "playing"
-            self.cooldown = 0
-            self.losses = 0
-            self.plays = 0
-    
-    def play_machine(self):
-        if self.cooldown > 0:
-            self.cooldown -= 1
-        else:
-            cost_to_play = 50
-            
-            if game.money >= cost_to_play:
-                game.money -= cost_to_play
-            else:
-                self.state = "leaving"
-                self.set_exit_path()
-                return
-            
-            # Get machine stats with upgrades applied
-            win_chance = self.target_machine.get_win_chance()
-            win_amount = self.target_machine.get_win_amount()
-            self.target_machine.cooldown = self.target_machine.get_cooldown()
-            
-            if random.random() < win_chance:
-                game.money += win_amount
-                game.total_earnings += win_amount - cost_to_play
-                self.losses = 0
-                game.add_effect(self.pos, GREEN)  # Win effect
-            else:
-                game.total_earnings -= cost_to_play
-                self.losses += 1
-                game.add_effect(self.pos, RED)  # Lose effect
-            
-            self.plays += 1
-            self.cooldown = self.target_machine.cooldown
-            
-            # Check if NPC should leave or try another machine
-            if self.losses >= 3:
-                self.machines_played += 1
-                if self.machines_played >= self.max_machines:
-                    self.state = "leaving"
-                    self.set_exit_path()
-                else:
-                    self.choose_machine()
-                    self.losses = 0
-                    self.plays = 0
-    
-    def leave_casino(self):
-        if self.path_index < len(self.path) - 1:
-            target = self.path[self.path_index + 1]
-            direction = target - self.pos
-            if direction.length() > self.speed:
-                self.pos += direction.normalize() * self.speed
-            else:
-                self.path_index += 1
-        else:
-            if self in game.npcs:
-                game.npcs.remove(self)
-    
-    def set_exit_path(self):
-        self.path, self.path_index = game.shortest_path_to_exit(self.pos)
-
-def spawn_npc():
-    game.npcs.append(NPC())
-    game.total_visitors += 1
+        # Static floor layer and dirty-rect tracking
+        self.renderer = Renderer(self, self.win)
 
 def place_machine():
-    cost = machine_types[game.selected_machine_type]["cost"]
-    pos_rect = pygame.Rect(game.player_pos.x, game.player_pos.y, *MACHINE_SIZE)
-    
-    # Check if position is valid (inside casino and not overlapping walls or other machines)
-    if (game.casino_rect.contains(pos_rect) and 
-        game.money >= cost and
-        not any(wall.colliderect(pos_rect) for wall in game.walls) and
-        not any(machine.pos.x == game.player_pos.x and 
-                machine.pos.y == game.player_pos.y for machine in game.machines)):
-        
-        game.machines.append(Machine(game.player_pos.copy(), game.selected_machine_type))
-        game.money -= cost
+    game.place_machine(game.player_pos, game.selected_machine_type)
 
 def place_wall():
-    pos_rect = pygame.Rect(game.player_pos.x, game.player_pos.y, *MACHINE_SIZE)
-    cost = 100
-    
-    # Check if position is valid (inside casino and not overlapping machines)
-    if (game.casino_rect.contains(pos_rect) and 
-        game.money >= cost and
-        not any(machine.pos.x == game.player_pos.x and 
-                machine.pos.y == game.player_pos.y for machine in game.machines)):
-        
-        game.walls.append(pos_rect)
-        game.money -= cost
+    game.place_wall(game.player_pos)
 
 def draw_window():
-    game.win.fill((50, 50, 50))
-    
-    # Draw casino area
-    pygame.draw.rect(game.win, (100, 100, 100), game.casino_rect)
+    renderer = game.renderer
+    mark = renderer.mark
+    # Floor, walls, paths and machine bodies come from the static layer
+    renderer.begin_frame()
     
-    # Draw walls
-    for wall in game.walls:
-        pygame.draw.rect(game.win, (70, 70, 70), wall)
-    
-    # Draw paths
-    for path in game.paths:
-        for pos in path:
-            pygame.draw.rect(game.win, GRAY, (pos.x, pos.y, 50, 10))
-    
-    # Draw machines
+    # Draw cooldown indicators
     for machine in game.machines:
-        color = machine.data["color"]
-        pygame.draw.rect(game.win, color, (machine.pos.x, machine.pos.y, *MACHINE_SIZE))
-        
-        # Draw cooldown indicator
         if machine.cooldown > 0:
-            cooldown_ratio = machine.cooldown / machine.get_cooldown()
+            cooldown_ratio = machine.cooldown / machine.cooldown_time
             height = int(MACHINE_SIZE[1] * cooldown_ratio)
-            pygame.draw.rect(game.win, (0, 0, 0, 128), 
-                           (machine.pos.x, machine.pos.y + MACHINE_SIZE[1] - height, 
-                            MACHINE_SIZE[0], height))
+            mark(pygame.draw.rect(game.win, (0, 0, 0, 128), 
+                                  (machine.pos.x, machine.pos.y + MACHINE_SIZE[1] - height, 
+                                   MACHINE_SIZE[0], height)))
     
     # Draw NPCs
     for npc in game.npcs:
-        pygame.draw.circle(game.win, RED, (int(npc.pos.x + 15), int(npc.pos.y + 15)), 15)
+        mark(pygame.draw.circle(game.win, RED, (int(npc.pos.x + 15), int(npc.pos.y + 15)), 15))
         
         # Draw state indicator
         if npc.state == "playing":
-            pygame.draw.circle(game.win, YELLOW, (int(npc.pos.x + 15), int(npc.pos.y - 10)), 5)
+            mark(pygame.draw.circle(game.win, YELLOW, (int(npc.pos.x + 15), int(npc.pos.y - 10)), 5))
+    
+    if game.crowd is not None:
+        crowd = game.crowd
+        n = crowd.count
+        for x, y, state in zip(crowd.x[:n].tolist(), crowd.y[:n].tolist(), crowd.state[:n].tolist()):
+            mark(pygame.draw.circle(game.win, RED, (int(x + 15), int(y + 15)), 15))
+            if state == PLAYING:
+                mark(pygame.draw.circle(game.win, YELLOW, (int(x + 15), int(y - 10)), 5))
     
     # Draw effects
-    for effect in game.effects:
-        alpha = int(255 * (effect["timer"] / effect["max_time"]))
-        size = int(effect["size"] * (effect["timer"] / effect["max_time"]))
-        
-        s = pygame.Surface((size*2, size*2), pygame.SRCALPHA)
-        pygame.draw.circle(s, (*effect["color"], alpha), (size, size), size)
-        game.win.blit(s, (effect["pos"].x + 15 - size, effect["pos"].y + 15 - size))
+    renderer.draw_effects(game.effects)
     
     # Draw player
     if game.build_mode:
@@ -467,40 +130,56 @@ def draw_window():
         player_color = BLUE
     else:
         player_color = WHITE
-    pygame.draw.rect(game.win, player_color, (game.player_pos.x, game.player_pos.y, *PLAYER_SIZE))
+    mark(pygame.draw.rect(game.win, player_color, (game.player_pos.x, game.player_pos.y, *PLAYER_SIZE)))
+    prof = game.profiler
+    if prof is not None:
+        prof.lap("draw")
     
     # Draw UI
     draw_ui()
-    
-    pygame.display.update()
+    if prof is not None:
+        prof.lap("ui")
+        draw_profiler(prof)
+        prof.lap("overlay")
+    
+    renderer.present()
+    if prof is not None:
+        prof.lap("present")
 
 def draw_ui():
+    mark = game.renderer.mark
+    text = game.renderer.text
+    
     # Money and selected machine info
-    money_text = game.ui_font.render(f"Cash: ${game.money}", True, WHITE)
-    game.win.blit(money_text, (10, 10))
+    money_text = text(game.ui_font, f"Cash: ${game.money}", WHITE)
+    mark(game.win.blit(money_text, (10, 10)))
     
     machine_info = machine_types[game.selected_machine_type]
-    info_text = game.ui_font.render(f"Selected: {machine_info['name']} (${machine_info['cost']})", True, WHITE)
-    game.win.blit(info_text, (10, 40))
+    info_text = text(game.ui_font, f"Selected: {machine_info['name']} (${machine_info['cost']})", WHITE)
+    mark(game.win.blit(info_text, (10, 40)))
     
     # UI buttons
-    pygame.draw.rect(game.win, LIGHT_GRAY, game.q_rect)
-    q_text = game.ui_font.render("Q", True, BLACK)
+    mark(pygame.draw.rect(game.win, LIGHT_GRAY, game.q_rect))
+    q_text = text(game.ui_font, "Q", BLACK)
     game.win.blit(q_text, (game.q_rect.x + 8, game.q_rect.y + 2))
     
-    pygame.draw.rect(game.win, LIGHT_GRAY, game.s_rect)
-    s_text = game.ui_font.render("S", True, BLACK)
+    mark(pygame.draw.rect(game.win, LIGHT_GRAY, game.s_rect))
+    s_text = text(game.ui_font, "S", BLACK)
     game.win.blit(s_text, (game.s_rect.x + 8, game.s_rect.y + 2))
     
-    pygame.draw.rect(game.win, LIGHT_GRAY, game.u_rect)
-    u_text = game.ui_font.render("U", True, BLACK)
+    mark(pygame.draw.rect(game.win, LIGHT_GRAY, game.u_rect))
+    u_text = text(game.ui_font, "U", BLACK)
     game.win.blit(u_text, (game.u_rect.x + 8, game.u_rect.y + 2))
     
     # Mode indicators
-    mode_text = game.ui_font.render(
+    mode_text = text(
+        game.ui_font,
         f"Mode: {'BUILD' if game.build_mode else 'WALL' if game.wall_mode else 'MOVE'}", 
-        True, WHITE)
-    game.win.blit(mode_text, (WIN_WIDTH - 150, 10))
+        WHITE)
+    mark(game.win.blit(mode_text, (WIN_WIDTH - 150, 10)))
+    speed = SPEEDS[game.speed]
+    speed_text = text(game.ui_font, f"Speed: {'MAX' if speed is None else f'{speed}x'}", WHITE)
+    mark(game.win.blit(speed_text, (WIN_WIDTH - 150, 40)))
     
     # Help menu
     if game.show_help:
@@ -513,79 +192,100 @@ def draw_ui():
     # Upgrades menu
     if game.show_upgrades:
         draw_upgrades_menu()
+    
+    # Machine upgrade popup, over everything else
+    if game.upgrade_machine is not None:
+        draw_machine_upgrades()
+
+MENU_RECT = pygame.Rect(100, 100, 600, 400)
+
+def render_menu(title, lines):
+    # A menu panel with its title and lines; transparent outside the box
+    # where long menus run over it
+    title = game.title_font.render(title, True, WHITE)
+    texts = [game.ui_font.render(line, True, WHITE) for line in lines]
+    width = max([MENU_RECT.width] + [20 + txt.get_width() for txt in texts])
+    height = max([MENU_RECT.height] + [60 + i * 25 + txt.get_height() for i, txt in enumerate(texts)])
+    panel = pygame.Surface((width, height), pygame.SRCALPHA)
+    box = pygame.Rect(0, 0, MENU_RECT.width, MENU_RECT.height)
+    pygame.draw.rect(panel, DARK_BG, box)
+    pygame.draw.rect(panel, WHITE, box, 2)
+    
+    panel.blit(title, (20, 20))
+    for i, txt in enumerate(texts):
+        panel.blit(txt, (20, 60 + i * 25))
+    return panel
+
+def draw_menu(name, key, title, get_lines):
+    panel = game.renderer.panel(name, key, lambda: render_menu(title, get_lines()))
+    game.renderer.mark(game.win.blit(panel, MENU_RECT.topleft))
+
+HELP_LINES = [
+    "Hotkeys:",
+    "WASD - Move player",
+    "B - Toggle build mode",
+    "W - Toggle wall mode",
+    "E - Place selected item (machine/wall)",
+    "1-5 - Select machine type",
+    "[ / ] - Slower / faster (1x, 2x, 8x, max)",
+    "Q - Toggle help menu",
+    "S - Toggle stats menu",
+    "U - Toggle upgrades menu",
+    "F3 / F4 - Profiler overlay / export trace",
+    "F5 / F9 - Quick save / load",
+    "ESC - Quit",
+    "",
+    "Gameplay:",
+    "- Build machines to attract NPCs",
+    "- NPCs play machines and can win/lose",
+    "- Walls can guide NPC traffic",
+    "- Upgrade machines and casino for better performance"
+]
 
 def draw_help_menu():
-    help_rect = pygame.Rect(100, 100, 600, 400)
-    pygame.draw.rect(game.win, DARK_BG, help_rect)
-    pygame.draw.rect(game.win, WHITE, help_rect, 2)
-    
-    title = game.title_font.render("Casino Tycoon - Help", True, WHITE)
-    game.win.blit(title, (help_rect.x + 20, help_rect.y + 20))
-    
-    lines = [
-        "Hotkeys:",
-        "WASD - Move player",
-        "B - Toggle build mode",
-        "W - Toggle wall mode",
-        "E - Place selected item (machine/wall)",
-        "1-5 - Select machine type",
-        "Q - Toggle help menu",
-        "S - Toggle stats menu",
-        "U - Toggle upgrades menu",
-        "ESC - Quit",
-        "",
-        "Gameplay:",
-        "- Build machines to attract NPCs",
-        "- NPCs play machines and can win/lose",
-        "- Walls can guide NPC traffic",
-        "- Upgrade machines and casino for better performance"
-    ]
-    
-    for i, line in enumerate(lines):
-        txt = game.ui_font.render(line, True, WHITE)
-        game.win.blit(txt, (help_rect.x + 20, help_rect.y + 60 + i * 25))
+    draw_menu("help", None, "Casino Tycoon - Help", lambda: HELP_LINES)
+
+def stats_lines():
+    # Latest metrics sample, if metrics are on
+    sample = game.metrics.latest() if game.metrics is not None else None
 
-def draw_stats_menu():
-    stats_rect = pygame.Rect(100, 100, 600, 400)
-    pygame.draw.rect(game.win, DARK_BG, stats_rect)
-    pygame.draw.rect(game.win, WHITE, stats_rect, 2)
-    
-    title = game.title_font.render("Casino Statistics", True, WHITE)
-    game.win.blit(title, (stats_rect.x + 20, stats_rect.y + 20))
-    
     # Machine stats
     machine_stats = []
     for machine_type in MachineType:
-        count = sum(1 for m in game.machines if m.type == machine_type)
+        count = game.machine_counts[machine_type]
         if count > 0:
-            machine_stats.append(f"{machine_type.value.capitalize()}: {count}")
+            line = f"{machine_type.value.capitalize()}: {count}"
+            if sample is not None:
+                name = machine_type.value
+                line += (f" ({sample['occupancy.' + name]:.0%} busy, {sample['seated.' + name]:.0f} playing, "
+                         f"{sample['queued.' + name]:.0f} on the way)")
+            machine_stats.append(line)
     
     # General stats
     lines = [
         f"Total Visitors: {game.total_visitors}",
-        f"Current Visitors: {len(game.npcs)}",
+        f"Current Visitors: {game.visitor_count()}",
         f"Total Earnings: ${game.total_earnings}",
+    ]
+    if sample is not None:
+        lines.append(f"Earnings Rate: ${sample['earnings_per_s'] * 60:.0f}/min")
+    return lines + [
         f"Machines: {len(game.machines)}",
+        f"Seed: {game.seed}",
         "",
         "Machine Breakdown:"
     ] + machine_stats
-    
-    for i, line in enumerate(lines):
-        txt = game.ui_font.render(line, True, WHITE)
-        game.win.blit(txt, (stats_rect.x + 20, stats_rect.y + 60 + i * 25))
 
-def draw_upgrades_menu():
-    upgrades_rect = pygame.Rect(100, 100, 600, 400)
-    pygame.draw.rect(game.win, DARK_BG, upgrades_rect)
-    pygame.draw.rect(game.win, WHITE, upgrades_rect, 2)
-    
-    title = game.title_font.render("Upgrades", True, WHITE)
-    game.win.blit(title, (upgrades_rect.x + 20, upgrades_rect.y + 20))
-    
+def draw_stats_menu():
+    key = (game.total_visitors, game.visitor_count(), game.total_earnings, len(game.machines),
+           game.metrics.written if game.metrics is not None else None)
+    draw_menu("stats", key, "Casino Statistics", stats_lines)
+
+def upgrades_lines():
     # Casino upgrades
     lines = ["Casino Upgrades:"]
-    for i, (key, upgrade) in enumerate(casino_upgrades.items()):
-        level = upgrade["current_level"]
+    for key, upgrade in casino_upgrades.items():
+        level = game.casino_levels[key]
         max_level = upgrade["max_level"]
         cost = upgrade["cost"] * (level + 1)
         
@@ -607,16 +307,69 @@ def draw_upgrades_menu():
         "- Odds: Increases win chance",
         "- Payout: Increases win amount"
     ])
-    
-    for i, line in enumerate(lines):
-        txt = game.ui_font.render(line, True, WHITE)
-        game.win.blit(txt, (upgrades_rect.x + 20, upgrades_rect.y + 60 + i * 25))
+    return lines
+
+def draw_upgrades_menu():
+    key = tuple(game.casino_levels.values())
+    draw_menu("upgrades", key, "Upgrades", upgrades_lines)
+
+# The overlay is re-rendered twice a second, not every frame
+PROFILER_REFRESH = FPS // 2
+
+def render_profiler(rows, notes):
+    # Phase names left-aligned, timings right-aligned in fixed columns
+    font = game.small_font
+    notes = [font.render(note, True, WHITE) for note in notes]
+    width = max([300] + [20 + txt.get_width() for txt in notes])
+    panel = pygame.Surface((width, 20 + 16 * (len(rows) + len(notes))), pygame.SRCALPHA)
+    panel.fill((*DARK_BG, 200))
+    y = 10
+    for name, *values in rows:
+        panel.blit(font.render(name, True, WHITE), (10, y))
+        for i, value in enumerate(values):
+            txt = font.render(value, True, WHITE)
+            panel.blit(txt, (150 + 50 * i - txt.get_width(), y))
+        y += 16
+    for txt in notes:
+        panel.blit(txt, (10, y))
+        y += 16
+    return panel
+
+def draw_profiler(prof):
+    panel = game.renderer.panel("profiler", prof.frame // PROFILER_REFRESH,
+                                lambda: render_profiler(*table(prof)))
+    game.renderer.mark(game.win.blit(panel, (WIN_WIDTH - panel.get_width() - 10, 40)))
+
+def toggle_profiler():
+    global profiler
+    if game.profiler is not None:
+        game.profiler = None
+        return
+    if profiler is None:
+        profiler = Profiler()
+    profiler.begin_frame()
+    game.profiler = profiler
+
+def export_profile():
+    if profiler is None:
+        return
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    rows = list(profiler.rows())
+    for ext in ("csv", "json"):
+        write_later(write_trace, f"profile-{stamp}.{ext}", rows, profiler.summary())
 
 def handle_events():
     for event in pygame.event.get():
         if event.type == pygame.QUIT:
-            pygame.quit()
-            sys.exit()
+            quit_game()
+        
+        # The upgrade popup takes every click and key until it closes
+        if game.upgrade_machine is not None:
+            if event.type == pygame.MOUSEBUTTONDOWN:
+                upgrade_popup_click(pygame.mouse.get_pos())
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+                game.upgrade_machine = None
+            continue
         
         if event.type == pygame.MOUSEBUTTONDOWN:
             mouse_pos = pygame.mouse.get_pos()
@@ -637,11 +390,9 @@ def handle_events():
             
             # Check if clicking on a machine to upgrade (when not in build/wall mode)
             elif not game.build_mode and not game.wall_mode:
-                for machine in game.machines:
-                    machine_rect = pygame.Rect(machine.pos.x, machine.pos.y, *MACHINE_SIZE)
-                    if machine_rect.collidepoint(mouse_pos):
-                        show_machine_upgrades(machine)
-                        break
+                machine = game.machine_at(mouse_pos)
+                if machine:
+                    show_machine_upgrades(machine)
         
         if event.type == pygame.KEYDOWN:
             if event.key == pygame.K_q:
@@ -682,11 +433,24 @@ def handle_events():
                     place_machine()
                 elif game.wall_mode:
                     place_wall()
+            elif event.key == pygame.K_LEFTBRACKET:
+                game.speed = max(game.speed - 1, 0)
+            elif event.key == pygame.K_RIGHTBRACKET:
+                game.speed = min(game.speed + 1, len(SPEEDS) - 1)
+            elif event.key == pygame.K_F3:
+                toggle_profiler()
+            elif event.key == pygame.K_F4:
+                export_profile()
+            elif event.key == pygame.K_F5:
+                write_later(write_file, QUICKSAVE_PATH, dumps(game))
+            elif event.key == pygame.K_F9:
+                resume(QUICKSAVE_PATH)
             elif event.key == pygame.K_ESCAPE:
-                pygame.quit()
-                sys.exit()
+                quit_game()
     
     # Player movement
+    if game.upgrade_machine is not None:
+        return
     keys = pygame.key.get_pressed()
     speed = 4
     if keys[pygame.K_w]:
@@ -708,105 +472,308 @@ def handle_events():
     if game.player_pos.y > game.casino_rect.bottom - PLAYER_SIZE[1]:
         game.player_pos.y = game.casino_rect.bottom - PLAYER_SIZE[1]
 
-def show_machine_upgrades(machine):
-    # Create a popup menu for machine upgrades
-    upgrade_rect = pygame.Rect(200, 200, 400, 200)
-    pygame.draw.rect(game.win, DARK_BG, upgrade_rect)
-    pygame.draw.rect(game.win, WHITE, upgrade_rect, 2)
-    
-    title = game.ui_font.render(f"Upgrade {machine.data['name']}", True, WHITE)
-    game.win.blit(title, (upgrade_rect.x + 20, upgrade_rect.y + 20))
-    
-    # Upgrade options
-    options = [
-        ("Speed", machine.upgrades["speed"], machine.upgrade_cost("speed"), machine.can_upgrade("speed")),
-        ("Odds", machine.upgrades["odds"], machine.upgrade_cost("odds"), machine.can_upgrade("odds")),
-        ("Payout", machine.upgrades["payout"], machine.upgrade_cost("payout"), machine.can_upgrade("payout"))
-    ]
-    
-    option_rects = []
-    for i, (name, level, cost, can_upgrade) in enumerate(options):
+# Machine upgrade popup. Clicking a machine opens it as a modal UI state:
+# the simulation keeps running and the popup is drawn live by the normal
+# frame loop, but clicks and keys go to the popup until it closes.
+UPGRADE_RECT = pygame.Rect(200, 200, 400, 200)
+
+def upgrade_options(machine):
+    # (rect within the popup, name, label, can_upgrade) per upgrade type
+    options = []
+    for i, name in enumerate(("Speed", "Odds", "Payout")):
+        upgrade_type = name.lower()
+        level = machine.level(upgrade_type)
+        can_upgrade = machine.can_upgrade(upgrade_type)
         if level >= 3:
             text = f"{name}: MAX"
         elif can_upgrade:
-            text = f"{name} (Lvl {level + 1}): ${cost}"
+            text = f"{name} (Lvl {level + 1}): ${machine.upgrade_cost(upgrade_type)}"
         else:
             text = f"{name}: MAX"
-        
-        text_surface = game.ui_font.render(text, True, WHITE if can_upgrade else GRAY)
-        rect = pygame.Rect(upgrade_rect.x + 20, upgrade_rect.y + 60 + i * 40, 360, 30)
-        option_rects.append((rect, name, can_upgrade))
-        
-        pygame.draw.rect(game.win, (80, 80, 80) if can_upgrade else (50, 50, 50), rect)
-        game.win.blit(text_surface, (rect.x + 10, rect.y + 5))
+        rect = pygame.Rect(20, 60 + i * 40, 360, 30)
+        options.append((rect, name, text, can_upgrade))
+    return options
+
+def render_machine_upgrades(machine):
+    panel = pygame.Surface(UPGRADE_RECT.size)
+    box = panel.get_rect()
+    pygame.draw.rect(panel, DARK_BG, box)
+    pygame.draw.rect(panel, WHITE, box, 2)
     
-    pygame.display.update()
+    title = game.ui_font.render(f"Upgrade {machine.data['name']}", True, WHITE)
+    panel.blit(title, (20, 20))
     
-    # Wait for player to click an option or click away
-    waiting = True
-    while waiting:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
-            elif event.type == pygame.MOUSEBUTTONDOWN:
-                mouse_pos = pygame.mouse.get_pos()
-                
-                # Check if clicked on an upgrade option
-                clicked = False
-                for rect, name, can_upgrade in option_rects:
-                    if rect.collidepoint(mouse_pos) and can_upgrade:
-                        if machine.upgrade(name.lower()):
-                            waiting = False
-                            clicked = True
-                            break
-                
-                # If clicked outside, close the menu
-                if not clicked and not upgrade_rect.collidepoint(mouse_pos):
-                    waiting = False
-        
-        game.clock.tick(FPS)
+    for rect, name, text, can_upgrade in upgrade_options(machine):
+        text_surface = game.ui_font.render(text, True, WHITE if can_upgrade else GRAY)
+        pygame.draw.rect(panel, (80, 80, 80) if can_upgrade else (50, 50, 50), rect)
+        panel.blit(text_surface, (rect.x + 10, rect.y + 5))
+    return panel
+
+def draw_machine_upgrades():
+    machine = game.upgrade_machine
+    key = (machine.order, machine.speed_level, machine.odds_level, machine.payout_level)
+    panel = game.renderer.panel("machine_upgrades", key, lambda: render_machine_upgrades(machine))
+    game.renderer.mark(game.win.blit(panel, UPGRADE_RECT.topleft))
+
+def show_machine_upgrades(machine):
+    game.upgrade_machine = machine
+
+def upgrade_popup_click(mouse_pos):
+    # Buying an upgrade or clicking outside closes the popup; a click on an
+    # upgrade that can't be afforded leaves it open
+    machine = game.upgrade_machine
+    x, y = mouse_pos[0] - UPGRADE_RECT.x, mouse_pos[1] - UPGRADE_RECT.y
+    for rect, name, text, can_upgrade in upgrade_options(machine):
+        if rect.collidepoint(x, y) and can_upgrade:
+            if machine.upgrade(name.lower()):
+                game.upgrade_machine = None
+            return
+    if not UPGRADE_RECT.collidepoint(mouse_pos):
+        game.upgrade_machine = None
 
 def buy_casino_upgrade(upgrade_key):
-    upgrade = casino_upgrades[upgrade_key]
-    if upgrade["current_level"] < upgrade["max_level"]:
-        cost = upgrade["cost"] * (upgrade["current_level"] + 1)
-        if game.money >= cost:
-            game.money -= cost
-            upgrade["current_level"] += 1
-            return True
-    return False
+    return game.buy_casino_upgrade(upgrade_key)
 
-def main():
+def resume(path, catch_up=False):
+    # Swap in the game saved at `path`; keeps the current one if it can't be
+    # read. With catch_up it is first run on through the time since it was saved.
+    global game
+    try:
+        loaded = load(path, make=GameState)
+    except (OSError, ValueError, struct.error) as e:
+        print(f"Could not load {path}: {e}")
+        return False
+    if game is not None:
+        loaded.profiler = game.profiler
+        loaded.metrics = game.metrics
+        loaded.speed = game.speed
+    game = loaded
+    if catch_up:
+        catch_up_offline(time.time() - game.saved_at)
+    autosaver.last_tick = game.tick
+    start_recording()
+    return True
+
+def catch_up_offline(seconds):
+    # Step through `seconds` of game time (capped at MAX_CATCH_UP) with no
+    # rendering and effects off, showing progress between chunks
+    ticks = int(min(max(seconds, 0), MAX_CATCH_UP) * FPS)
+    effects = game.effects_enabled
+    game.effects_enabled = False
+    done = 0
+    while done < ticks:
+        chunk = min(CATCH_UP_CHUNK, ticks - done)
+        game.advance(chunk)
+        done += chunk
+        pygame.event.pump()
+        game.win.fill(DARK_BG)
+        progress = game.title_font.render(f"Catching up: {done / ticks:.0%} of {ticks // FPS // 60} min away",
+                                          True, WHITE)
+        game.win.blit(progress, progress.get_rect(center=(WIN_WIDTH // 2, WIN_HEIGHT // 2)))
+        pygame.display.flip()
+    game.effects_enabled = effects
+    game.renderer.invalidate()
+
+def step_flat_out(budget):
+    # Max speed: as many ticks as fit in `budget` seconds
+    deadline = time.perf_counter() + budget
+    while time.perf_counter() < deadline:
+        if game.profiler is not None:
+            game.profiler.lap("idle")
+        game.step()
+
+def start_recording():
+    global recording
+    if recording is not None:
+        recording.close()
+    os.makedirs(REPLAY_DIR, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{game.tick}.evlog"
+    recording = replay.record(os.path.join(REPLAY_DIR, name), game)
+
+def write_later(write, *args):
+    # Disk writes go to the I/O pool under the async loop, and happen right
+    # away otherwise
+    if io_pool is None:
+        write(*args)
+        return
+    future = io_pool.submit(write, *args)
+    future.add_done_callback(report_write_error)
+
+def report_write_error(future):
+    if future.exception() is not None:
+        write_failed(future.exception())
+
+def write_failed(error):
+    # The game carries on; later writes try again
+    print(f"Background write failed: {error}")
+
+def check_recording():
+    # The event log's writer thread stops at the first disk error, which is
+    # reported once; the next recording (after a quick load) starts a new
+    # file.
+    global log_error
+    error = recording.out.error
+    if error is not None and error is not log_error:
+        write_failed(error)
+        log_error = error
+
+def quit_game():
+    if io_pool is not None:
+        io_pool.shutdown()
+    autosaver.flush()
+    save(game, AUTOSAVE_PATH)
+    recording.close()
+    if game.metrics is not None:
+        game.metrics.close()
+    pygame.quit()
+    sys.exit()
+
+autosaver = Autosaver(AUTOSAVE_PATH)
+recording = None
+# The last event log write error reported
+log_error = None
+# Made on first use and kept while the overlay is off
+profiler = None
+# Thread running disk writes for the async loop (None under main())
+io_pool = None
+
+def start():
+    # Carry on from the autosave, or start a new game
     global game
-    game = GameState()
+    game = None
+    if not (os.path.exists(AUTOSAVE_PATH) and resume(AUTOSAVE_PATH, catch_up=True)):
+        game = GameState()
+        start_recording()
+    # Published in shared memory; follow them with metrics.py
+    game.metrics = Metrics(METRICS_NAME)
+
+def main():
+    start()
+    accumulator = 0
     
     while True:
-        game.clock.tick(FPS)
-        
-        # Spawn NPCs periodically
-        game.spawn_timer += 1
-        if game.spawn_timer > game.spawn_rate:
-            spawn_npc()
-            game.spawn_timer = 0
+        elapsed = game.clock.tick(FPS)
+        if game.profiler is not None:
+            game.profiler.lap("idle")
         
         # Update game state
         handle_events()
-        
-        # Update NPCs
-        for npc in game.npcs[:]:
-            npc.update()
-        
-        # Update machine cooldowns
-        for machine in game.machines:
-            if machine.cooldown > 0:
-                machine.cooldown -= 1
-        
-        # Update effects
-        game.update_effects()
+        prof = game.profiler
+        if prof is not None:
+            prof.lap("events")
+        
+        # Advance the simulation in fixed ticks, `speed` of them per TICK_MS
+        speed = SPEEDS[game.speed]
+        if speed is None:
+            step_flat_out(MAX_SPEED_BUDGET)
+            accumulator = 0
+        else:
+            accumulator += elapsed * speed
+            ticks = 0
+            while accumulator >= TICK_MS and ticks < MAX_TICKS_PER_FRAME * speed:
+                game.step()
+                accumulator -= TICK_MS
+                ticks += 1
+            if ticks == MAX_TICKS_PER_FRAME * speed:
+                # Too far behind (window dragged, debugger paused); drop the backlog
+                accumulator = 0
+        
+        # Pack a snapshot now, write it out in the background
+        autosaver.update(game)
+        check_recording()
+        if prof is not None:
+            prof.lap("autosave")
         
         # Draw everything
         draw_window()
+        if prof is not None:
+            prof.end_frame(game)
+
+# The asyncio loop (--async). Ticks and frames are separate coroutines on
+# the one thread, each sleeping until it is next due; autosaves and event
+# log flushes are background tasks. Whatever touches the disk (autosaves,
+# quick saves, profile exports and the event log) is handed to a worker
+# thread, and the coroutines never wait on it, so a slow disk can't cost
+# frames. A write that is still going when the next one is due holds up
+# only that next write: autosaves skip ahead, everything else queues.
+
+async def run_ticks():
+    # Every tick that has come due, up to MAX_TICKS_PER_FRAME (times the
+    # speed) at a time
+    loop = asyncio.get_running_loop()
+    due = loop.time()
+    while True:
+        speed = SPEEDS[game.speed]
+        if speed is None:
+            # In slices, so a frame that comes due isn't kept waiting
+            step_flat_out(MAX_SPEED_BUDGET / 8)
+            due = loop.time()
+            await asyncio.sleep(0)
+            continue
+        ticks = 0
+        while loop.time() >= due and ticks < MAX_TICKS_PER_FRAME * speed:
+            if game.profiler is not None:
+                game.profiler.lap("idle")
+            game.step()
+            due += TICK_MS / 1000 / speed
+            ticks += 1
+        if ticks == MAX_TICKS_PER_FRAME * speed:
+            # Too far behind; drop the backlog
+            due = loop.time()
+        await asyncio.sleep(due - loop.time())
+
+async def run_frames():
+    loop = asyncio.get_running_loop()
+    due = loop.time()
+    while True:
+        prof = game.profiler
+        if prof is not None:
+            prof.lap("idle")
+        handle_events()
+        if prof is not None:
+            prof.lap("events")
+        draw_window()
+        if prof is not None:
+            prof.end_frame(game)
+        due = max(due + 1 / FPS, loop.time())
+        await asyncio.sleep(due - loop.time())
+
+async def run_autosave():
+    # Autosaver's schedule; the snapshot is packed here and written on the
+    # pool, and the next one isn't taken until that write is done
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(1)
+        if game.tick - autosaver.last_tick >= autosaver.interval:
+            autosaver.last_tick = game.tick
+            try:
+                await loop.run_in_executor(io_pool, write_file, autosaver.path, dumps(game))
+            except Exception as e:
+                write_failed(e)
+
+async def run_log_flush():
+    # Write out the event log every second rather than once a keyframe
+    while True:
+        await asyncio.sleep(1)
+        try:
+            recording.flush()
+        except Exception as e:
+            write_failed(e)
+        check_recording()
+
+async def main_async():
+    global io_pool
+    io_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="io")
+    start()
+    # Held on to so they aren't collected while they sleep
+    background = [asyncio.create_task(task) for task in (run_ticks(), run_autosave(), run_log_flush())]
+    await run_frames()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Casino Tycoon")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="run the asyncio loop, with disk writes in the background")
+    if parser.parse_args().use_async:
+        asyncio.run(main_async())
+    else:
+        main()
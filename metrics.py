@@ -0,0 +1,235 @@
+import argparse
+import os
+import struct
+import sys
+import time
+from array import array
+from multiprocessing import resource_tracker, shared_memory
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from simulation import MachineType, NPC_STATES, FPS
+
+# Live metrics. Every `interval` ticks Simulation.step samples one row of
+# FIELDS (cash, earnings and play rates, visitors, NPCs per state, and per
+# machine type the machines placed, the fraction on cooldown and the NPCs
+# queued for and seated at them) into a fixed-size ring of float64 rows.
+# Everything sampled comes from the game's running tallies, so a sample
+# costs the same however big the floor is (the crowd engine's per-state
+# counts are a bincount of its arrays).
+#
+# With a name the ring lives in a shared memory block that other processes
+# open with MetricsReader, e.g. a dashboard; the game never waits on them.
+# The block is a header, the field names and the ring:
+#
+#     HEADER    magic, version, fields, capacity, interval, seq, written
+#     names     fields x NAME_SIZE bytes, NUL-padded ASCII
+#     rows      capacity x fields float64, row `written % capacity` next
+#
+# `seq` is a sequence lock: odd while a row is being written, bumped back
+# to even once `written` counts it. Readers copy what they need and start
+# over if seq was odd or has moved on meanwhile.
+#
+#     python metrics.py                   # follow the running game's metrics
+#     python metrics.py --csv out.csv     # dump the whole ring
+
+MAGIC = b"CTMX"
+METRICS_VERSION = 1
+HEADER = struct.Struct("<4sHHIIQQ")
+SEQ_OFFSET = 16
+WRITTEN_OFFSET = 24
+NAME_SIZE = 32
+
+METRICS_NAME = "casino-metrics"
+METRICS_CAPACITY = 3600         # an hour at one sample a second
+
+FIELDS = (["tick", "money", "earnings", "earnings_per_s", "plays_per_s", "visitors", "total_visitors"]
+          + [f"npcs.{state}" for state in NPC_STATES]
+          + [f"{kind}.{machine_type.value}" for kind in ("machines", "occupancy", "queued", "seated")
+             for machine_type in MachineType])
+
+def block_size(fields, capacity):
+    return HEADER.size + fields * NAME_SIZE + fields * capacity * 8
+
+def tallies(game):
+    # NPCs per state, and per machine type those queued (walking to one)
+    # and seated (playing one)
+    if game.crowd is None:
+        return game.npc_states, game.machine_npcs["to_machine"], game.machine_npcs["playing"]
+    from crowd import TO_MACHINE, PLAYING
+    per_type = {}
+    for state in (TO_MACHINE, PLAYING):
+        counts = per_type[state] = {machine_type: 0 for machine_type in MachineType}
+        for machine, count in zip(game.machines, game.crowd.machine_counts(state)):
+            counts[machine.type] += count
+    return game.crowd.state_counts(), per_type[TO_MACHINE], per_type[PLAYING]
+
+class MetricsReader:
+    # A metrics ring, opened by name from another process
+    def __init__(self, name=METRICS_NAME):
+        try:
+            self.block = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Before Python 3.13 attaching registers the block with this
+            # process's resource tracker, which would unlink it at exit
+            self.block = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(self.block._name, "shared_memory")
+        self._open(self.block.buf)
+
+    def _open(self, buf):
+        self.buf = buf
+        magic, version, fields, capacity, self.interval, _, _ = HEADER.unpack_from(buf)
+        if magic != MAGIC or version != METRICS_VERSION:
+            raise ValueError("not a version 1 metrics block")
+        self.capacity = capacity
+        names = buf[HEADER.size:HEADER.size + fields * NAME_SIZE].tobytes()
+        self.fields = [names[i:i + NAME_SIZE].rstrip(b"\0").decode() for i in range(0, len(names), NAME_SIZE)]
+        start = HEADER.size + fields * NAME_SIZE
+        self.rows = buf[start:start + fields * capacity * 8].cast("d")
+
+    @property
+    def written(self):
+        return struct.unpack_from("<Q", self.buf, WRITTEN_OFFSET)[0]
+
+    def read(self, count=None):
+        # The last `count` rows (all kept rows by default), oldest first, as
+        # lists of floats in `fields` order
+        n = len(self.fields)
+        while True:
+            seq = struct.unpack_from("<Q", self.buf, SEQ_OFFSET)[0]
+            if seq & 1:
+                time.sleep(0)
+                continue
+            written = self.written
+            kept = min(written, self.capacity)
+            count = kept if count is None else min(count, kept)
+            first = written - count
+            data = array("d")
+            for row in range(first, written):
+                at = (row % self.capacity) * n
+                data.extend(self.rows[at:at + n])
+            if struct.unpack_from("<Q", self.buf, SEQ_OFFSET)[0] == seq:
+                return [data[i:i + n].tolist() for i in range(0, len(data), n)]
+
+    def latest(self):
+        # The newest row as a {field: value} dict, or None before the first
+        rows = self.read(1)
+        return dict(zip(self.fields, rows[0])) if rows else None
+
+    def close(self):
+        self.rows.release()
+        self.buf.release()
+        self.block.close()
+
+class Metrics(MetricsReader):
+    # The game's side: owns the ring and writes a row every `interval`
+    # ticks. Without a name the ring is a private buffer in this process.
+    def __init__(self, name=None, capacity=METRICS_CAPACITY, interval=FPS):
+        size = block_size(len(FIELDS), capacity)
+        self.block = None
+        if name is None:
+            buf = memoryview(bytearray(size))
+        else:
+            try:
+                self.block = shared_memory.SharedMemory(name=name, create=True, size=size)
+            except FileExistsError:
+                # Left behind by a game that didn't shut down cleanly
+                stale = shared_memory.SharedMemory(name=name)
+                stale.close()
+                stale.unlink()
+                self.block = shared_memory.SharedMemory(name=name, create=True, size=size)
+            buf = self.block.buf
+        HEADER.pack_into(buf, 0, MAGIC, METRICS_VERSION, len(FIELDS), capacity, interval, 0, 0)
+        for i, field in enumerate(FIELDS):
+            buf[HEADER.size + i * NAME_SIZE:HEADER.size + i * NAME_SIZE + len(field)] = field.encode()
+        self._open(buf)
+        self.seq = 0
+        self.last_tick = None
+        self.last_earnings = 0
+        self.last_plays = 0
+
+    def sample(self, game):
+        tick = game.tick
+        elapsed = (tick - self.last_tick) / FPS if self.last_tick is not None else 0
+        if elapsed > 0:
+            earnings_rate = (game.total_earnings - self.last_earnings) / elapsed
+            plays_rate = (game.total_plays - self.last_plays) / elapsed
+        else:
+            # First sample, or a different game was loaded since the last
+            earnings_rate = plays_rate = 0.0
+        self.last_tick = tick
+        self.last_earnings = game.total_earnings
+        self.last_plays = game.total_plays
+
+        states, queued, seated = tallies(game)
+        counts = game.machine_counts
+        busy = game.busy_counts
+        row = [tick, game.money, game.total_earnings, earnings_rate, plays_rate,
+               game.visitor_count(), game.total_visitors]
+        row += [states[state] for state in NPC_STATES]
+        row += [counts[machine_type] for machine_type in MachineType]
+        row += [busy[machine_type] / counts[machine_type] if counts[machine_type] else 0.0
+                for machine_type in MachineType]
+        row += [queued[machine_type] for machine_type in MachineType]
+        row += [seated[machine_type] for machine_type in MachineType]
+        self.write(row)
+
+    def write(self, row):
+        written = self.written
+        at = (written % self.capacity) * len(FIELDS)
+        struct.pack_into("<Q", self.buf, SEQ_OFFSET, self.seq + 1)
+        self.rows[at:at + len(FIELDS)] = array("d", row)
+        struct.pack_into("<Q", self.buf, WRITTEN_OFFSET, written + 1)
+        self.seq += 2
+        struct.pack_into("<Q", self.buf, SEQ_OFFSET, self.seq)
+
+    def close(self):
+        block = self.block
+        self.rows.release()
+        self.buf.release()
+        if block is not None:
+            block.close()
+            block.unlink()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Follow or dump a running game's live metrics")
+    parser.add_argument("--name", default=METRICS_NAME, help="shared memory block the game publishes to")
+    parser.add_argument("--fields", default="money,earnings_per_s,visitors,npcs.playing,occupancy.slot",
+                        help="comma-separated fields to follow")
+    parser.add_argument("--csv", default=None, metavar="PATH", help="write every kept row to PATH and exit")
+    args = parser.parse_args(argv)
+
+    try:
+        reader = MetricsReader(args.name)
+    except FileNotFoundError:
+        parser.error(f"no metrics published as {args.name!r}; is the game running?")
+
+    try:
+        if args.csv:
+            with open(args.csv, "w") as f:
+                f.write(",".join(reader.fields) + "\n")
+                for row in reader.read():
+                    f.write(",".join(f"{value:g}" for value in row) + "\n")
+            return 0
+
+        fields = args.fields.split(",")
+        unknown = [field for field in fields if field not in reader.fields]
+        if unknown:
+            parser.error(f"unknown fields: {', '.join(unknown)} (have: {', '.join(reader.fields)})")
+        columns = [reader.fields.index(field) for field in fields]
+        print("".join(f"{field:>16}" for field in fields))
+        seen = reader.written
+        while True:
+            written = reader.written
+            if written != seen:
+                for row in reader.read(min(written - seen, reader.capacity)):
+                    print("".join(f"{row[i]:>16.6g}" for i in columns), flush=True)
+                seen = written
+            time.sleep(reader.interval / FPS / 2)
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        reader.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
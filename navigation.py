@@ -0,0 +1,281 @@
+import heapq
+import math
+
+import pygame
+
+# Grid navigation over the casino floor. Walls and machines block the cells
+# they overlap; routes are found with A* over the 8-connected grid (no corner
+# cutting), string-pulled into straight segments and cached per
+# (start cell, goal cell).
+#
+# Placing an obstacle can only make routes longer, so a cached route stays
+# optimal unless it crosses one of the newly blocked cells; those routes are
+# the only ones dropped. Failed searches stay failed and are kept too, until
+# an obstacle lands on their start or goal cell.
+#
+# For crowds sharing destinations there are also flow fields: one Dijkstra
+# field per goal cell that any number of NPCs sample in O(1) per tick.
+#
+# Positions passed in and returned are NPC positions (sprite top-left); the
+# grid works on the sprite centre, `agent_offset` further along each axis.
+
+SQRT2 = math.sqrt(2)
+NEIGHBOURS = [(1, 0, 1.0), (-1, 0, 1.0), (0, 1, 1.0), (0, -1, 1.0),
+              (1, 1, SQRT2), (1, -1, SQRT2), (-1, 1, SQRT2), (-1, -1, SQRT2)]
+
+class NavGrid:
+    def __init__(self, rect, cell_size, agent_offset=0):
+        self.rect = pygame.Rect(rect)
+        self.cell_size = cell_size
+        self.agent_offset = agent_offset
+        self.cols = max(1, self.rect.width // cell_size)
+        self.rows = max(1, self.rect.height // cell_size)
+        # Ids of the obstacles overlapping each cell; empty means walkable
+        self.blockers = {}
+        self.next_blocker = 0
+        self.version = 0
+
+        self.routes = {}
+        # Cells each cached route passes through, and the reverse
+        self.route_swept = {}
+        self.route_cells = {}
+        self.searches = 0
+        # Flow fields per goal cell, rebuilt lazily once `version` moves on
+        self.fields = {}
+        self.fields_built = 0
+
+    def cell_of(self, x, y):
+        cx = int((x - self.rect.left) // self.cell_size)
+        cy = int((y - self.rect.top) // self.cell_size)
+        return min(max(cx, 0), self.cols - 1), min(max(cy, 0), self.rows - 1)
+
+    def center(self, cell):
+        half = self.cell_size / 2
+        return (self.rect.left + cell[0] * self.cell_size + half,
+                self.rect.top + cell[1] * self.cell_size + half)
+
+    def cells_in(self, rect):
+        rect = pygame.Rect(rect).clip(self.rect)
+        if not rect.width or not rect.height:
+            return []
+        left, top = self.cell_of(rect.left, rect.top)
+        right, bottom = self.cell_of(rect.right - 1, rect.bottom - 1)
+        return [(cx, cy) for cx in range(left, right + 1) for cy in range(top, bottom + 1)]
+
+    def block(self, rect):
+        # Mark an obstacle; returns the cells it covers
+        blocker = self.next_blocker
+        self.next_blocker += 1
+        cells = self.cells_in(rect)
+        for cell in cells:
+            self.blockers.setdefault(cell, set()).add(blocker)
+        self.version += 1
+        self.invalidate(cells)
+        return cells
+
+    def invalidate(self, cells):
+        for cell in cells:
+            for key in self.route_cells.pop(cell, ()):
+                self.routes.pop(key, None)
+                # Forget the route everywhere else too, so that a later
+                # route under the same key isn't dropped for cells it
+                # doesn't cross
+                for other in self.route_swept.pop(key, ()):
+                    keys = self.route_cells.get(other)
+                    if keys:
+                        keys.discard(key)
+
+    def passable(self, cell, allowed):
+        blockers = self.blockers.get(cell)
+        return not blockers or blockers <= allowed
+
+    def _allowed(self, start, goal):
+        # An NPC standing on (or heading into) a machine may cross that
+        # machine's own cells
+        return self.blockers.get(start, set()) | self.blockers.get(goal, set())
+
+    def _search(self, start, goal, allowed):
+        self.searches += 1
+        cols, rows = self.cols, self.rows
+        gx, gy = goal
+
+        def heuristic(cell):
+            dx = abs(cell[0] - gx)
+            dy = abs(cell[1] - gy)
+            return (dx + dy) + (SQRT2 - 2) * min(dx, dy)
+
+        open_heap = [(heuristic(start), 0.0, start)]
+        came_from = {start: None}
+        cost = {start: 0.0}
+        while open_heap:
+            _, g, cell = heapq.heappop(open_heap)
+            if cell == goal:
+                path = []
+                while cell is not None:
+                    path.append(cell)
+                    cell = came_from[cell]
+                path.reverse()
+                return path
+            if g > cost[cell]:
+                continue
+            x, y = cell
+            for dx, dy, step in NEIGHBOURS:
+                nx, ny = x + dx, y + dy
+                if not (0 <= nx < cols and 0 <= ny < rows):
+                    continue
+                neighbour = (nx, ny)
+                if not self.passable(neighbour, allowed):
+                    continue
+                if dx and dy and not (self.passable((nx, y), allowed) and self.passable((x, ny), allowed)):
+                    continue
+                new_cost = g + step
+                if new_cost < cost.get(neighbour, float("inf")):
+                    cost[neighbour] = new_cost
+                    came_from[neighbour] = cell
+                    heapq.heappush(open_heap, (new_cost + heuristic(neighbour), new_cost, neighbour))
+        return None
+
+    def _segment_cells(self, a, b):
+        # Cells swept by the straight line between two cell centres
+        ax, ay = self.center(a)
+        bx, by = self.center(b)
+        steps = max(1, int(math.hypot(bx - ax, by - ay) / (self.cell_size / 4)))
+        cells = []
+        for i in range(steps + 1):
+            t = i / steps
+            cell = self.cell_of(ax + (bx - ax) * t, ay + (by - ay) * t)
+            if not cells or cells[-1] != cell:
+                cells.append(cell)
+        return cells
+
+    def _in_sight(self, a, b, allowed):
+        # Whether every cell _segment_cells(a, b) would return is passable,
+        # walking the same sample points but stopping at the first blocked one
+        ax, ay = self.center(a)
+        bx, by = self.center(b)
+        size = self.cell_size
+        steps = max(1, int(math.hypot(bx - ax, by - ay) / (size / 4)))
+        # Points between two cell centres are on the grid, so cell_of's
+        # clamping can be skipped
+        left, top = self.rect.left, self.rect.top
+        blockers = self.blockers
+        last = None
+        for i in range(steps + 1):
+            t = i / steps
+            cell = (int((ax + (bx - ax) * t - left) // size), int((ay + (by - ay) * t - top) // size))
+            if cell != last:
+                cell_blockers = blockers.get(cell)
+                if cell_blockers and not cell_blockers <= allowed:
+                    return False
+                last = cell
+        return True
+
+    def _smooth(self, path, allowed):
+        # Greedy string pulling: from each corner, extend the line of sight
+        # along the path one cell at a time until it is blocked. Neighbouring
+        # path cells are always in sight of each other.
+        corners = [path[0]]
+        swept = set(path)
+        end = len(path) - 1
+        i = 0
+        while i < end:
+            j = i + 1
+            while j < end and self._in_sight(path[i], path[j + 1], allowed):
+                j += 1
+            swept.update(self._segment_cells(path[i], path[j]))
+            corners.append(path[j])
+            i = j
+        return corners, swept
+
+    def cell_route(self, start, goal):
+        key = (start, goal)
+        if key in self.routes:
+            return self.routes[key]
+        allowed = self._allowed(start, goal)
+        path = self._search(start, goal, allowed)
+        if path is None:
+            # Kept until something changes at either end
+            corners, swept = None, (start, goal)
+        else:
+            corners, swept = self._smooth(path, allowed)
+        self.routes[key] = corners
+        self.route_swept[key] = swept
+        for cell in swept:
+            self.route_cells.setdefault(cell, set()).add(key)
+        return corners
+
+    def route(self, start_pos, dest_pos):
+        # Waypoints from start_pos to dest_pos, both included. Falls back to
+        # a straight line when the destination can't be reached.
+        offset = self.agent_offset
+        start = self.cell_of(start_pos[0] + offset, start_pos[1] + offset)
+        goal = self.cell_of(dest_pos[0] + offset, dest_pos[1] + offset)
+        corners = self.cell_route(start, goal)
+
+        waypoints = [pygame.Vector2(start_pos)]
+        if corners:
+            for cell in corners[1:-1]:
+                x, y = self.center(cell)
+                waypoints.append(pygame.Vector2(x - offset, y - offset))
+        waypoints.append(pygame.Vector2(dest_pos))
+        return waypoints
+
+    def flow_field(self, goal):
+        field = self.fields.get(goal)
+        if field is None or field.version != self.version:
+            field = self.fields[goal] = FlowField(self, goal)
+        return field
+
+    def flow_target(self, pos, dest):
+        # Where an NPC at `pos` heading for `dest` should steer this tick,
+        # and whether that point is `dest` itself
+        offset = self.agent_offset
+        cell = self.cell_of(pos[0] + offset, pos[1] + offset)
+        goal = self.cell_of(dest[0] + offset, dest[1] + offset)
+        if cell == goal:
+            return dest, True
+        step = self.flow_field(goal).step[cell[1] * self.cols + cell[0]]
+        if step < 0:
+            return dest, True
+        x, y = self.center((step % self.cols, step // self.cols))
+        return (x - offset, y - offset), False
+
+class FlowField:
+    # Dijkstra integration field towards one goal cell. `step` holds, for
+    # every cell (flat index cy * cols + cx), the flat index of the next cell
+    # on a shortest route to the goal, or -1 where the goal is unreachable.
+    # Blocked cells get a way out but never carry routes through them.
+    def __init__(self, nav, goal):
+        self.goal = goal
+        self.version = nav.version
+        nav.fields_built += 1
+        cols, rows = nav.cols, nav.rows
+        allowed = nav.blockers.get(goal, set())
+        walkable = [nav.passable((i % cols, i // cols), allowed) for i in range(cols * rows)]
+
+        start = goal[1] * cols + goal[0]
+        dist = [float("inf")] * (cols * rows)
+        step = [-1] * (cols * rows)
+        dist[start] = 0.0
+        step[start] = start
+        heap = [(0.0, start)]
+        while heap:
+            d, i = heapq.heappop(heap)
+            if d > dist[i]:
+                continue
+            x, y = i % cols, i // cols
+            for dx, dy, cost in NEIGHBOURS:
+                nx, ny = x + dx, y + dy
+                if not (0 <= nx < cols and 0 <= ny < rows):
+                    continue
+                j = ny * cols + nx
+                if not walkable[i] and walkable[j]:
+                    continue
+                if dx and dy and not (walkable[y * cols + nx] and walkable[ny * cols + x]):
+                    continue
+                new_dist = d + cost
+                if new_dist < dist[j]:
+                    dist[j] = new_dist
+                    step[j] = i
+                    heapq.heappush(heap, (new_dist, j))
+        self.step = step
@@ -0,0 +1,192 @@
+import csv
+import gc
+import json
+import math
+import sys
+import time
+from array import array
+from collections import deque
+
+# Frame profiler. The main loop and Simulation.step call lap(name) at each
+# phase boundary, which charges the time since the previous lap to `name`;
+# a frame's phases therefore add up to the whole frame. Steps run several
+# times in a frame when catching up, and their phases add up across them.
+#
+# Every phase keeps a rolling histogram over the last `window` frames, with
+# log-spaced buckets HISTOGRAM_GROWTH apart, so p50/p95/p99 are read off the
+# bucket counts (to within 5%) without sorting anything. The raw per-frame
+# rows (phase times, entity counts, allocations) are kept for the same
+# window and can be exported as CSV or JSON.
+#
+# When off, the game's profiler attribute is None and every lap site is one
+# `is not None` check.
+
+HISTOGRAM_BASE = 1e-6           # seconds; everything faster lands in bucket 0
+HISTOGRAM_GROWTH = 1.05
+HISTOGRAM_BUCKETS = 300         # up to ~2.2 s
+LOG_GROWTH = math.log(HISTOGRAM_GROWTH)
+
+PERCENTILES = (0.5, 0.95, 0.99)
+
+def bucket_of(seconds):
+    if seconds <= HISTOGRAM_BASE:
+        return 0
+    return min(int(math.log(seconds / HISTOGRAM_BASE) / LOG_GROWTH) + 1, HISTOGRAM_BUCKETS - 1)
+
+def bucket_limit(bucket):
+    # Upper edge of a bucket, in seconds
+    return HISTOGRAM_BASE * HISTOGRAM_GROWTH ** bucket
+
+class RollingHistogram:
+    def __init__(self, window):
+        self.counts = [0] * HISTOGRAM_BUCKETS
+        self.ring = array("H", [0]) * window
+        self.pos = 0
+        self.n = 0
+
+    def add(self, seconds):
+        bucket = bucket_of(seconds)
+        ring = self.ring
+        if self.n == len(ring):
+            self.counts[ring[self.pos]] -= 1
+        else:
+            self.n += 1
+        ring[self.pos] = bucket
+        self.counts[bucket] += 1
+        self.pos = (self.pos + 1) % len(ring)
+
+    def percentile(self, q):
+        if not self.n:
+            return 0.0
+        rank = q * self.n
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return bucket_limit(bucket)
+        return bucket_limit(HISTOGRAM_BUCKETS - 1)
+
+class Profiler:
+    def __init__(self, window=3600):
+        self.window = window
+        self.phases = []
+        self.histograms = {}
+        self.frame_histogram = RollingHistogram(window)
+        self.current = {}
+        # One row per frame: (frame, seconds, {phase: seconds}, counts, allocations)
+        self.frames = deque(maxlen=window)
+        self.frame = 0
+        self.frame_start = self.last = time.perf_counter()
+        self.blocks = sys.getallocatedblocks()
+        self.collections = self._collections()
+
+    @staticmethod
+    def _collections():
+        return sum(stats["collections"] for stats in gc.get_stats())
+
+    def begin_frame(self):
+        self.frame_start = self.last = time.perf_counter()
+
+    def lap(self, name):
+        now = time.perf_counter()
+        current = self.current
+        current[name] = current.get(name, 0.0) + now - self.last
+        self.last = now
+
+    def end_frame(self, game):
+        now = time.perf_counter()
+        total = now - self.frame_start
+        current = self.current
+        for name, seconds in current.items():
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = RollingHistogram(self.window)
+                self.phases.append(name)
+            histogram.add(seconds)
+        # Phases that didn't run this frame (no simulation steps) count as 0
+        for name in self.phases:
+            if name not in current:
+                self.histograms[name].add(0.0)
+        self.frame_histogram.add(total)
+
+        blocks = sys.getallocatedblocks()
+        collections = self._collections()
+        counts = entity_counts(game)
+        self.frames.append((self.frame, total, current, counts,
+                            (blocks - self.blocks, collections - self.collections)))
+        self.blocks = blocks
+        self.collections = collections
+        self.current = {}
+        self.frame += 1
+        self.frame_start = self.last = now
+
+    def percentiles(self, name=None):
+        # (p50, p95, p99) in seconds for one phase, or whole frames
+        histogram = self.frame_histogram if name is None else self.histograms[name]
+        return tuple(histogram.percentile(q) for q in PERCENTILES)
+
+    def summary(self):
+        def row(name):
+            return dict(zip(("p50", "p95", "p99"), self.percentiles(name)))
+        last = self.frames[-1] if self.frames else None
+        return {
+            "frames": len(self.frames),
+            "frame": row(None),
+            "phases": {name: row(name) for name in self.phases},
+            "counts": last[3] if last else {},
+        }
+
+    def rows(self):
+        # The kept frames as flat dicts, times in milliseconds
+        for frame, total, phases, counts, (blocks, collections) in self.frames:
+            row = {"frame": frame, "frame_ms": total * 1e3}
+            for name in self.phases:
+                row[f"{name}_ms"] = phases.get(name, 0.0) * 1e3
+            row.update(counts)
+            row["alloc_blocks"] = blocks
+            row["gc_collections"] = collections
+            yield row
+
+    def export(self, path):
+        write_trace(path, list(self.rows()), self.summary())
+
+def write_trace(path, rows, summary):
+    # CSV for a .csv path, otherwise JSON with a summary up front
+    with open(path, "w", newline="") as f:
+        if path.endswith(".csv"):
+            if rows:
+                writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+                writer.writeheader()
+                writer.writerows(rows)
+        else:
+            json.dump({"summary": summary, "frames": rows}, f)
+
+def entity_counts(game):
+    counts = {
+        "visitors": game.visitor_count(),
+        "machines": len(game.machines),
+        "effects": len(game.effects),
+        "routes": len(game.nav.routes),
+    }
+    # The windowed game's text cache, as a whole-session hit rate
+    renderer = getattr(game, "renderer", None)
+    if renderer is not None:
+        counts["text_hit_pct"] = round(renderer.text_cache.hit_rate * 100)
+    return counts
+
+def table(profiler):
+    # Rows of (phase, p50, p95, p99) in milliseconds, header first, and a
+    # few lines on the latest frame
+    rows = [("phase (ms)", "p50", "p95", "p99")]
+    for name in profiler.phases + [None]:
+        rows.append((name or "frame",) + tuple(f"{p * 1e3:.2f}" for p in profiler.percentiles(name)))
+    notes = []
+    if profiler.frames:
+        _, _, _, counts, (blocks, collections) = profiler.frames[-1]
+        notes.append(" ".join(f"{key} {value}" for key, value in counts.items()))
+        notes.append(f"alloc {blocks:+d} blocks, gc {collections}")
+    return rows, notes
+
+def report(profiler):
+    rows, notes = table(profiler)
+    return [f"{name:10}" + "".join(f"{value:>8}" for value in values) for name, *values in rows] + notes
@@ -0,0 +1,163 @@
+from collections import OrderedDict
+
+import pygame
+
+from simulation import GRAY, GREEN, RED, MACHINE_SIZE, NPC_RADIUS
+
+# Layered rendering. The floor, walls, path tiles and machine bodies live on a
+# pre-rendered background surface that is only redrawn when the layout
+# changes. Everything else (NPCs, effects, cooldown bars, the player, UI) is
+# drawn on top each frame and its rect recorded with `mark`; next frame those
+# rects are patched back from the background, and only the old and new rects
+# are passed to display.update.
+#
+# A big crowd makes thousands of tiny rects, at which point one full blit and
+# flip is cheaper; past DIRTY_LIMIT the frame is presented whole.
+
+DIRTY_LIMIT = 300
+TEXT_CACHE_SIZE = 256
+
+class TextCache:
+    # Bounded LRU of rendered text surfaces keyed by (font, text, color).
+    # Static labels are rendered once; changing ones (the cash readout)
+    # cycle through and fall out of the cache as they go stale.
+    def __init__(self, size=TEXT_CACHE_SIZE):
+        self.size = size
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, color):
+        key = (font, text, color)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+        self.misses += 1
+        surface = self.surfaces[key] = font.render(text, True, color)
+        if len(self.surfaces) > self.size:
+            self.surfaces.popitem(last=False)
+        return surface
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+class EffectSprites:
+    # Every frame of the win/lose effect (a circle shrinking and fading out
+    # as its timer runs down), pre-rendered into one strip per
+    # (color, size, duration). frame(effect) returns the strip, the area of
+    # the current frame within it and the frame's offset from the NPC.
+    def __init__(self):
+        self.strips = {}
+
+    def build(self, color, size, duration):
+        frames = []
+        x = 0
+        for timer in range(duration + 1):
+            radius = int(size * (timer / duration)) if duration else 0
+            frames.append((pygame.Rect(x, 0, radius * 2, radius * 2), NPC_RADIUS - radius))
+            x += radius * 2
+        strip = pygame.Surface((max(x, 1), max(size * 2, 1)), pygame.SRCALPHA)
+        for timer, (area, _) in enumerate(frames):
+            if area.width:
+                alpha = int(255 * (timer / duration))
+                radius = area.width // 2
+                pygame.draw.circle(strip, (*color, alpha), (area.x + radius, radius), radius)
+        self.strips[(color, size, duration)] = strip, frames
+        return strip, frames
+
+    def frame(self, effect):
+        key = (effect.color, effect.size, effect.max_time)
+        strip, frames = self.strips.get(key) or self.build(*key)
+        area, offset = frames[min(effect.timer, effect.max_time)]
+        return strip, area, offset
+
+class Renderer:
+    def __init__(self, game, surface):
+        self.game = game
+        self.surface = surface
+        self.background = pygame.Surface(surface.get_size())
+        self.layout_version = None
+        # Rects drawn over the background this frame and the last one
+        self.drawn = []
+        self.previous = []
+        self.full_redraw = True
+
+        # The win and lose effects are built up front; others on first use
+        self.effect_sprites = EffectSprites()
+        for color in (GREEN, RED):
+            self.effect_sprites.build(color, 15, 30)
+
+        self.text_cache = TextCache()
+        # Pre-rendered menu panels: name -> (key, surface)
+        self.panels = {}
+
+    def text(self, font, text, color):
+        return self.text_cache.render(font, text, color)
+
+    def panel(self, name, key, build):
+        # The surface for panel `name`, re-rendered by build() only when
+        # `key` (the values shown on it) differs from last time
+        cached = self.panels.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        surface = build()
+        self.panels[name] = (key, surface)
+        return surface
+
+    def build_background(self):
+        game = self.game
+        bg = self.background
+        bg.fill((50, 50, 50))
+        pygame.draw.rect(bg, (100, 100, 100), game.casino_rect)
+        for wall in game.walls:
+            pygame.draw.rect(bg, (70, 70, 70), wall)
+        for path in game.paths:
+            for pos in path:
+                pygame.draw.rect(bg, GRAY, (pos.x, pos.y, 50, 10))
+        for machine in game.machines:
+            pygame.draw.rect(bg, machine.data["color"], (machine.pos.x, machine.pos.y, *MACHINE_SIZE))
+        self.layout_version = game.layout_version
+
+    def invalidate(self):
+        # Something drew outside the renderer; repaint everything next frame
+        self.full_redraw = True
+
+    def begin_frame(self):
+        if self.layout_version != self.game.layout_version:
+            self.build_background()
+            self.full_redraw = True
+        if self.full_redraw or len(self.drawn) > DIRTY_LIMIT:
+            self.surface.blit(self.background, (0, 0))
+            self.full_redraw = True
+        else:
+            for rect in self.drawn:
+                self.surface.blit(self.background, rect, rect)
+        self.previous = self.drawn
+        self.drawn = []
+
+    def mark(self, rect):
+        # Record a rect drawn this frame; returns it for chaining
+        self.drawn.append(rect)
+        return rect
+
+    def draw_effects(self, effects):
+        # One batched blits call for every live effect
+        frame = self.effect_sprites.frame
+        batch = []
+        for effect in effects:
+            strip, area, offset = frame(effect)
+            if area.width:
+                batch.append((strip, (effect.pos.x + offset, effect.pos.y + offset), area))
+        if batch:
+            self.drawn.extend(self.surface.blits(batch))
+
+    def present(self):
+        if self.full_redraw or len(self.drawn) > DIRTY_LIMIT:
+            pygame.display.update()
+        else:
+            pygame.display.update(self.previous + self.drawn)
+        self.full_redraw = False
@@ -0,0 +1,392 @@
+import argparse
+import bisect
+import os
+import struct
+import sys
+import time
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+try:
+    import numpy as np
+except ImportError:  # recording works without numpy; reading a log needs it
+    np = None
+
+import pygame
+
+from simulation import (
+    Simulation, MachineType, UPGRADE_TYPES, casino_upgrades, fill_floor, FPS,
+)
+from crowd import COST_TO_PLAY
+from savegame import HEADER, SAVE_VERSION, BackgroundFile, dumps, loads, save
+
+# Event-sourced replays. While a game has an EventLog attached, every state
+# change is appended to a binary log: visitor spawns, machine and wall
+# placements, machine and casino upgrades and every play with its outcome.
+# Every `keyframe_interval` ticks the log also takes a full savegame
+# snapshot.
+#
+# Everything random comes from the game's seeded streams, so the log only
+# has to be *applied* for player input: seeking to a tick loads the nearest
+# keyframe at or before it and steps the game headless from there, applying
+# the recorded input events at their ticks. Spawns by the spawn timer and
+# play outcomes come out of the stepping again; they are in the log for
+# `verify`, which replays every keyframe interval, and the ticks after the
+# last keyframe, and reports the first tick where the regenerated events or
+# state stop matching the recording, and
+# for `ledger`, which rebuilds the cash balance over time from the events
+# alone, without stepping at all.
+#
+# The file is a header and a sequence of chunks, each an EVENTS block of
+# fixed-size records or one KEYFRAME. Events are buffered in memory and
+# written out as a chunk before every keyframe, so the log on disk is
+# always whole up to its last keyframe.
+#
+#     python replay.py record game.evlog --ticks 36000 --machines 10
+#     python replay.py seek game.evlog --tick 20000 [--save out.sav]
+#     python replay.py verify game.evlog
+#     python replay.py ledger game.evlog --every 3600
+#
+# Casino upgrade levels belong to each game and come back with its keyframe,
+# so a replay can run in the same process as a live game.
+
+MAGIC = b"CTEV"
+LOG_VERSION = 1
+
+LOG_HEADER = struct.Struct("<4sHH")   # magic, version, savegame version
+CHUNK = struct.Struct("<BQI")         # chunk kind, tick, byte length
+# tick, kind, flags, code, target, x, y, value
+EVENT = struct.Struct("<IBBHiddq")
+
+EVENTS, KEYFRAME = 1, 2
+
+# Event kinds. `value` is always the change in cash; `code` the machine
+# type, upgrade type or casino upgrade; `target` the machine's order, or
+# the number of visitors for SPAWN.
+SPAWN, PLACE_MACHINE, PLACE_WALL, MACHINE_UPGRADE, CASINO_UPGRADE, PLAY = range(1, 7)
+KIND_NAMES = {SPAWN: "spawn", PLACE_MACHINE: "place_machine", PLACE_WALL: "place_wall",
+              MACHINE_UPGRADE: "machine_upgrade", CASINO_UPGRADE: "casino_upgrade", PLAY: "play"}
+
+# INPUT: recorded between steps, i.e. by the player rather than the
+# simulation; WON: a play that paid out
+INPUT, WON = 1, 2
+
+MACHINE_TYPES = list(MachineType)
+CASINO_UPGRADES = list(casino_upgrades)
+
+if np is not None:
+    EVENT_DTYPE = np.dtype([("tick", "<u4"), ("kind", "u1"), ("flags", "u1"), ("code", "<u2"),
+                            ("target", "<i4"), ("x", "<f8"), ("y", "<f8"), ("value", "<i8")])
+    assert EVENT_DTYPE.itemsize == EVENT.size
+
+class EventLog:
+    # Records into the binary file object `out`; attach() starts it off with
+    # a keyframe of the game as it is. With no `out` events just collect in
+    # `buf` and no keyframes are taken.
+    def __init__(self, out=None, keyframe_interval=FPS * 60):
+        self.out = out
+        self.keyframe_interval = keyframe_interval
+        self.buf = bytearray()
+        self.first_tick = 0
+        self.stepping = False
+        if out is not None:
+            out.write(LOG_HEADER.pack(MAGIC, LOG_VERSION, SAVE_VERSION))
+
+    def attach(self, game):
+        game.log = self
+        self.keyframe(game)
+
+    def detach(self, game):
+        self.flush()
+        game.log = None
+
+    def _record(self, game, kind, code=0, target=0, x=0.0, y=0.0, value=0, flags=0):
+        if not self.stepping:
+            flags |= INPUT
+        if not self.buf:
+            self.first_tick = game.tick
+        self.buf += EVENT.pack(game.tick, kind, flags, code, target, x, y, value)
+
+    def spawn(self, game, count):
+        self._record(game, SPAWN, target=count)
+
+    def place_machine(self, game, pos, machine_type, cost):
+        self._record(game, PLACE_MACHINE, MACHINE_TYPES.index(machine_type), x=pos.x, y=pos.y, value=-cost)
+
+    def place_wall(self, game, pos, cost):
+        self._record(game, PLACE_WALL, x=pos.x, y=pos.y, value=-cost)
+
+    def machine_upgrade(self, game, machine, upgrade_type, cost):
+        self._record(game, MACHINE_UPGRADE, UPGRADE_TYPES.index(upgrade_type), machine.order, value=-cost)
+
+    def casino_upgrade(self, game, upgrade_key, cost):
+        self._record(game, CASINO_UPGRADE, CASINO_UPGRADES.index(upgrade_key), value=-cost)
+
+    def play(self, game, machine, won, payout):
+        self._record(game, PLAY, target=machine.order, value=payout - COST_TO_PLAY, flags=WON if won else 0)
+
+    def plays(self, game, targets, wins, payouts):
+        # A batch of plays from the crowd engine, packed in one go
+        records = np.zeros(len(targets), EVENT_DTYPE)
+        records["tick"] = game.tick
+        records["kind"] = PLAY
+        records["flags"] = np.where(wins, WON, 0) | (0 if self.stepping else INPUT)
+        records["target"] = targets
+        records["value"] = np.where(wins, payouts, 0) - COST_TO_PLAY
+        if not self.buf:
+            self.first_tick = game.tick
+        self.buf += records.tobytes()
+
+    def begin_step(self):
+        self.stepping = True
+
+    def end_step(self, game):
+        self.stepping = False
+        if game.tick % self.keyframe_interval == 0:
+            self.keyframe(game)
+
+    def keyframe(self, game):
+        if self.out is None:
+            return
+        self.flush()
+        snapshot = dumps(game)
+        self.out.write(CHUNK.pack(KEYFRAME, game.tick, len(snapshot)))
+        self.out.write(snapshot)
+        self.out.flush()
+
+    def flush(self):
+        if self.out is None:
+            return
+        if self.buf:
+            self.out.write(CHUNK.pack(EVENTS, self.first_tick, len(self.buf)))
+            self.out.write(self.buf)
+            self.buf = bytearray()
+        self.out.flush()
+
+    def close(self):
+        self.flush()
+        if self.out is not None:
+            self.out.close()
+
+def record(path, game, keyframe_interval=FPS * 60):
+    # Start logging `game` to a new file at `path`; the file is written on
+    # a background thread, so keyframes never wait on the disk
+    log = EventLog(BackgroundFile(open(path, "wb")), keyframe_interval)
+    log.attach(game)
+    return log
+
+class Replay:
+    # A recorded log, read into memory: keyframes by tick and every event as
+    # one structured array in recording order
+    def __init__(self, data):
+        if np is None:
+            raise RuntimeError("reading event logs requires numpy")
+        magic, version, save_version = LOG_HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("not a casino event log")
+        if version != LOG_VERSION:
+            raise ValueError(f"unsupported event log version {version} (expected {LOG_VERSION})")
+        if save_version != SAVE_VERSION:
+            raise ValueError(f"keyframes are save version {save_version} (expected {SAVE_VERSION})")
+
+        self.keyframe_ticks = []
+        self.keyframes = []
+        blocks = []
+        pos = LOG_HEADER.size
+        # A chunk cut short by a crash is dropped along with anything after it
+        while pos + CHUNK.size <= len(data):
+            kind, tick, length = CHUNK.unpack_from(data, pos)
+            pos += CHUNK.size
+            if pos + length > len(data):
+                break
+            if kind == EVENTS:
+                blocks.append(np.frombuffer(data, EVENT_DTYPE, length // EVENT.size, pos))
+            elif kind == KEYFRAME:
+                if self.keyframe_ticks and tick < self.keyframe_ticks[-1]:
+                    raise ValueError(f"keyframe at tick {tick} is out of order")
+                self.keyframe_ticks.append(tick)
+                self.keyframes.append(bytes(data[pos:pos + length]))
+            pos += length
+        if not self.keyframes:
+            raise ValueError("event log has no keyframes")
+        self.events = np.concatenate(blocks) if blocks else np.zeros(0, EVENT_DTYPE)
+        self.inputs = self.events[(self.events["flags"] & INPUT) != 0]
+
+    @property
+    def end_tick(self):
+        last = self.keyframe_ticks[-1]
+        return max(last, int(self.events["tick"].max()) + 1 if len(self.events) else last)
+
+    def keyframe_before(self, tick):
+        # Index of the last keyframe at or before `tick`
+        if tick < self.keyframe_ticks[0]:
+            raise ValueError(f"tick {tick} is before the first keyframe at tick {self.keyframe_ticks[0]}")
+        return bisect.bisect_right(self.keyframe_ticks, tick) - 1
+
+    def restore(self, i, make=Simulation):
+        return loads(self.keyframes[i], make)
+
+    def seek(self, tick, make=Simulation, effects=False):
+        # The game as it was at the start of `tick`, before that tick's input.
+        # Effects are visual only and switched off unless asked for.
+        i = self.keyframe_before(tick)
+        game = self.restore(i, make)
+        game.effects_enabled = game.effects_enabled and effects
+        self.play_to(game, tick)
+        return game
+
+    def play_to(self, game, tick):
+        # Step `game` up to `tick`, applying the recorded input on the way
+        ticks = self.inputs["tick"]
+        lo = np.searchsorted(ticks, game.tick, "left")
+        hi = np.searchsorted(ticks, tick, "left")
+        for event in self.inputs[lo:hi].tolist():
+            game.advance(event[0] - game.tick)
+            apply_event(game, event)
+        game.advance(tick - game.tick)
+
+    def ledger(self, every):
+        # (tick, cash) every `every` ticks from the first keyframe on, from
+        # the cash changes in the log alone
+        start = self.keyframe_ticks[0]
+        money = loads(self.keyframes[0]).money
+        events = self.events[self.events["tick"] >= start]
+        ticks = np.arange(start, self.end_tick + 1, every)
+        # Events recorded at tick t happened before the game reached t + 1
+        spent = np.concatenate(([0], np.cumsum(events["value"])))
+        cash = money + spent[np.searchsorted(events["tick"], ticks, "left")]
+        return ticks, cash
+
+    def verify(self, make=Simulation):
+        # Replay every keyframe interval from its keyframe and compare the
+        # events it generates and the state it ends in with the recording,
+        # then replay the tail from the last keyframe to `end_tick` and
+        # compare its events. Returns (tick, reason) for the first mismatch,
+        # or None.
+        last = len(self.keyframes) - 1
+        for i in range(last + 1):
+            start = self.keyframe_ticks[i]
+            end = self.keyframe_ticks[i + 1] if i < last else self.end_tick
+            if start == end:
+                continue
+            game = self.restore(i, make)
+            game.log = EventLog()
+            self.play_to(game, end)
+
+            recorded = self.events[(self.events["tick"] >= start) & (self.events["tick"] < end)]
+            replayed = np.frombuffer(game.log.buf, EVENT_DTYPE)
+            n = min(len(recorded), len(replayed))
+            differ = np.nonzero(recorded[:n] != replayed[:n])[0]
+            if len(differ):
+                return int(recorded["tick"][differ[0]]), "events differ"
+            if i == last:
+                # A recording can stop partway through its last tick, after
+                # the input and before the step, so the tail only has to be
+                # the start of what the replay generates
+                if len(recorded) > n:
+                    return int(recorded["tick"][n]), "events differ"
+                break
+            if len(recorded) != len(replayed):
+                extra = recorded if len(recorded) > n else replayed
+                return int(extra["tick"][n]), "events differ"
+            # Everything but the header, which has the wall-clock save time
+            if dumps(game)[HEADER.size:] != self.keyframes[i + 1][HEADER.size:]:
+                return end, "state differs from the keyframe"
+        return None
+
+def apply_event(game, event):
+    # Perform a recorded input event on `game`, given as an event record tuple
+    tick, kind, flags, code, target, x, y, value = event
+    if kind == SPAWN:
+        game.spawn_npc(target)
+    elif kind == PLACE_MACHINE:
+        game.place_machine(pygame.Vector2(x, y), MACHINE_TYPES[code])
+    elif kind == PLACE_WALL:
+        game.place_wall(pygame.Vector2(x, y))
+    elif kind == MACHINE_UPGRADE:
+        game.machines[target].upgrade(UPGRADE_TYPES[code])
+    elif kind == CASINO_UPGRADE:
+        game.buy_casino_upgrade(CASINO_UPGRADES[code])
+    else:
+        raise ValueError(f"{KIND_NAMES.get(kind, kind)} events are not player input")
+
+def load(path):
+    with open(path, "rb") as f:
+        return Replay(f.read())
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record, seek and check casino event logs")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rec = commands.add_parser("record", help="record a headless run")
+    rec.add_argument("log")
+    rec.add_argument("--ticks", type=int, default=FPS * 60 * 60, help="ticks to run (default: one game hour)")
+    rec.add_argument("--seed", type=int, default=None)
+    rec.add_argument("--machines", type=int, default=10, help="slot machines to place first")
+    rec.add_argument("--crowd", type=int, default=0, metavar="N",
+                     help="use the NumPy crowd engine, starting with N visitors")
+    rec.add_argument("--keyframes", type=int, default=FPS * 60, help="ticks between keyframes")
+
+    seek = commands.add_parser("seek", help="restore the game at a tick")
+    seek.add_argument("log")
+    seek.add_argument("--tick", type=int, required=True)
+    seek.add_argument("--save", default=None, help="write the game there as a save file")
+
+    verify = commands.add_parser("verify", help="replay the whole log against its keyframes")
+    verify.add_argument("log")
+
+    ledger = commands.add_parser("ledger", help="cash over time, from the events alone")
+    ledger.add_argument("log")
+    ledger.add_argument("--every", type=int, default=FPS * 60, help="ticks between rows")
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        game = Simulation(crowd=args.crowd > 0, seed=args.seed)
+        game.effects_enabled = False
+        fill_floor(game, args.machines)
+        log = record(args.log, game, args.keyframes)
+        if args.crowd:
+            game.spawn_npc(args.crowd)
+        start = time.perf_counter()
+        game.advance(args.ticks)
+        log.close()
+        print(f"Recorded {args.ticks} ticks (seed {game.seed}) in {time.perf_counter() - start:.2f}s")
+        return 0
+
+    start = time.perf_counter()
+    replay = load(args.log)
+    loaded = time.perf_counter() - start
+    counts = ", ".join(f"{np.count_nonzero(replay.events['kind'] == kind)} {name}"
+                       for kind, name in KIND_NAMES.items())
+    print(f"{len(replay.keyframes)} keyframes, ticks {replay.keyframe_ticks[0]}-{replay.end_tick}; "
+          f"events: {counts} (read in {loaded * 1e3:.0f} ms)")
+
+    if args.command == "seek":
+        if args.tick < replay.keyframe_ticks[0]:
+            parser.error(f"tick {args.tick} is before the first keyframe at tick {replay.keyframe_ticks[0]}")
+        start = time.perf_counter()
+        game = replay.seek(args.tick)
+        elapsed = time.perf_counter() - start
+        stepped = args.tick - replay.keyframe_ticks[replay.keyframe_before(args.tick)]
+        print(f"Tick {game.tick}: cash ${game.money}, earnings ${game.total_earnings}, "
+              f"{game.visitor_count()} visitors, {len(game.machines)} machines")
+        print(f"Stepped {stepped} ticks from the keyframe in {elapsed * 1e3:.0f} ms "
+              f"({stepped / FPS / max(elapsed, 1e-9):.0f}x real time)")
+        if args.save:
+            save(game, args.save)
+    elif args.command == "verify":
+        start = time.perf_counter()
+        mismatch = replay.verify()
+        elapsed = time.perf_counter() - start
+        if mismatch is None:
+            print(f"Replay matches the recording ({elapsed:.2f}s)")
+            return 0
+        print("Replay diverges at tick {}: {}".format(*mismatch))
+        return 1
+    elif args.command == "ledger":
+        for tick, cash in zip(*replay.ledger(args.every)):
+            print(f"{tick:>10}  ${cash}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+import random
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; streams fall back to random.Random
+    np = None
+
+# Seeded random streams for a simulation. One seed is split with NumPy's
+# SeedSequence into independent named streams, so drawing more from one
+# (say, extra outcomes from a busier floor) never shifts another (which lane
+# the next visitor takes). A run is bit-reproducible from its seed.
+#
+# Draws come from blocks generated BLOCK_SIZE at a time: scalar draws index
+# into a pre-converted list and the crowd engine slices whole arrays off the
+# same block, so both consume a stream in the same order.
+#
+# Without numpy each stream is a random.Random seeded from (seed, name);
+# still reproducible, but not the same numbers as with numpy.
+
+STREAMS = ("spawns", "outcomes", "routing")
+BLOCK_SIZE = 4096
+
+class BufferedStream:
+    def __init__(self, seed_sequence, block_size=BLOCK_SIZE):
+        self.generator = np.random.Generator(np.random.PCG64(seed_sequence))
+        self.block_size = block_size
+        # Generator state the current block was drawn from; with the block's
+        # length and pos it is all a save needs to rebuild the block
+        self.block_state = self.generator.bit_generator.state
+        self.block = np.empty(0)
+        self.values = []
+        self._seek(0)
+
+    def _refill(self, size=None):
+        self.block_state = self.generator.bit_generator.state
+        self.block = self.generator.random(self.block_size if size is None else size)
+        self.values = self.block.tolist()
+        self._seek(0)
+
+    def restore(self, block_state, size, pos):
+        # Back to `pos` draws into a block of `size` drawn from `block_state`
+        # (no block yet when size is 0)
+        self.generator.bit_generator.state = block_state
+        if size:
+            self._refill(size)
+        else:
+            self.block_state = block_state
+            self.block = np.empty(0)
+            self.values = []
+        self._seek(pos)
+
+    def _seek(self, pos):
+        # Scalar draws go through a list iterator's __next__, the cheapest
+        # way to hand out one float at a time from Python
+        values = iter(self.values)
+        values.__setstate__(pos)
+        self._values = values
+        self._next = values.__next__
+
+    @property
+    def pos(self):
+        # Draws used from the current block
+        return len(self.values) - self._values.__length_hint__()
+
+    def random(self):
+        # One float in [0, 1)
+        try:
+            return self._next()
+        except StopIteration:
+            self._refill()
+            return self._next()
+
+    def uniform(self, count):
+        # `count` floats in [0, 1) as an array
+        parts = []
+        pos = self.pos
+        while count:
+            if pos == len(self.values):
+                self._refill()
+                pos = 0
+            take = min(count, len(self.values) - pos)
+            parts.append(self.block[pos:pos + take])
+            pos += take
+            count -= take
+        self._seek(pos)
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts) if parts else np.empty(0)
+
+    def index(self, n):
+        # A uniform choice from range(n)
+        return int(self.random() * n)
+
+class FallbackStream:
+    def __init__(self, seed, name):
+        self.generator = random.Random(f"{seed}/{name}")
+        self.random = self.generator.random
+
+    def index(self, n):
+        return int(self.random() * n)
+
+class RandomStreams:
+    # spawns: where new visitors enter; outcomes: machine wins and losses;
+    # routing: reserved for route choices, drawn from by nothing yet
+    def __init__(self, seed=None):
+        if np is None:
+            self.seed = seed if seed is not None else random.SystemRandom().getrandbits(64)
+            for name in STREAMS:
+                setattr(self, name, FallbackStream(self.seed, name))
+            return
+        root = np.random.SeedSequence(seed)
+        self.seed = root.entropy
+        for name, child in zip(STREAMS, root.spawn(len(STREAMS))):
+            setattr(self, name, BufferedStream(child))
@@ -0,0 +1,401 @@
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # only saves with a crowd or numpy RNG streams need it
+    np = None
+
+import pygame
+
+from simulation import Simulation, NPC, MachineType, casino_upgrades, build_stat_table, FPS, SPAWN_ORDER
+from crowd import STATE_NAMES, SAVED_FIELDS
+from rng import STREAMS
+
+# Binary save games. A save is a fixed header followed by sections in a fixed
+# order, all little-endian and packed with struct/array; crowd arrays are
+# written as raw NumPy buffers. Everything a running Simulation needs to
+# carry on exactly where it stopped is stored: cash and totals, casino
+# upgrade levels, walls, machines with levels and cooldowns, NPCs mid-route,
+# the crowd engine's arrays, live effects, the nav grid's route cache and
+# the RNG streams' positions. Restoring and stepping on gives the same game,
+# tick for tick, as never having saved.
+#
+# fork(game) is a snapshot restored straight away: two independent copies
+# of one game, e.g. to try two layouts from the same moment.
+#
+# SAVE_VERSION changes whenever the layout below does; older saves are
+# refused rather than misread.
+
+MAGIC = b"CTSV"
+SAVE_VERSION = 2
+
+HEADER = struct.Struct("<4sHHdQ")      # magic, version, flags, saved_at, tick
+GAME = struct.Struct("<qqqqidQQ")      # money, earnings, visitors, plays, spawn timer/rate, versions
+MACHINE = struct.Struct("<ddBBBBi")    # x, y, type, speed, odds, payout, cooldown
+NPC_RECORD = struct.Struct("<ddddBiiiiiii")
+EFFECT = struct.Struct("<ddBBBiii")    # x, y, color, timer, max_time, size
+ROUTE = struct.Struct("<hhhhh")        # start cell, goal cell, corner count (-1: no route)
+PCG64_STATE = struct.Struct("<16s16sBI")
+
+CROWD, FLOW_FIELDS, EFFECTS_ENABLED = 1, 2, 4
+
+MACHINE_TYPES = list(MachineType)
+
+class Writer:
+    def __init__(self):
+        self.buf = bytearray()
+
+    def pack(self, fmt, *values):
+        self.buf += fmt.pack(*values)
+
+    def count(self, n):
+        self.buf += struct.pack("<I", n)
+
+    def blob(self, data):
+        data = bytes(data)
+        self.count(len(data))
+        self.buf += data
+
+    def text(self, value):
+        self.blob(value.encode())
+
+    def bigint(self, value):
+        self.blob(value.to_bytes((value.bit_length() + 8) // 8, "little", signed=True))
+
+class Reader:
+    def __init__(self, data):
+        self.view = memoryview(data)
+        self.pos = 0
+
+    def unpack(self, fmt):
+        values = fmt.unpack_from(self.view, self.pos)
+        self.pos += fmt.size
+        return values
+
+    def count(self):
+        (n,) = struct.unpack_from("<I", self.view, self.pos)
+        self.pos += 4
+        return n
+
+    def blob(self):
+        n = self.count()
+        data = self.view[self.pos:self.pos + n]
+        self.pos += n
+        return data
+
+    def array(self, typecode):
+        values = array(typecode)
+        values.frombytes(self.blob())
+        return values
+
+    def text(self):
+        return bytes(self.blob()).decode()
+
+    def bigint(self):
+        return int.from_bytes(self.blob(), "little", signed=True)
+
+def dumps(game):
+    out = Writer()
+    flags = ((CROWD if game.crowd is not None else 0) |
+             (FLOW_FIELDS if game.flow_fields else 0) |
+             (EFFECTS_ENABLED if game.effects_enabled else 0))
+    out.pack(HEADER, MAGIC, SAVE_VERSION, flags, time.time(), game.tick)
+    out.bigint(game.seed)
+    out.pack(GAME, game.money, game.total_earnings, game.total_visitors, game.total_plays,
+             game.spawn_timer, game.spawn_rate, game.stats_version, game.layout_version)
+
+    out.count(len(game.casino_levels))
+    for key, level in game.casino_levels.items():
+        out.text(key)
+        out.count(level)
+
+    out.blob(array("i", [v for wall in game.walls for v in wall]).tobytes())
+
+    out.count(len(game.machines))
+    for m in game.machines:
+        out.pack(MACHINE, m.pos.x, m.pos.y, MACHINE_TYPES.index(m.type),
+                 m.speed_level, m.odds_level, m.payout_level, m.cooldown)
+
+    out.count(len(game.npcs))
+    # In update order, which loading keeps
+    for npc in sorted(game.npcs, key=SPAWN_ORDER):
+        target = npc.target_machine.order if npc.target_machine is not None else -1
+        out.pack(NPC_RECORD, npc.pos.x, npc.pos.y, npc.dest.x, npc.dest.y,
+                 STATE_NAMES.index(npc.state), npc.path_index, target, npc.cooldown,
+                 npc.losses, npc.machines_played, npc.plays, npc.max_machines)
+        if npc.path is None:
+            out.blob(b"")
+        else:
+            out.blob(array("d", [v for point in npc.path for v in point]).tobytes())
+
+    if game.crowd is not None:
+        _dump_crowd(out, game.crowd)
+
+    effects = list(game.effects)
+    out.count(len(effects))
+    for effect in effects:
+        out.pack(EFFECT, effect.pos.x, effect.pos.y, *effect.color,
+                 effect.timer, effect.max_time, effect.size)
+
+    _dump_routes(out, game.nav)
+
+    streams = game.rng
+    out.count(len(STREAMS))
+    for name in STREAMS:
+        out.text(name)
+        _dump_stream(out, getattr(streams, name))
+    return bytes(out.buf)
+
+def _dump_crowd(out, crowd):
+    n = crowd.count
+    out.count(n)
+    out.blob(array("i", crowd.goal_cells).tobytes())
+    for field in SAVED_FIELDS:
+        out.blob(getattr(crowd, field)[:n].tobytes())
+
+def _dump_routes(out, nav):
+    # The route cache is part of the game state: a cached route that an
+    # obstacle didn't touch is kept, and may differ from a fresh search
+    out.count(len(nav.routes))
+    for (start, goal), corners in nav.routes.items():
+        out.pack(ROUTE, *start, *goal, -1 if corners is None else len(corners))
+        out.blob(array("h", [v for cell in corners or () for v in cell]).tobytes())
+        cells = sorted(nav.route_swept[start, goal])
+        out.blob(array("h", [v for cell in cells for v in cell]).tobytes())
+
+def _dump_stream(out, stream):
+    if hasattr(stream, "block"):
+        # The state the current block came from, its length and the draws
+        # used; the block itself is regenerated on load
+        state = stream.block_state
+        out.pack(PCG64_STATE,
+                 state["state"]["state"].to_bytes(16, "little"),
+                 state["state"]["inc"].to_bytes(16, "little"),
+                 state["has_uint32"], state["uinteger"])
+        out.count(len(stream.values))
+        out.count(stream.pos)
+    else:
+        version, internal, gauss = stream.generator.getstate()
+        out.count(version)
+        out.blob(array("I", internal).tobytes())
+        out.blob(b"" if gauss is None else struct.pack("<d", gauss))
+
+def loads(data, make=Simulation):
+    # Rebuild a game from dumps() output. `make(crowd=, seed=, flow_fields=)`
+    # creates the empty game to fill in (GameState for the windowed game).
+    src = Reader(data)
+    magic, version, flags, saved_at, tick = src.unpack(HEADER)
+    if magic != MAGIC:
+        raise ValueError("not a casino save file")
+    if version != SAVE_VERSION:
+        raise ValueError(f"unsupported save version {version} (expected {SAVE_VERSION})")
+    seed = src.bigint()
+    money, earnings, visitors, plays, spawn_timer, spawn_rate, stats_version, layout_version = src.unpack(GAME)
+
+    game = make(crowd=bool(flags & CROWD), seed=seed, flow_fields=bool(flags & FLOW_FIELDS))
+    # Set before any machine is added, so they start with the right stats
+    for _ in range(src.count()):
+        key = src.text()
+        level = src.count()
+        if key in casino_upgrades:
+            game.casino_levels[key] = level
+    game.stat_table = build_stat_table(game.casino_levels)
+    game.effects_enabled = bool(flags & EFFECTS_ENABLED)
+    game.saved_at = saved_at
+    # Cooldowns are restored relative to the tick, so it goes first
+    game.tick = tick
+
+    walls = src.array("i")
+    for i in range(0, len(walls), 4):
+        game.add_wall(pygame.Rect(walls[i:i + 4]))
+
+    for _ in range(src.count()):
+        x, y, kind, speed, odds, payout, cooldown = src.unpack(MACHINE)
+        machine = game.add_machine(pygame.Vector2(x, y), MACHINE_TYPES[kind])
+        machine.speed_level, machine.odds_level, machine.payout_level = speed, odds, payout
+        machine.refresh_stats()
+        machine.cooldown = cooldown
+        if cooldown:
+            game.machine_index.remove(machine)
+        else:
+            game.machine_index.add(machine)
+
+    for _ in range(src.count()):
+        values = src.unpack(NPC_RECORD)
+        path = src.array("d")
+        npc = NPC.__new__(NPC)
+        npc.game = game
+        npc.pos = pygame.Vector2(values[0], values[1])
+        npc.dest = pygame.Vector2(values[2], values[3])
+        npc.state = STATE_NAMES[values[4]]
+        npc.path_index = values[5]
+        npc.target_machine = game.machines[values[6]] if values[6] >= 0 else None
+        npc.cooldown, npc.losses, npc.machines_played, npc.plays, npc.max_machines = values[7:]
+        npc.path = None
+        if path or not game.flow_fields:
+            npc.path = [pygame.Vector2(path[i], path[i + 1]) for i in range(0, len(path), 2)]
+        game.add_npc(npc)
+
+    if flags & CROWD:
+        _load_crowd(src, game.crowd)
+
+    for _ in range(src.count()):
+        x, y, r, g, b, timer, max_time, size = src.unpack(EFFECT)
+        effect = game.effects.add(pygame.Vector2(x, y), (r, g, b), max_time, size)
+        effect.timer = timer
+
+    _load_routes(src, game.nav)
+
+    for _ in range(src.count()):
+        _load_stream(src, getattr(game.rng, src.text()))
+
+    game.money = money
+    game.total_earnings = earnings
+    game.total_visitors = visitors
+    game.total_plays = plays
+    game.spawn_timer = spawn_timer
+    game.spawn_rate = int(spawn_rate) if spawn_rate.is_integer() else spawn_rate
+    game.stats_version = stats_version
+    game.layout_version = layout_version
+    return game
+
+def _load_crowd(src, crowd):
+    n = src.count()
+    crowd._grow(n)
+    crowd.goal_cells = list(src.array("i"))
+    crowd.goal_rows = {cell: row for row, cell in enumerate(crowd.goal_cells)}
+    crowd._flow_version = None
+    for field in SAVED_FIELDS:
+        target = getattr(crowd, field)
+        target[:n] = np.frombuffer(src.blob(), dtype=target.dtype, count=n)
+    crowd.count = n
+
+def _load_routes(src, nav):
+    nav.routes.clear()
+    nav.route_swept.clear()
+    nav.route_cells.clear()
+    for _ in range(src.count()):
+        sx, sy, gx, gy, count = src.unpack(ROUTE)
+        corners = src.array("h")
+        swept = src.array("h")
+        key = ((sx, sy), (gx, gy))
+        nav.routes[key] = None if count < 0 else [(corners[i], corners[i + 1]) for i in range(0, len(corners), 2)]
+        nav.route_swept[key] = cells = {(swept[i], swept[i + 1]) for i in range(0, len(swept), 2)}
+        for cell in cells:
+            nav.route_cells.setdefault(cell, set()).add(key)
+
+def _load_stream(src, stream):
+    if hasattr(stream, "block"):
+        state, inc, has_uint32, uinteger = src.unpack(PCG64_STATE)
+        block_state = {
+            "bit_generator": "PCG64",
+            "state": {"state": int.from_bytes(state, "little"), "inc": int.from_bytes(inc, "little")},
+            "has_uint32": has_uint32,
+            "uinteger": uinteger,
+        }
+        size = src.count()
+        stream.restore(block_state, size, src.count())
+    else:
+        version = src.count()
+        internal = tuple(src.array("I"))
+        gauss = src.blob()
+        stream.generator.setstate((version, internal, struct.unpack("<d", gauss)[0] if gauss else None))
+
+def fork(game, make=Simulation):
+    # An independent copy of `game` as it is right now
+    return loads(dumps(game), make)
+
+def save(game, path):
+    write_file(path, dumps(game))
+
+def write_file(path, data):
+    # Write beside the target and swap it in, so a crash mid-write never
+    # leaves a half-written save behind
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+class BackgroundFile:
+    # Wraps a binary file so that writes and flushes happen in order on a
+    # worker thread; write() only queues the bytes. close() waits for
+    # everything queued to be written. The first error writing closes the
+    # file, stops the thread and is kept in `error`; nothing more is queued
+    # after it.
+    def __init__(self, f):
+        self.f = f
+        self.error = None
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                self.f.close()
+                return
+            try:
+                if data:
+                    self.f.write(data)
+                else:
+                    self.f.flush()
+            except OSError as e:
+                self.error = e
+                try:
+                    self.f.close()
+                except OSError:
+                    pass
+                return
+
+    def write(self, data):
+        if self.error is None:
+            self.queue.put(bytes(data))
+
+    def flush(self):
+        if self.error is None:
+            self.queue.put(b"")
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+def load(path, make=Simulation, use_mmap=False):
+    # use_mmap reads the file through a memory map instead of into memory
+    # first, which pays off for very large floors and crowds
+    with open(path, "rb") as f:
+        if not use_mmap:
+            return loads(f.read(), make)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return loads(mapped, make)
+
+class Autosaver:
+    # Snapshots the game every `interval` ticks. Packing the snapshot is
+    # the only part done on the caller's thread; writing it out happens on
+    # a background thread, and a save still being written is never queued
+    # behind.
+    def __init__(self, path, interval=FPS * 60):
+        self.path = path
+        self.interval = interval
+        self.last_tick = 0
+        self.thread = None
+
+    def update(self, game):
+        if game.tick - self.last_tick < self.interval:
+            return False
+        if self.thread is not None and self.thread.is_alive():
+            return False
+        self.last_tick = game.tick
+        self.thread = threading.Thread(target=write_file, args=(self.path, dumps(game)), daemon=True)
+        self.thread.start()
+        return True
+
+    def flush(self):
+        if self.thread is not None:
+            self.thread.join()
@@ -0,0 +1,170 @@
+import argparse
+import os
+import sys
+import time
+from array import array
+from multiprocessing import Barrier, Process, shared_memory
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from simulation import Simulation, fill_floor, FPS
+
+# A resort of casino floors in a chain, simulated as shards across worker
+# processes. Visitors arrive at floor 0; whoever leaves floor i walks in to
+# floor i + 1, and leaving the last floor means leaving the resort. Each
+# floor is an ordinary headless Simulation with its own cash, upgrade
+# levels and streams (seeded seed + floor), and all the shards ever share
+# is a few running totals per floor.
+#
+# The totals are int64s in one shared memory block, FIELDS per floor, in
+# two buffers picked by tick parity. A worker steps its floors, writes
+# their rows for that tick, then waits on a barrier with the others. In the
+# next tick each floor reads the row of the floor before it from the other
+# buffer and lets in everyone who left there since it last looked. Nothing
+# rewrites a buffer until two ticks later, past another barrier, so one
+# barrier per tick is all the synchronisation there is. Arrivals always lag
+# departures by one tick, whichever shard the floors are on, so a run
+# depends on its seed and not on --workers.
+#
+#     python shards.py --floors 20 --workers 4 --ticks 3600 --machines 30
+#     python shards.py --floors 20 --workers 0 ...   # all floors in this process
+
+MONEY, EARNINGS, PLAYS, PRESENT, ARRIVED, LEFT = range(6)
+FIELDS = 6
+
+class Shard:
+    # The floors one worker runs, and its view of the resort's totals: a
+    # memoryview of int64s laid out as described above
+    def __init__(self, floors, totals, count, seed=0, machines=0, visitors=0, money=None,
+                 spawn_rate=FPS * 5, crowd=False):
+        self.totals = totals
+        self.count = count
+        self.floors = {}
+        # Departures from the floor before each one, as of its last arrivals
+        self.seen = {}
+        for floor in floors:
+            game = Simulation(crowd=crowd, seed=seed + floor)
+            game.effects_enabled = False
+            fill_floor(game, machines)
+            if money is not None:
+                game.money = money
+            if floor == 0:
+                game.spawn_rate = spawn_rate
+                if visitors:
+                    game.spawn_npc(visitors)
+            else:
+                # Visitors only ever come down from the floor before
+                game.spawn_rate = float("inf")
+            self.floors[floor] = game
+            self.seen[floor] = 0
+
+    def row(self, tick, floor):
+        return ((tick & 1) * self.count + floor) * FIELDS
+
+    def step(self, tick):
+        totals = self.totals
+        for floor, game in self.floors.items():
+            if floor:
+                left = totals[self.row(tick - 1, floor - 1) + LEFT]
+                if left > self.seen[floor]:
+                    game.spawn_npc(left - self.seen[floor])
+                    self.seen[floor] = left
+            game.step()
+            at = self.row(tick, floor)
+            present = game.visitor_count()
+            totals[at + MONEY] = game.money
+            totals[at + EARNINGS] = game.total_earnings
+            totals[at + PLAYS] = game.total_plays
+            totals[at + PRESENT] = present
+            totals[at + ARRIVED] = game.total_visitors
+            totals[at + LEFT] = game.total_visitors - present
+
+def run_worker(name, count, floors, ticks, barrier, options):
+    block = shared_memory.SharedMemory(name=name)
+    totals = block.buf.cast("q")
+    try:
+        shard = Shard(floors, totals, count, **options)
+        for tick in range(ticks):
+            shard.step(tick)
+            barrier.wait()
+    except BaseException:
+        # Let the other workers out of the barrier rather than hang them
+        barrier.abort()
+        raise
+    finally:
+        totals.release()
+        block.close()
+
+def floor_rows(totals, count, ticks):
+    # Each floor's totals after the last tick
+    rows = []
+    for floor in range(count):
+        at = (((ticks - 1) & 1) * count + floor) * FIELDS
+        rows.append(dict(zip(("money", "earnings", "plays", "present", "arrived", "left"),
+                             totals[at:at + FIELDS].tolist())))
+    return rows
+
+def run_resort(count, ticks, workers=0, **options):
+    # Runs `count` floors for `ticks` ticks and returns floor_rows(). With
+    # no workers every floor is stepped here, in one shard.
+    size = 2 * count * FIELDS
+    if not workers:
+        totals = memoryview(array("q", [0]) * size)
+        shard = Shard(range(count), totals, count, **options)
+        for tick in range(ticks):
+            shard.step(tick)
+        return floor_rows(totals, count, ticks)
+
+    workers = min(workers, count)
+    block = shared_memory.SharedMemory(create=True, size=8 * size)
+    try:
+        block.buf[:] = bytes(len(block.buf))
+        barrier = Barrier(workers)
+        processes = [Process(target=run_worker,
+                             args=(block.name, count, list(range(w, count, workers)), ticks, barrier, options))
+                     for w in range(workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        if any(process.exitcode for process in processes):
+            raise RuntimeError("a shard worker failed")
+        totals = block.buf.cast("q")
+        try:
+            return floor_rows(totals, count, ticks)
+        finally:
+            totals.release()
+    finally:
+        block.close()
+        block.unlink()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate a chain of casino floors as shards across processes")
+    parser.add_argument("--floors", type=int, default=8, help="floors in the resort")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes, each running every Nth floor (0: run them all here)")
+    parser.add_argument("--ticks", type=int, default=FPS * 60 * 10, help="ticks to run (default: ten game minutes)")
+    parser.add_argument("--machines", type=int, default=20, help="slot machines on every floor")
+    parser.add_argument("--visitors", type=int, default=100, help="visitors already at the door of floor 0")
+    parser.add_argument("--spawn-rate", type=int, default=FPS * 5, help="ticks between arrivals at floor 0")
+    parser.add_argument("--money", type=int, default=None, help="starting cash of every floor")
+    parser.add_argument("--seed", type=int, default=0, help="seed of floor 0; floor i uses seed + i")
+    parser.add_argument("--crowd", action="store_true", help="use the NumPy crowd engine on every floor")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    rows = run_resort(args.floors, args.ticks, args.workers, seed=args.seed, machines=args.machines,
+                      visitors=args.visitors, money=args.money, spawn_rate=args.spawn_rate, crowd=args.crowd)
+    elapsed = time.perf_counter() - start
+
+    print(f"{'floor':>6}{'arrived':>10}{'present':>10}{'plays':>10}{'cash':>12}{'earnings':>12}")
+    for floor, row in enumerate(rows):
+        print(f"{floor:>6}{row['arrived']:>10}{row['present']:>10}{row['plays']:>10}"
+              f"{row['money']:>12}{row['earnings']:>12}")
+    print(f"Resort: {rows[0]['arrived']} visitors, {rows[-1]['left']} gone home, "
+          f"cash ${sum(row['money'] for row in rows)}, earnings ${sum(row['earnings'] for row in rows)}")
+    print(f"{args.floors} floors x {args.ticks} ticks on {min(args.workers, args.floors) or 1} process(es) "
+          f"in {elapsed:.1f}s ({args.floors * args.ticks / elapsed:.0f} floor ticks/s)")
+
+if __name__ == "__main__":
+    sys.exit(main())
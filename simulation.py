@@ -0,0 +1,941 @@
+import pygame
+import sys
+import time
+import heapq
+from operator import attrgetter
+from enum import Enum
+
+from spatial import SpatialGrid
+from navigation import NavGrid
+from rng import RandomStreams
+from profiler import Profiler, report
+
+# The simulation only needs pygame's Vector2 and Rect, so nothing in this
+# module opens a window. main.py renders on top of a Simulation.
+
+# Simulation ticks per second of game time
+FPS = 60
+
+# Colors
+WHITE = (255, 255, 255)
+YELLOW = (255, 255, 0)
+RED = (200, 50, 50)
+GREEN = (50, 200, 50)
+BLUE = (0, 0, 200)
+PURPLE = (200, 0, 200)
+GRAY = (150, 150, 150)
+LIGHT_GRAY = (200, 200, 200)
+BLACK = (0, 0, 0)
+DARK_BG = (30, 30, 30)
+ORANGE = (255, 165, 0)
+CYAN = (0, 255, 255)
+
+# Sizes
+PLAYER_SIZE = (30, 30)
+MACHINE_SIZE = (50, 50)
+WALL_SIZE = 50
+NPC_RADIUS = 15
+NAV_CELL_SIZE = 25
+
+# Win/lose effects alive at once; past this the oldest are recycled
+EFFECT_CAPACITY = 512
+
+# Machine types with stats, costs and unlock requirements
+class MachineType(Enum):
+    SLOT = "slot"
+    ROULETTE = "roulette"
+    BLACKJACK = "blackjack"
+    POKER = "poker"
+    CRAPS = "craps"
+
+machine_types = {
+    MachineType.SLOT: {
+        "name": "Slot Machine",
+        "cost": 200,
+        "win_chance": 0.4,
+        "win_amount": 50,
+        "cooldown": 60,
+        "unlock_at": 0,
+        "color": GREEN
+    },
+    MachineType.ROULETTE: {
+        "name": "Roulette",
+        "cost": 500,
+        "win_chance": 0.3,
+        "win_amount": 150,
+        "cooldown": 90,
+        "unlock_at": 2000,
+        "color": PURPLE
+    },
+    MachineType.BLACKJACK: {
+        "name": "Blackjack",
+        "cost": 800,
+        "win_chance": 0.5,
+        "win_amount": 300,
+        "cooldown": 120,
+        "unlock_at": 5000,
+        "color": BLUE
+    },
+    MachineType.POKER: {
+        "name": "Poker Table",
+        "cost": 1200,
+        "win_chance": 0.45,
+        "win_amount": 400,
+        "cooldown": 150,
+        "unlock_at": 10000,
+        "color": ORANGE
+    },
+    MachineType.CRAPS: {
+        "name": "Craps Table",
+        "cost": 1500,
+        "win_chance": 0.35,
+        "win_amount": 500,
+        "cooldown": 180,
+        "unlock_at": 15000,
+        "color": CYAN
+    }
+}
+
+# Casino upgrades; the levels bought are per game, in Simulation.casino_levels
+casino_upgrades = {
+    "more_machines": {
+        "name": "More Machines",
+        "description": "NPCs will play up to 3 machines before leaving",
+        "cost": 3000,
+        "max_level": 3
+    },
+    "faster_cooldown": {
+        "name": "Faster Play",
+        "description": "Reduces machine cooldown by 10% per level",
+        "cost": 2000,
+        "max_level": 5
+    },
+    "better_odds": {
+        "name": "Better Odds",
+        "description": "Increases win chance by 5% per level",
+        "cost": 5000,
+        "max_level": 3
+    },
+    "higher_payouts": {
+        "name": "Higher Payouts",
+        "description": "Increases win amount by 20% per level",
+        "cost": 4000,
+        "max_level": 3
+    }
+}
+
+# Highest level of each per-machine upgrade (speed, odds, payout)
+MACHINE_UPGRADE_MAX = 3
+
+def build_stat_table(casino_levels):
+    # (win_chance, win_amount, cooldown, value) for every
+    # (MachineType, speed, odds, payout) level tuple, with the casino-wide
+    # upgrades at `casino_levels` folded in. Rebuilt whenever a casino
+    # upgrade is bought.
+    faster_cooldown = casino_levels["faster_cooldown"]
+    better_odds = casino_levels["better_odds"]
+    higher_payouts = casino_levels["higher_payouts"]
+    levels = range(MACHINE_UPGRADE_MAX + 1)
+
+    table = {}
+    for machine_type, data in machine_types.items():
+        for speed in levels:
+            cooldown = int(data["cooldown"] * (0.9 ** (speed + faster_cooldown)))
+            for odds in levels:
+                win_chance = min(data["win_chance"] + (0.05 * (odds + better_odds)), 0.9)  # Cap at 90% chance
+                for payout in levels:
+                    win_amount = int(data["win_amount"] * (1 + (0.2 * (payout + higher_payouts))))
+                    value = (win_chance * win_amount) / cooldown
+                    table[machine_type, speed, odds, payout] = (win_chance, win_amount, cooldown, value)
+    return table
+
+class MachineIndex:
+    # Idle machines ordered by expected value, best first. Entries are
+    # invalidated lazily: a machine's `index_stamp` changes whenever it goes
+    # busy or its stats change, and heap entries carrying an old stamp are
+    # discarded once they reach the top.
+    def __init__(self):
+        self.heap = []
+        self.compact_at = 64
+
+    def _push(self, machine):
+        # Ties go to the earliest placed machine, like the old linear scan
+        heapq.heappush(self.heap, (-machine.value, machine.order, machine.index_stamp, machine))
+        if len(self.heap) > self.compact_at:
+            # Stale entries below the top are never popped; drop them in bulk
+            self.heap = [entry for entry in self.heap if entry[2] == entry[3].index_stamp]
+            heapq.heapify(self.heap)
+            self.compact_at = 2 * len(self.heap) + 64
+
+    def add(self, machine):
+        machine.index_stamp += 1
+        # Worthless machines were never picked by the old scan either
+        if machine.cooldown == 0 and machine.value > 0:
+            self._push(machine)
+
+    def remove(self, machine):
+        machine.index_stamp += 1
+
+    def best(self):
+        heap = self.heap
+        while heap:
+            _, _, stamp, machine = heap[0]
+            if stamp == machine.index_stamp:
+                return machine
+            heapq.heappop(heap)
+        return None
+
+# What an NPC is doing; they end up "left" once out of the door
+NPC_STATES = ("walking_path", "to_machine", "playing", "leaving")
+
+# Slots in a TimerWheel; covers every stock machine cooldown, so entries
+# rarely go through the overflow heap
+TIMER_WHEEL_SIZE = 256
+
+# Simulation.awake is kept in this order, the order NPCs were added in
+SPAWN_ORDER = attrgetter("seq")
+
+class TimerWheel:
+    # Entities waiting for a given tick. Anything due within `size` ticks
+    # of the last tick drained sits in that tick's slot; anything later
+    # waits in a heap until it comes into range. Entries are never taken
+    # back out: whoever drains a slot checks each entity is still due then.
+    def __init__(self, size=TIMER_WHEEL_SIZE):
+        self.slots = [[] for _ in range(size)]
+        self.mask = size - 1
+        self.later = []
+        self.now = 0
+        self.count = 0
+
+    def schedule(self, tick, entity):
+        if tick - self.now <= self.mask:
+            self.slots[tick & self.mask].append(entity)
+        else:
+            # count breaks ties, as entities don't compare
+            self.count += 1
+            heapq.heappush(self.later, (tick, self.count, entity))
+
+    def due(self, tick):
+        # Everything scheduled for `tick`; called once for every tick in turn
+        self.now = tick
+        later = self.later
+        while later and later[0][0] - tick <= self.mask:
+            when, _, entity = heapq.heappop(later)
+            self.slots[when & self.mask].append(entity)
+        i = tick & self.mask
+        slot = self.slots[i]
+        if slot:
+            self.slots[i] = []
+        return slot
+
+class NPCStore:
+    # The NPCs in the casino, each in a numbered slot it keeps until it
+    # leaves. Removal is deferred to flush(), at the end of the update pass,
+    # and the NPCs of visitors who left are pooled and reused by new().
+    def __init__(self):
+        self.slots = []
+        self.free_slots = []
+        self.removed = []
+        self.pool = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for npc in self.slots:
+            if npc is not None:
+                yield npc
+
+    def new(self, game):
+        if self.pool:
+            npc = self.pool.pop()
+            npc.reset()
+            return npc
+        return NPC(game)
+
+    def add(self, npc):
+        if self.free_slots:
+            npc.slot = self.free_slots.pop()
+            self.slots[npc.slot] = npc
+        else:
+            npc.slot = len(self.slots)
+            self.slots.append(npc)
+        self.count += 1
+
+    def remove(self, npc):
+        self.removed.append(npc)
+
+    def flush(self):
+        for npc in self.removed:
+            slot = npc.slot
+            self.slots[slot] = None
+            self.free_slots.append(slot)
+            self.pool.append(npc)
+        self.count -= len(self.removed)
+        self.removed.clear()
+
+class Simulation:
+    def __init__(self, crowd=False, seed=None, flow_fields=False):
+        # Every random draw comes from these seeded streams; `seed` is the
+        # one to pass back in to replay this run (picked fresh when None)
+        self.rng = RandomStreams(seed)
+        self.seed = self.rng.seed
+        # Wall-clock time of the save this game was loaded from, if any
+        self.saved_at = None
+        # Event log recording every state change (replay.EventLog), if any
+        self.log = None
+        # Frame profiler timing each phase of step (profiler.Profiler), if any
+        self.profiler = None
+        # Time series sampled every few ticks (metrics.Metrics), if any
+        self.metrics = None
+
+        # Game objects
+        self.casino_rect = pygame.Rect(50, 300, 700, 200)
+        self.money = 1000
+        self.total_earnings = 0
+        self.total_visitors = 0
+        self.total_plays = 0
+        self.machines = []
+        self.npcs = NPCStore()
+        self.walls = []
+        # Cooldowns are scheduled rather than counted down every tick:
+        # machines wake up (rejoin the index) on the tick their cooldown
+        # ends, and NPCs waiting out a machine's cooldown are left out of
+        # `awake`, the NPCs updated each tick, until their next play is due
+        self.machine_wakeups = TimerWheel()
+        self.npc_wakeups = TimerWheel()
+        self.awake = []
+        self.awake_changed = False
+        self.npc_count = 0
+        # Bumped whenever a machine or wall is placed; the renderer rebuilds
+        # its static floor layer when it changes
+        self.layout_version = 0
+        self.machine_counts = {machine_type: 0 for machine_type in MachineType}
+        # Running tallies, kept up to date as things change rather than
+        # recounted: machines on cooldown per type, NPCs per state, and per
+        # machine type the NPCs walking to (queued) and playing (seated) one
+        self.busy_counts = {machine_type: 0 for machine_type in MachineType}
+        self.npc_states = dict.fromkeys(NPC_STATES, 0)
+        self.machine_npcs = {state: {machine_type: 0 for machine_type in MachineType}
+                             for state in ("to_machine", "playing")}
+        self.machine_index = MachineIndex()
+        # Machines and walls, bucketed for overlap checks and hit-testing
+        self.grid = SpatialGrid(WALL_SIZE)
+        # Walkable floor for NPC routing; machines and walls block it. With
+        # flow_fields NPCs steer by per-destination flow fields instead of
+        # following individual A* routes.
+        self.nav = NavGrid(self.casino_rect, NAV_CELL_SIZE, NPC_RADIUS)
+        self.flow_fields = flow_fields
+
+        # Casino upgrade levels bought, by casino_upgrades key
+        self.casino_levels = dict.fromkeys(casino_upgrades, 0)
+        # Derived machine stats; stats_version changes whenever any machine's
+        # stats or the set of machines change
+        self.stat_table = build_stat_table(self.casino_levels)
+        self.stats_version = 0
+
+        # Paths for NPCs
+        self.paths = [
+            [pygame.Vector2(x, 480) for x in range(100, 700, 50)],
+            [pygame.Vector2(x, 420) for x in range(100, 700, 50)],
+            [pygame.Vector2(x, 360) for x in range(100, 700, 50)],
+        ]
+        self.exit_point = pygame.Vector2(750, 480)
+
+        # Animation effects (purely visual; headless runs switch them off)
+        self.effects = EffectRing()
+        self.effects_enabled = True
+
+        # Spawn timer
+        self.spawn_timer = 0
+        self.spawn_rate = FPS * 5  # 5 seconds
+
+        # Number of simulation steps taken so far
+        self.tick = 0
+
+        # Optional array-backed crowd engine replacing the NPC objects
+        self.crowd = None
+        if crowd:
+            from crowd import CrowdEngine
+            self.crowd = CrowdEngine(self)
+
+    def route(self, start, dest):
+        # Waypoints around walls and machines, cached by the nav grid
+        return self.nav.route(start, dest)
+
+    def shortest_path_to_exit(self, npc_pos):
+        return self.route(npc_pos, self.exit_point), 0
+
+    def add_effect(self, pos, color, duration=30, size=15):
+        if not self.effects_enabled:
+            return
+        self.effects.add(pos, color, duration, size)
+
+    def update_effects(self):
+        self.effects.update()
+
+    def spawn_npc(self, count=1):
+        if self.crowd is not None:
+            self.crowd.spawn(count)
+        else:
+            for _ in range(count):
+                self.add_npc(self.npcs.new(self))
+        self.total_visitors += count
+        if self.log is not None:
+            self.log.spawn(self, count)
+
+    def add_npc(self, npc):
+        # NPCs are updated in the order they were added
+        npc.seq = self.npc_count
+        self.npc_count += 1
+        self.npcs.add(npc)
+        self.npc_states[npc.state] += 1
+        if npc.state in self.machine_npcs:
+            self.machine_npcs[npc.state][npc.target_machine.type] += 1
+        if npc.state == "playing" and npc.wake_at > self.tick:
+            self.npc_wakeups.schedule(npc.wake_at, npc)
+        else:
+            self.awake.append(npc)
+
+    def visitor_count(self):
+        if self.crowd is not None:
+            return len(self.crowd)
+        return len(self.npcs)
+
+    def place_machine(self, pos, machine_type):
+        cost = machine_types[machine_type]["cost"]
+        pos_rect = pygame.Rect(pos.x, pos.y, *MACHINE_SIZE)
+
+        # Check if position is valid (inside casino and not overlapping walls or other machines)
+        if (self.casino_rect.contains(pos_rect) and
+            self.money >= cost and
+            not self.grid.query_rect(pos_rect)):
+
+            self.add_machine(pos, machine_type)
+            self.money -= cost
+            if self.log is not None:
+                self.log.place_machine(self, pos, machine_type, cost)
+            return True
+        return False
+
+    def add_machine(self, pos, machine_type):
+        # Put a machine on the floor, unchecked and free (loading a save)
+        machine = Machine(self, pygame.Vector2(pos), machine_type)
+        machine.order = len(self.machines)
+        self.machines.append(machine)
+        self.machine_counts[machine_type] += 1
+        pos_rect = pygame.Rect(machine.pos.x, machine.pos.y, *MACHINE_SIZE)
+        self.grid.insert(machine, pos_rect)
+        self.nav.block(pos_rect)
+        self.machine_index.add(machine)
+        self.stats_version += 1
+        self.layout_version += 1
+        return machine
+
+    def place_wall(self, pos):
+        pos_rect = pygame.Rect(pos.x, pos.y, *MACHINE_SIZE)
+        cost = 100
+
+        # Check if position is valid (inside casino and not overlapping machines or other walls)
+        if (self.casino_rect.contains(pos_rect) and
+            self.money >= cost and
+            not self.grid.query_rect(pos_rect)):
+
+            self.add_wall(pos_rect)
+            self.money -= cost
+            if self.log is not None:
+                self.log.place_wall(self, pos, cost)
+            return True
+        return False
+
+    def add_wall(self, rect):
+        self.walls.append(rect)
+        self.grid.insert(rect, rect)
+        self.nav.block(rect)
+        self.layout_version += 1
+
+    def machine_at(self, pos):
+        for item in self.grid.query_point(pos):
+            if isinstance(item, Machine):
+                return item
+        return None
+
+    def buy_casino_upgrade(self, upgrade_key):
+        upgrade = casino_upgrades[upgrade_key]
+        level = self.casino_levels[upgrade_key]
+        if level < upgrade["max_level"]:
+            cost = upgrade["cost"] * (level + 1)
+            if self.money >= cost:
+                self.money -= cost
+                self.casino_levels[upgrade_key] = level + 1
+                self.refresh_machine_stats()
+                if self.log is not None:
+                    self.log.casino_upgrade(self, upgrade_key, cost)
+                return True
+        return False
+
+    def set_casino_levels(self, levels):
+        # Start from other casino upgrade levels, free of charge
+        self.casino_levels.update(levels)
+        self.refresh_machine_stats()
+
+    def refresh_machine_stats(self):
+        self.stat_table = build_stat_table(self.casino_levels)
+        for machine in self.machines:
+            machine.refresh_stats()
+            self.machine_index.add(machine)
+        self.stats_version += 1
+
+    def step(self):
+        log = self.log
+        if log is not None:
+            log.begin_step()
+        prof = self.profiler
+
+        # Spawn NPCs periodically
+        self.spawn_timer += 1
+        if self.spawn_timer > self.spawn_rate:
+            self.spawn_npc()
+            self.spawn_timer = 0
+
+        # Update NPCs; those due to play again this tick wake up first
+        if self.crowd is not None:
+            self.crowd.update()
+        tick = self.tick
+        awake = self.awake
+        due = self.npc_wakeups.due(tick)
+        if due:
+            awake += [npc for npc in due if npc.wake_at == tick and npc.state == "playing"]
+            awake.sort(key=SPAWN_ORDER)
+        for npc in awake:
+            npc.update()
+        if self.awake_changed:
+            # Drop the ones that left or started waiting out a cooldown
+            self.awake = [npc for npc in awake
+                          if npc.state != "left" and (npc.state != "playing" or npc.wake_at <= tick)]
+            self.awake_changed = False
+        self.npcs.flush()
+        if prof is not None:
+            prof.lap("npcs")
+
+        # Update effects
+        self.update_effects()
+        if prof is not None:
+            prof.lap("effects")
+
+        self.tick += 1
+
+        # Machines whose cooldown is over go back into the index
+        for machine in self.machine_wakeups.due(self.tick):
+            if machine.free_at == self.tick:
+                self.machine_index.add(machine)
+                self.busy_counts[machine.type] -= 1
+        if prof is not None:
+            prof.lap("cooldowns")
+        metrics = self.metrics
+        if metrics is not None and self.tick % metrics.interval == 0:
+            metrics.sample(self)
+            if prof is not None:
+                prof.lap("metrics")
+        if log is not None:
+            log.end_step(self)
+            if prof is not None:
+                prof.lap("recording")
+
+    def advance(self, ticks):
+        for _ in range(ticks):
+            self.step()
+
+class Effect:
+    __slots__ = ("pos", "color", "timer", "max_time", "size")
+
+    def __init__(self, pos, color, duration, size):
+        self.pos = pos
+        self.color = color
+        self.timer = duration
+        self.max_time = duration
+        self.size = size
+
+class EffectRing:
+    # Fixed-capacity ring buffer of Effects, oldest first. The Effect objects
+    # are allocated once and reused; expired ones are dropped from the head,
+    # and when the ring is full a new effect takes the oldest one's slot.
+    # Iterating yields the live effects.
+    def __init__(self, capacity=EFFECT_CAPACITY):
+        self.slots = [Effect(pygame.Vector2(), WHITE, 0, 0) for _ in range(capacity)]
+        self.capacity = capacity
+        self.head = 0
+        self.count = 0
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __iter__(self):
+        for effect in self._window():
+            if effect.timer > 0:
+                yield effect
+
+    def _window(self):
+        slots, capacity, head = self.slots, self.capacity, self.head
+        end = head + self.count
+        if end <= capacity:
+            return slots[head:end]
+        return slots[head:] + slots[:end - capacity]
+
+    def add(self, pos, color, duration, size):
+        if self.count == self.capacity:
+            self.head = (self.head + 1) % self.capacity
+            self.count -= 1
+        effect = self.slots[(self.head + self.count) % self.capacity]
+        effect.pos.update(pos)
+        effect.color = color
+        effect.timer = duration
+        effect.max_time = duration
+        effect.size = size
+        self.count += 1
+        return effect
+
+    def update(self):
+        for effect in self._window():
+            effect.timer -= 1
+        # Effects mostly share a duration, so they expire from the head
+        while self.count and self.slots[self.head].timer <= 0:
+            self.head = (self.head + 1) % self.capacity
+            self.count -= 1
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+# Per-machine upgrades, stored on the machine as `<type>_level` ints
+UPGRADE_TYPES = ("speed", "odds", "payout")
+
+class Machine:
+    __slots__ = ("game", "pos", "type", "free_at", "order", "index_stamp",
+                 "speed_level", "odds_level", "payout_level",
+                 "win_chance", "win_amount", "cooldown_time", "value")
+
+    def __init__(self, game, pos, machine_type):
+        self.game = game
+        self.pos = pos
+        self.type = machine_type
+        self.cooldown = 0
+        # Position in game.machines and MachineIndex bookkeeping
+        self.order = 0
+        self.index_stamp = 0
+        self.speed_level = 0
+        self.odds_level = 0
+        self.payout_level = 0
+        self.refresh_stats()
+
+    @property
+    def data(self):
+        return machine_types[self.type]
+
+    @property
+    def cooldown(self):
+        # Ticks until the machine is free; free_at is the tick it frees up
+        return max(self.free_at - self.game.tick, 0)
+
+    @cooldown.setter
+    def cooldown(self, ticks):
+        game = self.game
+        free_at = game.tick + ticks
+        if ticks > 0:
+            if self.free_at <= game.tick:
+                game.busy_counts[self.type] += 1
+            # Played twice in one tick: it's already down to wake up then
+            if free_at != self.free_at:
+                game.machine_wakeups.schedule(free_at, self)
+        self.free_at = free_at
+
+    def level(self, upgrade_type):
+        return getattr(self, upgrade_type + "_level")
+
+    def refresh_stats(self):
+        # Cached from game.stat_table; only upgrades change these
+        key = (self.type, self.speed_level, self.odds_level, self.payout_level)
+        self.win_chance, self.win_amount, self.cooldown_time, self.value = self.game.stat_table[key]
+
+    def get_win_chance(self):
+        return self.win_chance
+
+    def get_win_amount(self):
+        return self.win_amount
+
+    def get_cooldown(self):
+        return self.cooldown_time
+
+    def can_upgrade(self, upgrade_type):
+        return self.level(upgrade_type) < MACHINE_UPGRADE_MAX
+
+    def upgrade_cost(self, upgrade_type):
+        return 500 * (self.level(upgrade_type) + 1)
+
+    def upgrade(self, upgrade_type):
+        if self.can_upgrade(upgrade_type):
+            cost = self.upgrade_cost(upgrade_type)
+            if self.game.money >= cost:
+                self.game.money -= cost
+                setattr(self, upgrade_type + "_level", self.level(upgrade_type) + 1)
+                self.refresh_stats()
+                self.game.machine_index.add(self)
+                self.game.stats_version += 1
+                if self.game.log is not None:
+                    self.game.log.machine_upgrade(self.game, self, upgrade_type, cost)
+                return True
+        return False
+
+    def start_cooldown(self):
+        self.cooldown = self.cooldown_time
+        self.game.machine_index.remove(self)
+
+class NPC:
+    __slots__ = ("game", "path", "path_index", "dest", "pos", "state", "target_machine",
+                 "wake_at", "seq", "slot", "losses", "machines_played", "plays", "max_machines")
+
+    speed = 1.5
+
+    def __init__(self, game):
+        self.game = game
+        self.pos = pygame.Vector2()
+        self.seq = 0
+        self.slot = -1
+        self.reset()
+
+    def reset(self):
+        # Start out as a new visitor; NPCStore reuses the NPCs of ones who left
+        game = self.game
+        # Enter along a random lane, detouring around anything built on it
+        lane = game.paths[game.rng.spawns.index(len(game.paths))]
+        self.pos.update(lane[0])
+        self.head_to(lane[-1])
+        # One of NPC_STATES; changed through set_state once the NPC is added
+        self.state = "walking_path"
+        self.target_machine = None
+        self.cooldown = 0
+        self.losses = 0
+        self.machines_played = 0
+        self.plays = 0
+        self.max_machines = 2 + game.casino_levels["more_machines"]
+
+    @property
+    def cooldown(self):
+        # Ticks until the next play; wake_at is the tick it's due on
+        return max(self.wake_at - self.game.tick, 0)
+
+    @cooldown.setter
+    def cooldown(self, ticks):
+        self.wake_at = self.game.tick + ticks
+
+    def set_state(self, state, machine=None):
+        # Move to `state` (and `machine`, if given) in the game's tallies
+        game = self.game
+        game.npc_states[self.state] -= 1
+        game.npc_states[state] += 1
+        machine_npcs = game.machine_npcs
+        if self.state in machine_npcs:
+            machine_npcs[self.state][self.target_machine.type] -= 1
+        if machine is not None:
+            self.target_machine = machine
+        if state in machine_npcs:
+            machine_npcs[state][self.target_machine.type] += 1
+        self.state = state
+
+    def update(self):
+        if self.state == "walking_path":
+            self.walk_path()
+        elif self.state == "to_machine":
+            self.move_to_machine()
+        elif self.state == "playing":
+            self.play_machine()
+        elif self.state == "leaving":
+            self.leave_casino()
+
+    def head_to(self, dest):
+        self.dest = dest
+        self.path_index = 0
+        self.path = None if self.game.flow_fields else self.game.route(self.pos, dest)
+
+    def advance(self):
+        # Move one tick towards self.dest; True once it has been reached
+        if self.path is None:
+            return self.steer()
+        return self.follow_path()
+
+    def steer(self):
+        target, final = self.game.nav.flow_target(self.pos, self.dest)
+        direction = target - self.pos
+        if direction.length() > self.speed:
+            self.pos += direction.normalize() * self.speed
+            return False
+        if final:
+            return True
+        self.pos.update(target)
+        return False
+
+    def follow_path(self):
+        if self.path_index < len(self.path) - 1:
+            target = self.path[self.path_index + 1]
+            direction = target - self.pos
+            if direction.length() > self.speed:
+                self.pos += direction.normalize() * self.speed
+            else:
+                self.path_index += 1
+            return False
+        return True
+
+    def walk_path(self):
+        if self.advance():
+            # Choose machine or leave if no machines or not enough money
+            if self.game.machines and self.game.money >= 50:
+                self.choose_machine()
+            else:
+                self.set_state("leaving")
+                self.set_exit_path()
+
+    def choose_machine(self):
+        # AI: Choose the idle machine with the best value (win_chance * win_amount / cooldown)
+        best_machine = self.game.machine_index.best()
+
+        if best_machine:
+            self.set_state("to_machine", best_machine)
+            self.head_to(best_machine.pos)
+        else:
+            self.set_state("leaving")
+            self.set_exit_path()
+
+    def move_to_machine(self):
+        if self.advance():
+            self.set_state("playing")
+            self.cooldown = 0
+            self.losses = 0
+            self.plays = 0
+
+    def play_machine(self):
+        # Only called once any cooldown is over; the NPC sleeps through it
+        cost_to_play = 50
+        game = self.game
+
+        if game.money >= cost_to_play:
+            game.money -= cost_to_play
+            game.total_plays += 1
+        else:
+            self.set_state("leaving")
+            self.set_exit_path()
+            return
+
+        # Machine stats with upgrades applied
+        machine = self.target_machine
+        win_amount = machine.win_amount
+        machine.start_cooldown()
+
+        won = game.rng.outcomes.random() < machine.win_chance
+        if won:
+            game.money += win_amount
+            game.total_earnings += win_amount - cost_to_play
+            self.losses = 0
+            game.add_effect(self.pos, GREEN)  # Win effect
+        else:
+            game.total_earnings -= cost_to_play
+            self.losses += 1
+            game.add_effect(self.pos, RED)  # Lose effect
+        if game.log is not None:
+            game.log.play(game, machine, won, win_amount if won else 0)
+
+        self.plays += 1
+        # Play again the tick after the machine frees up
+        self.wake_at = game.tick + machine.cooldown + 1
+
+        # Check if NPC should leave or try another machine
+        if self.losses >= 3:
+            self.machines_played += 1
+            if self.machines_played >= self.max_machines:
+                self.set_state("leaving")
+                self.set_exit_path()
+            else:
+                self.choose_machine()
+                self.losses = 0
+                self.plays = 0
+        if self.state == "playing":
+            game.npc_wakeups.schedule(self.wake_at, self)
+            game.awake_changed = True
+
+    def leave_casino(self):
+        if self.advance():
+            self.game.npcs.remove(self)
+            # Out of the tallies, until NPCStore reuses it for a new visitor
+            self.game.npc_states["leaving"] -= 1
+            self.state = "left"
+            self.game.awake_changed = True
+
+    def set_exit_path(self):
+        self.head_to(self.game.exit_point)
+
+def fill_floor(game, count, machine_type=MachineType.SLOT):
+    # Place up to `count` machines on a MACHINE_SIZE grid, row by row
+    placed = 0
+    rect = game.casino_rect
+    for y in range(rect.top, rect.bottom - MACHINE_SIZE[1] + 1, MACHINE_SIZE[1]):
+        for x in range(rect.left, rect.right - MACHINE_SIZE[0] + 1, MACHINE_SIZE[0]):
+            if placed >= count:
+                return placed
+            game.money += machine_types[machine_type]["cost"]
+            if game.place_machine(pygame.Vector2(x, y), machine_type):
+                placed += 1
+            else:
+                game.money -= machine_types[machine_type]["cost"]
+    return placed
+
+def run_headless(ticks, seed=None, crowd=0, machines=0, flow_fields=False, profiler=None):
+    # With a profiler every tick is profiled as one frame
+    game = Simulation(crowd=crowd > 0, seed=seed, flow_fields=flow_fields)
+    game.effects_enabled = False
+    fill_floor(game, machines)
+    if crowd:
+        game.spawn_npc(crowd)
+    if profiler is None:
+        game.advance(ticks)
+        return game
+    game.profiler = profiler
+    profiler.begin_frame()
+    for _ in range(ticks):
+        game.step()
+        profiler.end_frame(game)
+    return game
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the casino simulation without a window")
+    parser.add_argument("--ticks", type=int, default=FPS * 60 * 60, help="simulation ticks to run (default: one game hour)")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the simulation's random streams")
+    parser.add_argument("--machines", type=int, default=0, help="slot machines to place on the floor first")
+    parser.add_argument("--crowd", type=int, default=0, metavar="N",
+                        help="use the NumPy crowd engine, starting with N visitors")
+    parser.add_argument("--flow", action="store_true", help="route NPCs with flow fields")
+    parser.add_argument("--profile", default=None, metavar="PATH",
+                        help="profile every tick and write the trace there (.csv or .json)")
+    args = parser.parse_args(argv)
+
+    profiler = None
+    if args.profile:
+        profiler = Profiler(window=args.ticks)
+    start = time.perf_counter()
+    game = run_headless(args.ticks, args.seed, args.crowd, args.machines, args.flow, profiler)
+    elapsed = time.perf_counter() - start
+
+    print(f"Seed: {game.seed}")
+    print(f"Ticks: {game.tick} ({game.tick / max(elapsed, 1e-9):.0f} ticks/s)")
+    print(f"Cash: ${game.money}")
+    print(f"Total Earnings: ${game.total_earnings}")
+    print(f"Total Visitors: {game.total_visitors}")
+    print(f"Current Visitors: {game.visitor_count()}")
+    if profiler is not None:
+        print()
+        print("\n".join(report(profiler)))
+        profiler.export(args.profile)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,45 @@
+import pygame
+
+# Uniform spatial hash for the static floor layout (machines and walls),
+# serving the placement overlap checks and click hit-tests. Each item is
+# bucketed into every cell its rect touches, so with a cell size matching the
+# item size a rect lives in at most four cells and overlap and point queries
+# only look at a handful of buckets however large the floor. Items are
+# tracked by identity, so unhashable ones (wall Rects) work. Nothing built is
+# ever removed, so neither is anything here.
+
+class SpatialGrid:
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.rects = {}
+
+    def _cells(self, rect):
+        size = self.cell_size
+        for cx in range(rect.left // size, (rect.right - 1) // size + 1):
+            for cy in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                yield cx, cy
+
+    def __len__(self):
+        return len(self.rects)
+
+    def insert(self, item, rect):
+        rect = pygame.Rect(rect)
+        self.rects[id(item)] = rect
+        for cell in self._cells(rect):
+            self.cells.setdefault(cell, []).append(item)
+
+    def query_rect(self, rect):
+        # Items whose rect overlaps `rect` (touching edges don't count)
+        rect = pygame.Rect(rect)
+        found = {}
+        for cell in self._cells(rect):
+            for item in self.cells.get(cell, ()):
+                if id(item) not in found and self.rects[id(item)].colliderect(rect):
+                    found[id(item)] = item
+        return list(found.values())
+
+    def query_point(self, pos):
+        size = self.cell_size
+        bucket = self.cells.get((int(pos[0]) // size, int(pos[1]) // size), ())
+        return [item for item in bucket if self.rects[id(item)].collidepoint(pos)]